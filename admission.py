@@ -0,0 +1,147 @@
+"""
+Контроль допуска загрузок: ограничение частоты запросов клиента (token bucket по
+IP из X-Real-IP от nginx) и общий лимит одновременных загрузок. Решение принимается
+по заголовкам, до чтения тела запроса.
+"""
+
+import ipaddress
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+UPLOAD_RATE = float(os.environ.get("UPLOAD_RATE", "2"))  # запросов загрузки в секунду на клиента; 0 - без ограничения
+UPLOAD_BURST = float(os.environ.get("UPLOAD_BURST", "10"))  # запросов подряд сверх средней частоты
+MAX_CONCURRENT_UPLOADS = int(os.environ.get("MAX_CONCURRENT_UPLOADS", "16"))  # на все процессы; 0 - без ограничения
+UPLOAD_RETRY_AFTER = int(os.environ.get("UPLOAD_RETRY_AFTER", "1"))  # секунды, для ответа 503
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Адреса, от которых принимается X-Real-IP (nginx); порт 8000 открыт и напрямую
+TRUSTED_PROXIES = os.environ.get(
+    "TRUSTED_PROXIES", "127.0.0.1/32,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16"
+)
+
+
+def _parse_networks(value: str) -> tuple:
+    return tuple(ipaddress.ip_network(item.strip(), strict=False)
+                 for item in value.split(",") if item.strip())
+
+
+_TRUSTED_NETWORKS = _parse_networks(TRUSTED_PROXIES)
+
+
+def _parse_ip(value: str):
+    try:
+        return ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+
+
+def client_ip(peer: str, real_ip: str = None) -> str:
+    """IP клиента: X-Real-IP, если соединение пришло от доверенного прокси, иначе адрес соединения."""
+    peer_address = _parse_ip(peer)
+    if real_ip and peer_address is not None \
+            and any(peer_address in network for network in _TRUSTED_NETWORKS):
+        address = _parse_ip(real_ip)
+        if address is not None:
+            return str(address)
+    return peer
+
+
+class RateLimiter:
+    """
+    Token bucket на клиента: запас пополняется на rate в секунду до burst, каждый запрос
+    забирает один токен. Хранится не больше max_clients клиентов (давно не приходившие
+    вытесняются - их запас к этому времени обычно уже полный). Лимит действует в пределах
+    процесса: в режиме prefork клиент может получить до SERVER_PROCESSES x rate.
+    """
+
+    def __init__(self, rate: float = UPLOAD_RATE, burst: float = UPLOAD_BURST,
+                 max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # клиент -> (токены, время пополнения)
+        self._limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str) -> float:
+        """Забирает токен клиента. Возвращает 0 или через сколько секунд появится следующий токен."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+                self._limited += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "rate": self.rate, "burst": self.burst,
+                    "clients": len(self._buckets), "limited": self._limited}
+
+
+class UploadSlots:
+    """
+    Лимит одновременных загрузок. Семафор создается при импорте, до fork, поэтому в
+    режиме prefork он общий для всех процессов. Занятый слот держится от проверки
+    заголовков до ответа, включая чтение тела.
+    """
+
+    def __init__(self, limit: int = MAX_CONCURRENT_UPLOADS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._active = 0  # загрузки этого процесса
+        self._rejected = 0
+        self._semaphore = None
+        if limit > 0:
+            try:
+                self._semaphore = multiprocessing.BoundedSemaphore(limit)
+            except (OSError, ImportError) as e:
+                # Нет POSIX семафоров (например, без /dev/shm): лимит на процесс
+                logger.warning(f"Shared upload semaphore is not available, limit is per process: {e}")
+                self._semaphore = threading.BoundedSemaphore(limit)
+
+    def try_acquire(self) -> bool:
+        """Занимает слот без ожидания. False - все слоты заняты."""
+        if self._semaphore is not None and not self._semaphore.acquire(False):
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._active += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": self.limit, "active": self._active, "rejected": self._rejected}
+
+
+def retry_after(wait: float) -> str:
+    """Значение заголовка Retry-After (целые секунды, не меньше 1)."""
+    return str(max(1, math.ceil(wait)))
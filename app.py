@@ -1,29 +1,71 @@
 import os
+import re
 import json
+import logging
+import uuid
 import datetime
-import psycopg2
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import unquote, parse_qs
-from io import BytesIO
-from PIL import Image
+from psycopg2.extras import execute_values
 
 # Импорт настроек логгера
-from logger_config import get_logger
+from logger_config import (
+    DroppingQueueHandler, end_request, get_logger, request_stages, start_request
+)
+from admission import UPLOAD_RETRY_AFTER, RateLimiter, UploadSlots, client_ip, retry_after
+from content_store import blob_relpath, count_references, delete_unreferenced, lock_blob
+from job_queue import (
+    UPLOAD_JOBS, JobQueue, delete_jobs, enqueue_jobs, job_statuses
+)
+from hot_cache import CachedFile, HotFileCache
+from image_search import (
+    SEARCH_COUNT_LIMIT, SearchParamsError, count_query, list_query, parse_filters
+)
+from list_cache import ListResponseCache
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_REQUEST_BYTES, HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS, HTTP_RESPONSE_BYTES, NEAR_DUPLICATE_REJECTIONS, REGISTRY, UPLOAD_REJECTIONS,
+    UPLOAD_STAGE_DURATION, VARIANT_BYTES_SAVED, VARIANT_RESPONSES, timed
+)
+from image_processing import (
+    ImageJobTimeoutError, ImageProcessingError, ImageProcessor, ImageQueueFullError,
+    ImageRejectedError
+)
+from file_response import (
+    CACHE_CONTROL_HTML, CACHE_CONTROL_IMMUTABLE, RangeNotSatisfiable, etag_matches, http_date,
+    is_not_modified, make_etag, multipart_byteranges, parse_range, range_applies
+)
+from pagination import (
+    PaginationParamsError, decode_cursor, encode_cursor, parse_limit, parse_page
+)
+from near_duplicates import (
+    DEFAULT_SIMILAR_RESULTS, MAX_SIMILAR_RESULTS, NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_MODE,
+    SimilarParamsError, find_similar, image_phash, parse_distance, to_db
+)
+from multipart_parser import (
+    MultipartReader, MultipartError, FileTooLargeError, UploadedFile, save_part_to_temp
+)
+from readiness import ReadinessMonitor
+from schema import init_database, schema_state
+from server_runner import run_server
+from services import DB_CONFIG, UPLOAD_DIR, db_pool, get_db_connection, storage
+from storage import StorageError, is_hidden_key, is_safe_key
+from transcoding import VARIANT_FORMATS, Transcoder, negotiate
+from thumbnails import (
+    THUMBNAIL_FORMATS, ThumbnailCache, ThumbnailParamsError, parse_thumbnail_params, thumbnail_url
+)
 
 # Константы
-UPLOAD_DIR = "/app/image"
+STATIC_DIR = "/app/static"
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 МБ
+MULTIPART_OVERHEAD = 64 * 1024  # запас на заголовки и boundary multipart тела
+MAX_BATCH_FILES = 100
+MAX_BATCH_BODY_SIZE = 100 * 1024 * 1024  # 100 МБ на один пакетный запрос
 ALLOWED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
 ITEMS_PER_PAGE = 10
-
-# Настройки базы данных
-DB_CONFIG = {
-    "dbname": "images_db",
-    "user": "postgres",
-    "password": "password",
-    "host": "db",
-    "port": "5432"
-}
+MAX_ITEMS_PER_PAGE = 100
 
 # Единый словарь для MIME-типов
 CONTENT_TYPES = {
@@ -39,6 +81,13 @@ CONTENT_TYPES = {
     ".webp": "image/webp"
 }
 
+# CORS заголовки всех ответов
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS, DELETE",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+
 # Создание необходимых директорий
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -46,45 +95,140 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 logger = get_logger()
 
 
-def get_db_connection():
-    """Создает подключение к базе данных."""
-    return psycopg2.connect(**DB_CONFIG)
+# Пул процессов для проверки и обработки изображений (декодирование не держит GIL обработчиков)
+image_processor = ImageProcessor()
 
+# Потоки, ожидающие проверки файлов пакетной загрузки в пуле процессов
+validation_executor = ThreadPoolExecutor(max_workers=image_processor.workers,
+                                         thread_name_prefix="validate")
 
-def init_database():
-    """Инициализирует базу данных и создает таблицы."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+# Кеш готовых ответов /images-list (инвалидация через LISTEN/NOTIFY)
+list_cache = ListResponseCache(DB_CONFIG)
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS images (
-                id SERIAL PRIMARY KEY,
-                filename TEXT NOT NULL UNIQUE,
-                original_name TEXT NOT NULL,
-                size INTEGER NOT NULL,
-                upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                file_type TEXT NOT NULL
-            )
-        """)
+# Дисковый кеш уменьшенных копий изображений
+thumbnail_cache = ThumbnailCache(processor=image_processor)
 
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_upload_time 
-            ON images(upload_time DESC)
-        """)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logger.info("Database initialized successfully")
-    except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
-        # Не прерываем выполнение, продолжаем работу
+# Содержимое часто запрашиваемых файлов (статика, свежие изображения) в памяти
+hot_cache = HotFileCache()
+
+# Перекодирование оригиналов в WebP/AVIF (TRANSCODE_FORMATS); выполняется исполнителем worker.py
+transcoder = Transcoder(image_processor, storage, db_pool.connection, on_change=list_cache.invalidate)
+
+# Контроль допуска загрузок: частота запросов клиента и общий лимит одновременных загрузок
+upload_rate_limiter = RateLimiter()
+upload_slots = UploadSlots()
+
+# Фоновая проверка базы данных для /readyz и /health (пробы не открывают подключений)
+readiness = ReadinessMonitor(DB_CONFIG, prepare=lambda: init_database())
+
+# Время этапов запуска сервера, мс (заполняется в __main__)
+startup_state = {}
+
+# Очередь фоновых задач после загрузки (исполнитель - worker.py)
+job_queue = JobQueue(db_pool.connection)
+
+
+def upload_jobs() -> list:
+    """Задачи после загрузки; transcode - если в сборке Pillow есть кодировщики (проверяется один раз)."""
+    return [job_type for job_type in UPLOAD_JOBS if job_type != "transcode" or transcoder.enabled]
+
+
+# Методы, различаемые в метриках (остальные - "other")
+METRICS_METHODS = ("GET", "POST", "DELETE", "OPTIONS")
+
+# Допустимый X-Request-ID от nginx или клиента
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def collect_component_stats() -> dict:
+    """Статистика пулов подключений, обработки изображений и кешей для /metrics."""
+    pool = db_pool.stats()
+    processing = image_processor.stats()
+    stats = {
+        "db_pool_connections": ("gauge", "Open PostgreSQL connections", pool["size"]),
+        "db_pool_connections_in_use": ("gauge", "PostgreSQL connections checked out",
+                                       pool["in_use"]),
+        "db_pool_checkout_waits_total": ("counter", "Checkouts that had to wait", pool["waits"]),
+        "db_pool_checkout_timeouts_total": ("counter", "Checkouts that timed out",
+                                            pool["timeouts"]),
+        "image_processing_queue_depth": ("gauge", "Image jobs queued or running",
+                                         processing["queue_depth"]),
+        "image_processing_jobs_total": ("counter", "Image jobs finished (completed or invalid)",
+                                        processing["completed"] + processing["invalid"]),
+        "image_processing_rejected_total": ("counter", "Image jobs rejected by a full queue",
+                                            processing["rejected"]),
+        "image_processing_seconds_total": ("counter", "Time spent processing image jobs",
+                                           processing["processing_seconds_total"]),
+        "image_processing_wait_seconds_total": ("counter", "Time image jobs waited in the queue",
+                                                processing["wait_seconds_total"]),
+        "log_records_dropped_total": ("counter", "Log records dropped by a full logging queue",
+                                      DroppingQueueHandler.dropped),
+    }
+    try:
+        jobs = job_queue.counts()
+    except Exception:
+        jobs = None
+    if jobs is not None:
+        # Счетчики таблицы jobs общие для всех процессов: не суммируются в /metrics
+        stats.update({
+            "jobs_queued": ("gauge", "Background jobs waiting to run", jobs["queued"], "max"),
+            "jobs_running": ("gauge", "Background jobs being run by workers", jobs["running"],
+                             "max"),
+            "jobs_failed": ("gauge", "Background jobs that failed permanently", jobs["failed"],
+                            "max"),
+        })
+    hot = hot_cache.stats()
+    stats.update({
+        "hot_cache_hits_total": ("counter", "Files served from the in-memory cache", hot["hits"]),
+        "hot_cache_misses_total": ("counter", "Files read from disk", hot["misses"]),
+        "hot_cache_evictions_total": ("counter", "Files evicted from the in-memory cache",
+                                      hot["evictions"]),
+        "hot_cache_bytes": ("gauge", "Bytes held in the in-memory file cache", hot["bytes"]),
+        "uploads_in_progress": ("gauge", "Uploads admitted and not yet answered",
+                                upload_slots.stats()["active"]),
+        "upload_rate_limit_clients": ("gauge", "Clients tracked by the upload rate limiter",
+                                      upload_rate_limiter.stats()["clients"]),
+    })
+    cache = storage.stats().get("cache")
+    if cache is not None:
+        stats.update({
+            "storage_cache_hits_total": ("counter", "Storage read cache hits", cache["hits"]),
+            "storage_cache_misses_total": ("counter", "Storage read cache misses (remote fetches)",
+                                           cache["misses"]),
+            "storage_cache_bytes": ("gauge", "Bytes held in the storage read cache", cache["bytes"]),
+        })
+    return stats
+
+
+REGISTRY.register_collector(collect_component_stats)
+
+
+def static_file_type(filepath: str, content_type: str = None) -> tuple:
+    """MIME-тип (по расширению, если не указан) и Cache-Control статического файла."""
+    if not content_type:
+        ext = os.path.splitext(filepath)[1].lower()
+        content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+    # HTML кешируется ненадолго, остальная статика - как immutable (как в nginx)
+    cache_control = CACHE_CONTROL_HTML if content_type.startswith("text/html") else CACHE_CONTROL_IMMUTABLE
+    return content_type, cache_control
+
+
+def file_headers(cache_control: str, extra_headers: dict = None) -> dict:
+    """Постоянные заголовки ответа с файлом, кроме типа, длины и валидаторов."""
+    return {"Cache-Control": cache_control, "Accept-Ranges": "bytes", **CORS_HEADERS,
+            **(extra_headers or {})}
+
+
+def describe_static_file(path: str) -> tuple:
+    """Тип и заголовки статического файла для hot_cache.preload."""
+    content_type, cache_control = static_file_type(path)
+    return content_type, file_headers(cache_control)
 
 
 def log_success(message: str) -> None:
     """Логирует успешное выполнение операции."""
-    logger.info(f"Success: {message}")
+    # Успешные операции - самые частые сообщения, они пишутся выборочно
+    logger.info(f"Success: {message}", extra={"sample": True})
 
 
 def log_error(message: str) -> None:
@@ -96,12 +240,116 @@ class ImageServer(BaseHTTPRequestHandler):
     """HTTP сервер для обработки загрузки и обслуживания изображений."""
 
     protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными write: без TCP_NODELAY keep-alive ответ ждет delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self) -> None:
+        """Обрабатывает один запрос, записывает его метрики и строку access log."""
+        self._request_started = None
+        self._response_status = None
+        self._response_bytes = 0
+        self._expect_continue = False
+        self.request_id = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._request_started is not None:
+                HTTP_IN_FLIGHT.dec()
+                self._record_request_metrics()
+                end_request()
+
+    def parse_request(self) -> bool:
+        """Разбирает строку запроса и заголовки; отсюда запрос считается принятым в обработку."""
+        REGISTRY.ensure_started()
+        readiness.ensure_started()
+        self._request_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        parsed = super().parse_request()
+
+        # id запроса от nginx ($request_id) связывает его логи с access log nginx
+        incoming = self.headers.get("X-Request-ID", "") if getattr(self, "headers", None) else ""
+        self.request_id = incoming if REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        start_request(self.request_id)
+        return parsed
+
+    def handle_expect_100(self) -> bool:
+        """100 Continue откладывается до проверки допуска загрузки (do_POST): отклоненный клиент не передает тело."""
+        self._expect_continue = True
+        return True
+
+    def send_response(self, code: int, message: str = None) -> None:
+        self._response_status = code
+        super().send_response(code, message)
+        if getattr(self, "request_id", None):
+            self.send_header("X-Request-ID", self.request_id)
+
+    def log_request(self, code="-", size="-") -> None:
+        """Строка access log пишется в _record_request_metrics вместе с этапами запроса."""
+
+    def log_message(self, format: str, *args) -> None:
+        """Сообщения BaseHTTPRequestHandler (ошибки разбора, таймауты) - в общий лог, а не в stderr."""
+        logger.warning(f"{self.address_string()} - {format % args}")
+
+    def send_header(self, keyword: str, value: str) -> None:
+        if keyword.lower() == "content-length":
+            self._response_bytes = int(value)
+        super().send_header(keyword, value)
+
+    def _route_label(self) -> str:
+        """Метка маршрута для метрик (ограниченный набор значений)."""
+        # При ошибке разбора строки запроса path и command не заданы
+        path, _, query = (getattr(self, "path", None) or "").partition("?")
+        if path.startswith("/images/"):
+            query_params = parse_qs(query)
+            return "thumbnail" if "w" in query_params or "fmt" in query_params else "image"
+        if path.startswith("/images-list"):
+            return "images-list"
+        if path.startswith("/images-similar/"):
+            return "images-similar"
+        if path.startswith("/delete/"):
+            return "delete"
+        if path in ("/upload", "/upload-batch", "/health", "/livez", "/readyz", "/metrics"):
+            return path[1:]
+        if path in ("/", "/index.html", "/favicon.ico") or \
+                path.startswith(("/style.css", "/script.js", "/static/", "/assets/")):
+            return "static"
+        return "other"
+
+    def _record_request_metrics(self) -> None:
+        """Записывает счетчики, задержку и объем данных завершенного запроса и строку access log."""
+        duration = time.perf_counter() - self._request_started
+        command = getattr(self, "command", None)
+        path = getattr(self, "path", None)
+        method = command if command in METRICS_METHODS else "other"
+        route = self._route_label()
+        status = self._response_status or 0
+        HTTP_REQUESTS.inc(method=method, route=route, status=status)
+        HTTP_REQUEST_DURATION.observe(duration, method=method, route=route)
+        HTTP_RESPONSE_BYTES.inc(self._response_bytes, route=route)
+        try:
+            request_bytes = int(self.headers.get("Content-Length", 0))
+        except (AttributeError, ValueError):
+            request_bytes = 0
+        if request_bytes > 0:
+            HTTP_REQUEST_BYTES.inc(request_bytes, route=route)
+
+        logger.log(
+            logging.WARNING if status >= 500 else logging.INFO,
+            f'{command or "-"} {path or "-"} {status} {duration * 1000:.1f}ms',
+            extra={
+                "method": command, "route": route, "path": path, "status": status,
+                "duration_ms": round(duration * 1000, 3), "bytes_in": request_bytes,
+                "bytes_out": self._response_bytes, "client": self.address_string(),
+                "stages": request_stages() or None,
+                # Успешные запросы пишутся выборочно, ошибки - всегда
+                "sample": status < 400,
+            }
+        )
 
     def _set_cors_headers(self) -> None:
         """Устанавливает CORS заголовки для поддержки кросс-доменных запросов."""
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS, DELETE")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        for key, value in CORS_HEADERS.items():
+            self.send_header(key, value)
 
     def _send_response(self, code: int, content_type: str, content: bytes,
                        extra_headers: dict = None) -> None:
@@ -139,88 +387,253 @@ class ImageServer(BaseHTTPRequestHandler):
             self._serve_static_file(path)
         elif path.startswith("/images-list"):
             self._serve_images_list(path)
+        elif path.startswith("/images-similar/"):
+            self._serve_similar_images(path)
         elif path == "/health":
             self._serve_health_check()
+        elif path == "/livez":
+            self._serve_liveness()
+        elif path == "/readyz":
+            self._serve_readiness()
+        elif path == "/metrics":
+            self._send_response(200, METRICS_CONTENT_TYPE, REGISTRY.render())
         else:
             self.send_error(404, "Page not found")
 
+    def _serve_liveness(self) -> None:
+        """/livez: процесс жив и обрабатывает запросы; внешние зависимости не проверяются."""
+        self._send_response(200, "application/json",
+                            json.dumps({"status": "alive", "pid": os.getpid()}).encode("utf-8"),
+                            {"Cache-Control": "no-store"})
+
+    def _serve_readiness(self) -> None:
+        """/readyz: готовность к трафику по результату последней фоновой проверки базы."""
+        ready, state = readiness.status()
+        data = {
+            "status": "ready" if ready else "not ready",
+            **state,
+            "schema_version": schema_state["version"],
+            "startup": startup_state,
+        }
+        self._send_response(200 if ready else 503, "application/json",
+                            json.dumps(data).encode("utf-8"), {"Cache-Control": "no-store"})
+
     def _serve_health_check(self) -> None:
-        """Проверка здоровья приложения."""
-        try:
-            conn = get_db_connection()
-            conn.close()
-            health_data = json.dumps({
-                "status": "healthy",
-                "database": "connected",
-                "timestamp": datetime.datetime.now().isoformat()
-            }).encode("utf-8")
-            self._send_response(200, "application/json", health_data)
-        except Exception as e:
+        """Подробное состояние приложения; состояние базы - из фоновой проверки /readyz."""
+        ready, state = readiness.status()
+        if not ready:
             error_data = json.dumps({
                 "status": "unhealthy",
-                "database": "disconnected",
-                "error": str(e)
+                "database": state["database"],
+                "pool": db_pool.stats(),
+                "error": state["error"]
             }).encode("utf-8")
             self._send_response(503, "application/json", error_data)
+            return
+        try:
+            jobs = job_queue.counts()
+        except Exception as e:
+            log_error(f"Could not count jobs for health check: {e}")
+            jobs = None
+        health_data = json.dumps({
+            "status": "healthy",
+            "database": state["database"],
+            "readiness": state,
+            "schema_version": schema_state["version"],
+            "startup": startup_state,
+            "pool": db_pool.stats(),
+            "image_processing": image_processor.stats(),
+            "storage": storage.stats(),
+            "hot_cache": hot_cache.stats(),
+            "uploads": upload_slots.stats(),
+            "upload_rate_limit": upload_rate_limiter.stats(),
+            "jobs": jobs,
+            "timestamp": datetime.datetime.now().isoformat()
+        }).encode("utf-8")
+        self._send_response(200, "application/json", health_data)
 
     def _serve_images_list(self, path: str) -> None:
-        """Отображает список изображений с пагинацией."""
+        """
+        Отображает список изображений с пагинацией.
+        Поддерживает page= (OFFSET, для совместимости) и cursor= (keyset по (upload_time, id)),
+        а также фильтры и поиск (image_search.parse_filters).
+        """
         try:
             # Парсинг параметров пагинации
             query_params = parse_qs(path.split('?')[1]) if '?' in path else {}
-            page = int(query_params.get('page', [1])[0])
-            page = max(1, page)  # Страница не может быть меньше 1
+            try:
+                limit = parse_limit(query_params, ITEMS_PER_PAGE, MAX_ITEMS_PER_PAGE)
+                cursor_param = query_params.get('cursor', [None])[0]
+                after = decode_cursor(cursor_param) if cursor_param else None
+                page = None if after else parse_page(query_params)
+                filters = parse_filters(query_params)
+            except (PaginationParamsError, SearchParamsError) as e:
+                self.send_error(400, str(e))
+                return
+
+            # Готовый ответ берем из кеша; он сбрасывается при любом изменении таблицы images
+            cache_key = (limit, cursor_param, page, filters.cache_key())
+            cached = list_cache.get(cache_key)
+            if cached:
+                body, etag = cached
+            else:
+                version = list_cache.version
+                body = self._build_images_list(limit, after, page, filters)
+                etag = list_cache.put(cache_key, version, body)
+
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match and etag_matches(if_none_match, etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+                self._set_cors_headers()
+                self.end_headers()
+                return
+
+            self._send_response(200, "application/json", body,
+                                {"ETag": etag, "Cache-Control": "no-cache"})
+
+        except Exception as e:
+            log_error(f"Error serving images list: {str(e)}")
+            self.send_error(500, "Internal server error")
+
+    def _serve_similar_images(self, path: str) -> None:
+        """Почти одинаковые изображения: /images-similar/<id>?distance=N&limit=M."""
+        path, _, query = path.partition("?")
+        try:
+            image_id = int(path[len("/images-similar/"):])
+            query_params = parse_qs(query)
+            distance = parse_distance(query_params)
+            limit = parse_limit(query_params, DEFAULT_SIMILAR_RESULTS, MAX_SIMILAR_RESULTS)
+        except (SimilarParamsError, PaginationParamsError) as e:
+            self.send_error(400, str(e))
+            return
+        except ValueError:
+            self.send_error(400, "Invalid image ID")
+            return
+
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                found, phash = image_phash(cursor, image_id)
+                similar = []
+                if phash is not None:
+                    similar = find_similar(cursor, phash, distance, limit, exclude_id=image_id)
+                cursor.close()
+        except Exception as e:
+            log_error(f"Error searching similar images: {str(e)}")
+            self.send_error(500, "Internal server error")
+            return
 
-            offset = (page - 1) * ITEMS_PER_PAGE
+        if not found:
+            self.send_error(404, "Image not found in database")
+            return
+        if phash is None:
+            self.send_error(409, "Perceptual hash is not computed yet for this image")
+            return
 
-            conn = get_db_connection()
+        response_data = json.dumps({
+            "id": image_id,
+            "distance": distance,
+            "similar": [{
+                "id": similar_id,
+                "filename": filename,
+                "original_name": original_name,
+                "upload_time": upload_time.strftime("%Y-%m-%d %H:%M:%S"),
+                "url": f"/images/{filename}",
+                "thumbnail_url": thumbnail_url(filename),
+                "distance": similar_distance,
+            } for similar_id, filename, original_name, upload_time, similar_distance in similar],
+        }).encode("utf-8")
+        self._send_response(200, "application/json", response_data)
+
+    def _build_images_list(self, limit: int, after: tuple, page: int, filters) -> bytes:
+        """Выбирает страницу изображений из базы данных и кодирует ответ в JSON."""
+        with get_db_connection() as conn:
             cursor = conn.cursor()
 
-            # Получаем общее количество изображений
-            cursor.execute("SELECT COUNT(*) FROM images")
-            total_count = cursor.fetchone()[0]
+            # Общее количество изображений берем из счетчика, а не из COUNT(*);
+            # с фильтрами счетчик не подходит - считаем не дальше SEARCH_COUNT_LIMIT строк
+            count_exact = True
+            if filters.active:
+                cursor.execute(*count_query(filters))
+                total_count = cursor.fetchone()[0]
+                if total_count > SEARCH_COUNT_LIMIT:
+                    total_count, count_exact = SEARCH_COUNT_LIMIT, False
+            else:
+                total_count = self._get_total_count(cursor)
 
-            # Получаем изображения для текущей страницы
-            cursor.execute("""
-                SELECT id, filename, original_name, size, upload_time, file_type 
-                FROM images 
-                ORDER BY upload_time DESC 
-                LIMIT %s OFFSET %s
-            """, (ITEMS_PER_PAGE, offset))
+            # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+            offset = 0 if after else (page - 1) * limit
+            cursor.execute(*list_query(filters, limit + 1, after, offset,
+                                       selective=filters.active and count_exact))
 
             images = cursor.fetchall()
+            has_more = len(images) > limit
+            images = images[:limit]
+            variants = self._get_variants(cursor, [img[1] for img in images])
+            jobs = job_statuses(cursor, [img[1] for img in images])
             cursor.close()
-            conn.close()
-
-            # Возвращаем данные в JSON формате
-            images_data = []
-            for img in images:
-                id, filename, original_name, size, upload_time, file_type = img
-                images_data.append({
-                    "id": id,
-                    "filename": filename,
-                    "original_name": original_name,
-                    "size_kb": round(size / 1024, 2),
-                    "upload_time": upload_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "file_type": file_type,
-                    "url": f"/images/{filename}"
-                })
-
-            response_data = {
-                "images": images_data,
-                "pagination": {
-                    "current_page": page,
-                    "total_pages": (total_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE,
-                    "total_count": total_count,
-                    "items_per_page": ITEMS_PER_PAGE
-                }
+
+        next_cursor = encode_cursor(images[-1][4], images[-1][0]) if has_more else None
+
+        # Возвращаем данные в JSON формате
+        images_data = []
+        for img in images:
+            id, filename, original_name, size, upload_time, file_type = img
+            images_data.append({
+                "id": id,
+                "filename": filename,
+                "original_name": original_name,
+                "size_kb": round(size / 1024, 2),
+                "upload_time": upload_time.strftime("%Y-%m-%d %H:%M:%S"),
+                "file_type": file_type,
+                "url": f"/images/{filename}",
+                "thumbnail_url": thumbnail_url(filename),
+                "variants": variants.get(filename, {}),
+                "jobs": jobs.get(filename, {})
+            })
+
+        response_data = {
+            "images": images_data,
+            "pagination": {
+                "current_page": page,
+                "total_pages": (total_count + limit - 1) // limit,
+                "total_count": total_count,
+                "total_count_exact": count_exact,
+                "items_per_page": limit,
+                "has_more": has_more,
+                "next_cursor": next_cursor
             }
+        }
 
-            self._send_response(200, "application/json", json.dumps(response_data).encode("utf-8"))
+        return json.dumps(response_data).encode("utf-8")
 
-        except Exception as e:
-            log_error(f"Error serving images list: {str(e)}")
-            self.send_error(500, "Internal server error")
+    def _get_variants(self, cursor, filenames: list) -> dict:
+        """Сохраненные варианты файлов страницы и экономия относительно оригинала."""
+        if not filenames or not transcoder.serves_variants:
+            return {}
+        cursor.execute("""
+            SELECT filename, format, size, original_size FROM image_variants
+            WHERE filename = ANY(%s) AND key IS NOT NULL
+        """, (list(set(filenames)),))
+        variants = {}
+        for filename, fmt, size, original_size in cursor.fetchall():
+            variants.setdefault(filename, {})[fmt] = {
+                "size_kb": round(size / 1024, 2),
+                "saved_kb": round((original_size - size) / 1024, 2),
+                "saved_percent": round(100 * (1 - size / original_size), 1) if original_size else 0.0,
+            }
+        return variants
+
+    def _get_total_count(self, cursor) -> int:
+        """Возвращает количество изображений из счетчика (COUNT(*) - только если счетчика нет)."""
+        cursor.execute("SELECT total_count FROM images_counter")
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        cursor.execute("SELECT COUNT(*) FROM images")
+        return cursor.fetchone()[0]
 
     def _serve_static_file(self, path: str, content_type: str = None) -> None:
         """Обслуживает статические файлы из директории /static."""
@@ -234,48 +647,253 @@ class ImageServer(BaseHTTPRequestHandler):
                 filename = path[1:]  # remove leading "/"
 
             # Исправленный путь
-            filepath = os.path.join("/app/static", filename)
+            filepath = os.path.abspath(os.path.join(STATIC_DIR, filename))
+            if not filepath.startswith(STATIC_DIR + os.sep):
+                self.send_error(403, "Access denied")
+                return
 
             if os.path.isfile(filepath):
-                with open(filepath, "rb") as f:
-                    content = f.read()
-
-                # Автоматическое определение MIME-типа если не указан
-                if not content_type:
-                    ext = os.path.splitext(filename)[1].lower()
-                    content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
-
-                self._send_response(200, content_type, content)
+                content_type, cache_control = static_file_type(filepath, content_type)
+                self._send_file(filepath, content_type, cache_control)
             else:
-                self.send_error(404, f"File not found: {filepath}")
+                self.send_error(404, "File not found")
 
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение во время отправки: заголовки уже ушли, отвечать некому
+            return
         except Exception as e:
-            self.send_error(500, f"Server error: {e}")
+            # Текст исключения (например, OSError) содержит пути сервера - только в лог
+            log_error(f"Error serving static file {path}: {e}")
+            self.send_error(500, "Internal server error")
 
     def _serve_uploaded_image(self, path: str) -> None:
-        """Обслуживает загруженные пользователем изображения."""
-        filename = os.path.basename(path)
-        filepath = os.path.join(UPLOAD_DIR, filename)
+        """Обслуживает загруженные пользователем изображения и их уменьшенные копии."""
+        path, _, query = path.partition("?")
+        filename = path[len("/images/"):]  # путь блоба вида ab/cd/<sha256>.<ext>
 
         # Защита от path traversal атак
-        filepath = os.path.abspath(filepath)
-        if not filepath.startswith(os.path.abspath(UPLOAD_DIR)):
+        if not is_safe_key(filename):
             self.send_error(403, "Access denied")
             return
 
-        if os.path.isfile(filepath):
-            try:
-                with open(filepath, "rb") as f:
-                    content = f.read()
+        # Скрытые файлы (незавершенные загрузки) не отдаются
+        if is_hidden_key(filename):
+            self.send_error(404, "Image not found")
+            return
+
+        try:
+            ext = os.path.splitext(filename)[1].lower()
+            query_params = parse_qs(query)
+            if "w" in query_params or "fmt" in query_params:
+                filepath = storage.local_path(filename)
+                if filepath is None:
+                    self.send_error(404, "Image not found")
+                    return
+                self._serve_thumbnail(filepath, filename, ext, query_params)
+                return
+
+            self._serve_original(filename, ext)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение во время отправки: заголовки уже ушли, отвечать некому
+            return
+        except StorageError as e:
+            log_error(f"Storage error for {filename}: {e}")
+            self.send_error(502, "Storage is unavailable")
+        except Exception as e:
+            # Текст исключения (OSError, Pillow) содержит пути сервера - только в лог
+            log_error(f"Error serving image {filename}: {e}")
+            self.send_error(500, "Internal server error")
 
-                ext = os.path.splitext(filename)[1].lower()
+    def _serve_original(self, filename: str, ext: str) -> None:
+        """
+        Отдает оригинал или его вариант в формате, который принимает клиент (WebP/AVIF).
+        Ответ зависит от Accept, поэтому при включенном перекодировании он с Vary: Accept.
+        """
+        key = filename
+        content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+        headers = {}
+        variant = None
+        if transcoder.serves_variants:
+            headers["Vary"] = "Accept"
+            accept = self.headers.get("Accept")
+            # Варианты ищутся в базе, только если клиент принимает хотя бы один из форматов
+            variants = transcoder.variants(filename) if transcoder.accepted_formats(accept) else {}
+            fmt = negotiate(accept, variants)
+            if fmt is not None:
+                variant = (fmt, *variants[fmt])
+                key = variant[1]
+                content_type = VARIANT_FORMATS[fmt][2]
+
+        # Оригинал может отдать само хранилище или nginx - байты не идут через Python
+        location = storage.serve_location(key)
+        if location is not None:
+            self._send_storage_location(*location, headers=headers)
+        else:
+            filepath = storage.local_path(key)
+            if filepath is None and variant is not None:
+                # Вариант уже удален вместе с оригиналом или еще не виден - пробуем оригинал
+                variant = None
+                filepath = storage.local_path(filename)
                 content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+            if filepath is None:
+                self.send_error(404, "Image not found")
+                return
+            self._send_file(filepath, content_type, CACHE_CONTROL_IMMUTABLE, headers)
+
+        if variant is not None and self._response_status in (200, 302):
+            fmt, _key, size, original_size = variant
+            VARIANT_RESPONSES.inc(format=fmt)
+            VARIANT_BYTES_SAVED.inc(max(0, original_size - size), format=fmt)
+
+    def _send_storage_location(self, kind: str, location: str, headers: dict = None) -> None:
+        """Перенаправляет отдачу файла: redirect - клиента на подписанный URL, accel - nginx."""
+        if kind == "redirect":
+            self.send_response(302)
+            self.send_header("Location", location)
+            # Подписанный URL ограничен по времени - кешировать перенаправление можно недолго
+            self.send_header("Cache-Control", "private, max-age=60")
+        else:
+            self.send_response(200)
+            self.send_header("X-Accel-Redirect", location)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self._set_cors_headers()
+        self.end_headers()
+
+    def _serve_thumbnail(self, filepath: str, filename: str, ext: str, query_params: dict) -> None:
+        """Отдает уменьшенную копию изображения из кеша производных."""
+        try:
+            width, fmt = parse_thumbnail_params(query_params, ext)
+        except ThumbnailParamsError as e:
+            self.send_error(400, str(e))
+            return
+
+        try:
+            variant_path = thumbnail_cache.get_or_create(filepath, filename, width, fmt)
+        except ImageQueueFullError:
+            self.send_error(503, "Server is busy, please retry later")
+            return
+        except Exception as e:
+            # ImageProcessingError, а также исключения Pillow и OSError из самой задачи
+            # (ImageProcessor.run пробрасывает их как есть)
+            log_error(f"Thumbnail rendering failed for {filename}: {e}")
+            self.send_error(500, "Could not render thumbnail")
+            return
+        content_type = THUMBNAIL_FORMATS[fmt][2]
+        self._send_file(variant_path, content_type, CACHE_CONTROL_IMMUTABLE)
+
+    def _send_file(self, filepath: str, content_type: str, cache_control: str,
+                   extra_headers: dict = None) -> None:
+        """
+        Отдает файл с поддержкой ETag, 304 и Range запросов: часто запрашиваемые -
+        из памяти (hot_cache), остальные - через sendfile.
+        """
+        cached = hot_cache.get(filepath)
+        if cached is not None:
+            self._send_file_body(cached.body, cached, content_type, cache_control, extra_headers)
+            return
+        with open(filepath, "rb") as f:
+            stat = os.fstat(f.fileno())
+            cached = hot_cache.admit(filepath, f, stat, content_type,
+                                     file_headers(cache_control, extra_headers))
+            if cached is not None:
+                self._send_file_body(cached.body, cached, content_type, cache_control, extra_headers)
+            else:
+                self._send_file_body(f, CachedFile(stat), content_type, cache_control, extra_headers,
+                                     size=stat.st_size)
+
+    def _send_file_body(self, source, meta: CachedFile, content_type: str, cache_control: str,
+                        extra_headers: dict = None, size: int = None) -> None:
+        """Отправляет ответ; source - байты из кеша или открытый файл (sendfile)."""
+        if size is None:
+            size = len(source)
+        validators = {
+            "ETag": meta.etag,
+            "Last-Modified": meta.last_modified,
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes",
+        }
+        validators.update(extra_headers or {})
+
+        if is_not_modified(self.headers, meta.etag, meta.mtime):
+            self.send_response(304)
+            for key, value in validators.items():
+                self.send_header(key, value)
+            self._set_cors_headers()
+            self.end_headers()
+            return
+
+        ranges = None
+        range_header = self.headers.get("Range")
+        if range_header and range_applies(self.headers, meta.etag, meta.mtime):
+            try:
+                ranges = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self._set_cors_headers()
+                self.end_headers()
+                return
+
+        if not ranges and isinstance(source, bytes):
+            # Файл из памяти: заголовки закодированы при допуске в кеш
+            block = meta.header_block(content_type)
+            if block is None:
+                block = meta.build_header_block(content_type, file_headers(cache_control, extra_headers))
+            self.send_response(200)
+            self._send_header_block(block, size)
+            self.end_headers()
+            self._write_file_range(source, 0, size)
+            return
+
+        if not ranges:
+            self.send_response(200)
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Length", str(size))
+            self._set_cors_headers()
+            for key, value in validators.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self._write_file_range(source, 0, size)
+            return
+
+        self.send_response(206)
+        self._set_cors_headers()
+        for key, value in validators.items():
+            self.send_header(key, value)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            self._write_file_range(source, start, end - start + 1)
+            return
 
-                self._send_response(200, content_type, content)
-            except Exception as e:
-                self.send_error(500, f"Server error: {e}")
+        boundary = uuid.uuid4().hex
+        parts, tail, total = multipart_byteranges(ranges, size, content_type, boundary)
+        self.send_header("Content-type", f"multipart/byteranges; boundary={boundary}")
+        self.send_header("Content-Length", str(total))
+        self.end_headers()
+        for head, start, end in parts:
+            self.wfile.write(head)
+            self._write_file_range(source, start, end - start + 1)
+        self.wfile.write(tail)
+
+    def _send_header_block(self, block: bytes, size: int) -> None:
+        """Добавляет готовый блок заголовков (см. CachedFile) к ответу, как send_header."""
+        if self.request_version != "HTTP/0.9":
+            self._headers_buffer.append(block)
+        self._response_bytes = size
+
+    def _write_file_range(self, source, offset: int, count: int) -> None:
+        if isinstance(source, bytes):
+            self.wfile.write(memoryview(source)[offset:offset + count])
         else:
-            self.send_error(404, "Image not found")
+            self.connection.sendfile(source, offset, count)
 
     def do_DELETE(self) -> None:
         """Обрабатывает DELETE запросы для удаления изображений."""
@@ -286,34 +904,53 @@ class ImageServer(BaseHTTPRequestHandler):
         try:
             image_id = int(self.path.split("/")[2])
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
 
-            # Получаем информацию об изображении перед удалением
-            cursor.execute("SELECT filename FROM images WHERE id = %s", (image_id,))
-            result = cursor.fetchone()
+                # Получаем информацию об изображении перед удалением
+                cursor.execute("SELECT filename FROM images WHERE id = %s", (image_id,))
+                result = cursor.fetchone()
 
-            if not result:
-                cursor.close()
-                conn.close()
-                self.send_error(404, "Image not found in database")
-                return
+                if not result:
+                    cursor.close()
+                    self.send_error(404, "Image not found in database")
+                    return
 
-            filename = result[0]
-            filepath = os.path.join(UPLOAD_DIR, filename)
+                filename = result[0]
+                lock_blob(cursor, filename)
 
-            # Удаляем запись из базы данных
-            cursor.execute("DELETE FROM images WHERE id = %s", (image_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
+                # Удаляем запись из базы данных
+                cursor.execute("DELETE FROM images WHERE id = %s", (image_id,))
 
-            # Удаляем физический файл
-            if os.path.exists(filepath):
-                os.remove(filepath)
+                # Файл удаляется только вместе с последней ссылкой на него
+                orphaned_keys = None
+                if count_references(cursor, filename) == 0:
+                    orphaned_keys = [filename] + transcoder.delete_variants(cursor, filename)
+                    delete_jobs(cursor, filename)
+
+                conn.commit()
+                cursor.close()
+            list_cache.invalidate()
+
+            # Файлы удаляются только после commit: если он не прошел, записи остаются
+            # со своими файлами. Ошибка здесь оставляет лишь "сирот" для сверки
+            blob_removed = False
+            if orphaned_keys is not None:
+                try:
+                    removed = delete_unreferenced(get_db_connection, storage, filename, orphaned_keys)
+                    blob_removed = filename in removed
+                    if not blob_removed:
+                        log_error(f"Physical file not found or referenced again: {filename}")
+                except Exception as e:
+                    log_error(f"Could not delete files of {filename}, left for reconcile: {e}")
+
+            if blob_removed:
+                thumbnail_cache.invalidate(filename)
+                # Ключ кеша - путь, с которого файл отдавался (для S3 - в STORAGE_CACHE_DIR)
+                hot_cache.invalidate(storage.cache_path(filename))
                 log_success(f"Image deleted: {filename} (ID: {image_id})")
             else:
-                log_error(f"Physical file not found: {filename}")
+                log_success(f"Image reference deleted: {filename} (ID: {image_id})")
 
             # Отправляем успешный ответ
             response_data = json.dumps({
@@ -330,55 +967,132 @@ class ImageServer(BaseHTTPRequestHandler):
             self.send_error(500, "Internal server error")
 
     def do_POST(self) -> None:
-        """Обрабатывает POST запросы для загрузки изображений на endpoint /upload."""
-        if self.path != "/upload":
+        """Обрабатывает POST запросы: /upload (один файл) и /upload-batch (несколько файлов)."""
+        if self.path == "/upload":
+            handler, max_body_size = self._handle_upload, MAX_FILE_SIZE + MULTIPART_OVERHEAD
+        elif self.path == "/upload-batch":
+            handler, max_body_size = self._handle_batch_upload, MAX_BATCH_BODY_SIZE
+        else:
+            # Тело запроса не будет прочитано, соединение нельзя переиспользовать
+            self.close_connection = True
             self.send_error(404, "Route not found")
             return
 
+        params = self._admit_upload(max_body_size)
+        if params is None:
+            return
+        try:
+            handler(*params)
+        finally:
+            upload_slots.release()
+
+    def _admit_upload(self, max_body_size: int):
+        """
+        Контроль допуска загрузки до чтения тела: частота запросов клиента, заголовки
+        multipart запроса, свободный слот загрузки. Возвращает (boundary, content_length)
+        со занятым слотом или None, если ответ с отказом уже отправлен.
+        """
+        client = client_ip(self.client_address[0], self.headers.get("X-Real-IP"))
+        wait = upload_rate_limiter.acquire(client)
+        if wait:
+            log_error(f"Upload rate limit exceeded for {client}")
+            self._reject_upload(429, "rate_limited", "Too many uploads, retry later",
+                                retry_after(wait))
+            return None
+
+        params = self._multipart_request_params(max_body_size)
+        if params is None:
+            return None
+
+        if not upload_slots.try_acquire():
+            log_error(f"Too many concurrent uploads, rejecting {client}")
+            self._reject_upload(503, "busy", "Server is busy, please retry later",
+                                str(UPLOAD_RETRY_AFTER))
+            return None
+
+        # Клиент с Expect: 100-continue начинает передавать тело только теперь
+        if self._expect_continue:
+            self.send_response_only(100)
+            self.end_headers()
+        return params
+
+    def _reject_upload(self, code: int, reason: str, message: str, retry: str = None) -> None:
+        """Отклоняет загрузку до чтения тела: соединение закрывается, отказ учитывается в метриках."""
+        UPLOAD_REJECTIONS.inc(reason=reason)
+        self.close_connection = True
+        self.send_error(code, message, headers={"Retry-After": retry} if retry else None)
+
+    def _multipart_request_params(self, max_body_size: int):
+        """
+        Проверяет заголовки multipart запроса до чтения тела.
+        Возвращает (boundary, content_length) или None, если ответ с ошибкой уже отправлен.
+        """
         content_type = self.headers.get("Content-Type", "")
         if "multipart/form-data" not in content_type:
-            self.send_error(400, "Invalid content type. Expected multipart/form-data")
-            return
+            self._reject_upload(400, "bad_request", "Invalid content type. Expected multipart/form-data")
+            return None
 
-        try:
-            # Извлекаем boundary для парсинга multipart данных
-            import re
-            match = re.search(r'boundary=([^;]+)', content_type)
-            if not match:
-                self.send_error(400, "Could not find boundary in Content-Type")
-                return
+        # Извлекаем boundary для парсинга multipart данных
+        match = re.search(r'boundary=([^;]+)', content_type)
+        if not match:
+            self._reject_upload(400, "bad_request", "Could not find boundary in Content-Type")
+            return None
 
-            boundary_token = match.group(1).strip()
-            boundary = f"--{boundary_token}".encode('utf-8')
+        boundary_token = match.group(1).strip().strip('"')
 
+        try:
             content_length = int(self.headers.get("Content-Length", 0))
-            if content_length == 0:
-                self.send_error(400, "Empty request body")
+        except ValueError:
+            content_length = 0
+        if content_length <= 0:
+            self._reject_upload(400, "bad_request", "Empty request body")
+            return None
+
+        # Заведомо слишком большое тело отклоняем, не читая его
+        if content_length > max_body_size:
+            log_error(f"Request body too large: {content_length} bytes")
+            self._reject_upload(413, "too_large",
+                                f"Request body too large. Maximum size is {max_body_size} bytes")
+            return None
+
+        return boundary_token, content_length
+
+    def _handle_upload(self, boundary_token: str, content_length: int) -> None:
+        """Загружает одно изображение (поле file)."""
+        upload = None
+        try:
+            # Потоковое чтение тела: файл пишется во временный файл по мере поступления
+            try:
+                upload = self._parse_multipart_data(boundary_token, content_length)
+            except FileTooLargeError:
+                log_error(f"File too large, upload aborted ({content_length} bytes declared)")
+                self.close_connection = True
+                self.send_error(413, f"File too large. Maximum size is {MAX_FILE_SIZE} bytes")
+                return
+            except MultipartError as e:
+                log_error(f"Malformed multipart body: {e}")
+                self.close_connection = True
+                self.send_error(400, "Malformed multipart body")
                 return
 
-            # Чтение и парсинг тела запроса
-            body = self.rfile.read(content_length)
-            file_data, filename = self._parse_multipart_data(body, boundary)
-
-            if not file_data or not filename:
+            if not upload or not upload.filename:
                 self.send_error(400, "No file was uploaded or file field is missing")
                 return
 
             # Валидация загружаемого файла
-            self._validate_uploaded_file(file_data, filename)
-
-            # Сохранение файла с уникальным именем
-            unique_name = self._save_uploaded_file(file_data, filename)
+            if not self._validate_uploaded_file(upload):
+                return
 
-            # Сохранение метаданных в базу данных
-            self._save_image_metadata(unique_name, filename, len(file_data))
+            # Сохранение файла в контентно-адресуемое хранилище и метаданных в базу данных
+            unique_name, deduplicated = self._save_uploaded_file(upload)
 
             # Отправка успешного ответа
             response_data = json.dumps({
                 "status": "success",
                 "message": "File uploaded successfully",
                 "url": f"/images/{unique_name}",
-                "list_url": "/images-list"
+                "list_url": "/images-list",
+                "deduplicated": deduplicated
             }).encode("utf-8")
 
             self._send_response(200, "application/json", response_data)
@@ -386,127 +1100,287 @@ class ImageServer(BaseHTTPRequestHandler):
         except Exception as e:
             log_error(f"Unexpected error during file upload: {str(e)}")
             self.send_error(500, "Internal server error during file processing")
-
-    def _save_image_metadata(self, filename: str, original_name: str, size: int) -> None:
-        """Сохраняет метаданные изображения в базу данных."""
+        finally:
+            # После переноса на место временного файла уже нет; иначе удаляем его
+            if upload is not None:
+                upload.discard()
+
+    def _handle_batch_upload(self, boundary_token: str, content_length: int) -> None:
+        """
+        Загружает несколько изображений одним multipart запросом (поля file или files).
+        Файлы проверяются параллельно, метаданные сохраняются одной транзакцией;
+        в ответе - результат по каждому файлу.
+        """
+        uploads = []  # (индекс в results, UploadedFile)
         try:
-            file_type = os.path.splitext(filename)[1].lower()
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            results = []
+            parse_started = time.perf_counter()
+            try:
+                reader = MultipartReader(self.rfile, boundary_token, content_length)
+                for part in reader:
+                    if part.name not in ("file", "files") or not part.filename:
+                        continue
+                    index = len(results)
+                    result = {"index": index, "original_name": part.filename}
+                    results.append(result)
+
+                    # Данные отклоненной части парсер пропустит сам при переходе к следующей
+                    if len(uploads) >= MAX_BATCH_FILES:
+                        result.update(status="error",
+                                      message=f"Too many files. Maximum is {MAX_BATCH_FILES} per batch")
+                        continue
+                    try:
+                        uploads.append((index, save_part_to_temp(part, storage.spool_dir, MAX_FILE_SIZE)))
+                    except FileTooLargeError:
+                        log_error(f"File too large in batch: {part.filename}")
+                        result.update(status="error",
+                                      message=f"File too large. Maximum size is {MAX_FILE_SIZE} bytes")
+
+                if not reader.discard_remaining():
+                    self.close_connection = True
+                UPLOAD_STAGE_DURATION.observe(time.perf_counter() - parse_started, stage="parse")
+            except MultipartError as e:
+                log_error(f"Malformed multipart body: {e}")
+                self.close_connection = True
+                self.send_error(400, "Malformed multipart body")
+                return
 
-            cursor.execute("""
-                INSERT INTO images (filename, original_name, size, file_type)
-                VALUES (%s, %s, %s, %s)
-            """, (filename, original_name, size, file_type))
+            if not results:
+                self.send_error(400, "No files were uploaded or file fields are missing")
+                return
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+            # Валидация (декодирование изображений) выполняется параллельно
+            errors = list(validation_executor.map(self._check_uploaded_file,
+                                                  [upload for _, upload in uploads]))
+            valid = []
+            for (index, upload), error in zip(uploads, errors):
+                if error:
+                    results[index].update(status="error", message=error[1])
+                else:
+                    valid.append((index, upload))
+
+            if valid:
+                saved = self._save_uploaded_files([upload for _, upload in valid])
+                for (index, _upload), (unique_name, deduplicated) in zip(valid, saved):
+                    results[index].update(status="success", url=f"/images/{unique_name}",
+                                          deduplicated=deduplicated)
+
+            uploaded = len(valid)
+            failed = len(results) - uploaded
+            response_data = json.dumps({
+                "status": "success" if not failed else ("partial" if uploaded else "error"),
+                "uploaded": uploaded,
+                "failed": failed,
+                "results": results,
+                "list_url": "/images-list"
+            }).encode("utf-8")
 
-            log_success(f"Metadata saved to database: {filename}")
+            self._send_response(200 if uploaded else 400, "application/json", response_data)
 
         except Exception as e:
-            log_error(f"Failed to save metadata to database: {str(e)}")
-            # Не прерываем выполнение, но логируем ошибку
-
-    def _parse_multipart_data(self, body: bytes, boundary: bytes) -> tuple:
-        """Парсит multipart данные и извлекает файл."""
-        parts = body.split(boundary)
-        file_data = None
-        filename = None
-
-        for part in parts:
-            if not part or part.strip() == b'--':
-                continue
-
-            # Поиск разделителя заголовков и данных
-            header_end = part.find(b'\r\n\r\n')
-            if header_end == -1:
-                header_end = part.find(b'\n\n')
-                if header_end == -1:
-                    continue
-                headers_part = part[:header_end]
-                data_part = part[header_end + 2:]
-            else:
-                headers_part = part[:header_end]
-                data_part = part[header_end + 4:]
-
-            try:
-                headers_text = headers_part.decode('utf-8', errors='ignore')
-            except UnicodeDecodeError:
-                continue
-
+            log_error(f"Unexpected error during batch upload: {str(e)}")
+            self.send_error(500, "Internal server error during file processing")
+        finally:
+            for _, upload in uploads:
+                upload.discard()
+
+    @timed(UPLOAD_STAGE_DURATION, stage="db_insert")
+    def _save_image_metadata(self, cursor, filenames: list, uploads: list) -> None:
+        """Сохраняет метаданные изображений в базу данных одним INSERT (в транзакции вызывающего)."""
+        rows = [
+            (filename, upload.filename, upload.size, os.path.splitext(filename)[1].lower(),
+             upload.sha256, None if upload.phash is None else to_db(upload.phash))
+            for filename, upload in zip(filenames, uploads)
+        ]
+        execute_values(cursor, """
+            INSERT INTO images (filename, original_name, size, file_type, content_hash, phash)
+            VALUES %s
+        """, rows, page_size=len(rows))
+
+    @timed(UPLOAD_STAGE_DURATION, stage="parse")
+    def _parse_multipart_data(self, boundary: str, content_length: int) -> UploadedFile:
+        """Потоково парсит multipart тело и сохраняет файл во временный файл хранилища."""
+        reader = MultipartReader(self.rfile, boundary, content_length)
+        upload = None
+
+        for part in reader:
             # Поиск файла в multipart данных
-            if 'name="file"' in headers_text and 'filename="' in headers_text:
-                import re
-                filename_match = re.search(r'filename="([^"]+)"', headers_text)
-                if filename_match:
-                    filename = filename_match.group(1)
-                file_data = data_part.rstrip(b'\r\n')
+            if part.name == "file" and part.filename:
+                upload = save_part_to_temp(part, storage.spool_dir, MAX_FILE_SIZE)
                 break
 
-        return file_data, filename
+        # Остаток тела нужно дочитать, иначе он испортит следующий запрос keep-alive соединения
+        if not reader.discard_remaining():
+            self.close_connection = True
+
+        return upload
+
+    @timed(UPLOAD_STAGE_DURATION, stage="validate")
+    def _check_uploaded_file(self, upload: UploadedFile):
+        """Выполняет валидацию загружаемого файла. Возвращает None или (код ответа, сообщение)."""
+        filename = upload.filename
 
-    def _validate_uploaded_file(self, file_data: bytes, filename: str) -> None:
-        """Выполняет валидацию загружаемого файла."""
         # Проверка расширения файла
         ext = os.path.splitext(filename)[1].lower()
         if ext not in ALLOWED_EXTENSIONS:
             log_error(f"Unsupported file format: {filename}")
-            self.send_error(400, f"Unsupported file format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}")
+            return 400, f"Unsupported file format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
 
         # Проверка размера файла
-        if len(file_data) > MAX_FILE_SIZE:
-            log_error(f"File too large: {filename} ({len(file_data)} bytes)")
-            self.send_error(400, f"File too large. Maximum size is {MAX_FILE_SIZE} bytes")
+        if upload.size > MAX_FILE_SIZE:
+            log_error(f"File too large: {filename} ({upload.size} bytes)")
+            return 413, f"File too large. Maximum size is {MAX_FILE_SIZE} bytes"
 
-        # Проверка валидности изображения
+        # Проверка валидности изображения (с лимитом пикселей до декодирования) в пуле процессов
         try:
-            with Image.open(BytesIO(file_data)) as img:
-                img.verify()
-        except Exception as e:
+            upload.phash = image_processor.validate(upload.path)["phash"]
+        except ImageRejectedError as e:
             log_error(f"Invalid image file: {filename} - {str(e)}")
-            self.send_error(400, "Invalid image file")
-
-    def _save_uploaded_file(self, file_data: bytes, filename: str) -> str:
-        """Сохраняет загруженный файл с уникальным именем."""
-        ext = os.path.splitext(filename)[1].lower()
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
-        unique_name = f"{timestamp}{ext}"
-        filepath = os.path.join(UPLOAD_DIR, unique_name)
+            return 400, str(e)
+        except ImageQueueFullError:
+            log_error(f"Image processing queue is full, upload rejected: {filename}")
+            return 503, "Server is busy, please retry later"
+        except ImageJobTimeoutError:
+            log_error(f"Image validation timed out: {filename}")
+            return 400, "Image processing timed out"
+        except ImageProcessingError as e:
+            log_error(f"Image validation failed: {filename} - {str(e)}")
+            return 500, "Image processing failed"
+
+        if NEAR_DUPLICATE_MODE == "reject":
+            return self._check_near_duplicate(upload)
+        return None
+
+    def _check_near_duplicate(self, upload: UploadedFile):
+        """
+        Режим reject: отклоняет файл, почти одинаковый с уже загруженным изображением.
+        Точная копия (тот же блоб) не отклоняется - ее обрабатывает дедупликация по содержимому.
+        """
+        unique_name = blob_relpath(upload.sha256, os.path.splitext(upload.filename)[1].lower())
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM images WHERE filename = %s)", (unique_name,))
+            exact_copy = cursor.fetchone()[0]
+            similar = [] if exact_copy else find_similar(cursor, upload.phash,
+                                                         NEAR_DUPLICATE_DISTANCE, limit=1)
+            cursor.close()
+        if not similar:
+            return None
+        _id, existing, _name, _time, distance = similar[0]
+        NEAR_DUPLICATE_REJECTIONS.inc()
+        log_error(f"Near-duplicate upload rejected: {upload.filename} "
+                  f"(distance {distance} to {existing})")
+        return 409, f"Near-duplicate of an existing image: /images/{existing} (distance {distance})"
+
+    def _validate_uploaded_file(self, upload: UploadedFile) -> bool:
+        """Выполняет валидацию загружаемого файла. При ошибке отправляет ответ и возвращает False."""
+        error = self._check_uploaded_file(upload)
+        if error:
+            self.send_error(*error)
+            return False
+        return True
+
+    def _save_uploaded_file(self, upload: UploadedFile) -> tuple:
+        """
+        Сохраняет проверенный файл под именем из хеша содержимого и добавляет запись в images.
+        Возвращает (имя файла, True если такое содержимое уже было сохранено).
+        """
+        return self._save_uploaded_files([upload])[0]
+
+    @timed(UPLOAD_STAGE_DURATION, stage="save")
+    def _save_uploaded_files(self, uploads: list) -> list:
+        """
+        Сохраняет проверенные файлы в хранилище и их метаданные одной транзакцией.
+        Возвращает список (имя файла, признак дедупликации) в порядке uploads.
+        """
+        unique_names = [
+            blob_relpath(upload.sha256, os.path.splitext(upload.filename)[1].lower())
+            for upload in uploads
+        ]
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Блокировки берутся в одном порядке, чтобы параллельные пачки не взаимоблокировались
+            for unique_name in sorted(set(unique_names)):
+                lock_blob(cursor, unique_name)
 
-        with open(filepath, "wb") as f:
-            f.write(file_data)
+            created = []
+            results = []
+            try:
+                for upload, unique_name in zip(uploads, unique_names):
+                    is_new = storage.put(upload.path, unique_name,
+                                         content_type=CONTENT_TYPES.get(os.path.splitext(unique_name)[1]),
+                                         sha256=upload.sha256)
+                    if is_new:
+                        created.append(unique_name)
+                    results.append((unique_name, not is_new))
+
+                self._save_image_metadata(cursor, unique_names, uploads)
+                # Обработка новых файлов - в фоне (worker.py); задачи видны только после commit
+                enqueue_jobs(cursor, upload_jobs(), created)
+                conn.commit()
+            except Exception:
+                # Без записей в базе новые блобы стали бы "сиротами"
+                for unique_name in created:
+                    storage.delete(unique_name)
+                raise
+            finally:
+                cursor.close()
+        list_cache.invalidate()
 
-        log_success(f"Image uploaded successfully: {unique_name} (original: {filename})")
-        return unique_name
+        for upload, (unique_name, deduplicated) in zip(uploads, results):
+            if deduplicated:
+                log_success(f"Duplicate upload linked to existing file: {unique_name} "
+                            f"(original: {upload.filename})")
+            else:
+                log_success(f"Image uploaded successfully: {unique_name} "
+                            f"(original: {upload.filename})")
+        log_success(f"Metadata saved to database: {len(uploads)} image(s)")
+        return results
 
-    def send_error(self, code: int, message: str) -> None:
+    def send_error(self, code: int, message: str = None, explain: str = None,
+                   headers: dict = None) -> None:
         """Переопределенный метод отправки ошибок в JSON формате."""
+        if message is None:
+            # BaseHTTPRequestHandler вызывает send_error и без текста (например, 414)
+            message = self.responses.get(code, ("Error",))[0]
         error_json = json.dumps({"status": "error", "message": message}).encode("utf-8")
         self.send_response(code)
         self.send_header("Content-type", "application/json")
         self.send_header("Content-Length", str(len(error_json)))
         self._set_cors_headers()
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
         self.end_headers()
         self.wfile.write(error_json)
 
 
 if __name__ == "__main__":
     """Точка входа для запуска HTTP сервера."""
-    # Инициализация базы данных
-    logger.info("Initializing database...")
+    started = time.perf_counter()
+
+    # Схема базы данных: при актуальной версии - одна проверка без DDL
+    logger.info("Checking database schema...")
     init_database()
+    startup_state["schema_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    # Файлы метрик процессов прошлого запуска больше не актуальны
+    REGISTRY.clear()
+
+    # Статика загружается до fork: в режиме prefork процессы делят эти страницы памяти
+    stage_started = time.perf_counter()
+    hot_cache.preload(STATIC_DIR, describe=describe_static_file)
+    startup_state["preload_ms"] = round((time.perf_counter() - stage_started) * 1000, 3)
+    startup_state["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
 
-    server_address = ("0.0.0.0", 8000)
-    logger.info(f"Starting server on {server_address[0]}:{server_address[1]}")
+    server_address = ("0.0.0.0", int(os.environ.get("SERVER_PORT", "8000")))
+    logger.info(f"Starting server on {server_address[0]}:{server_address[1]} "
+                f"(startup {startup_state['total_ms']:.0f} ms: schema {startup_state['schema_ms']:.0f} ms, "
+                f"static preload {startup_state['preload_ms']:.0f} ms)")
     logger.info("Server is running and waiting for connections...")
 
     try:
-        httpd = HTTPServer(server_address, ImageServer)
-        logger.info("Server started on port 8000...")
-        httpd.serve_forever()
+        run_server(server_address, ImageServer)
     except Exception as e:
         logger.critical(f"Failed to start server: {e}")
-        raise
\ No newline at end of file
+        raise
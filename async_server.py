@@ -0,0 +1,237 @@
+"""
+Режим сервера на asyncio: соединения (в том числе простаивающие keep-alive) обслуживает
+цикл событий, а поток из пула занимается только на время обработки самого запроса.
+Маршруты и логика остаются в обработчике ImageServer (BaseHTTPRequestHandler).
+"""
+
+import asyncio
+import io
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from logger_config import get_logger
+from server_runner import (
+    IN_FLIGHT_WAIT, KEEPALIVE_TIMEOUT, MAX_IN_FLIGHT, OVERLOADED_RESPONSE, SERVER_THREADS,
+    SHUTDOWN_TIMEOUT
+)
+
+logger = get_logger()
+
+MAX_REQUEST_HEAD_SIZE = 64 * 1024  # 64 КБ на строку запроса и заголовки
+LISTEN_BACKLOG = 1024
+
+_HEADERS_TOO_LARGE_RESPONSE = (
+    b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+)
+
+
+class _RequestReader:
+    """
+    Блокирующий rfile для обработчика поверх asyncio.StreamReader. Вызывается из потока пула;
+    не читает дальше запрошенного, поэтому следующий запрос остается в StreamReader.
+    """
+
+    def __init__(self, head: bytes, reader: asyncio.StreamReader,
+                 loop: asyncio.AbstractEventLoop, timeout: float):
+        self._head = io.BytesIO(head)
+        self._reader = reader
+        self._loop = loop
+        self._timeout = timeout
+
+    def _call(self, coro):
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, self._timeout), self._loop)
+        return future.result()
+
+    def readline(self, limit: int = -1) -> bytes:
+        line = self._head.readline(limit)
+        if line:
+            return line
+        return self._call(self._reader.readline())
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._head.read(size)
+        if size < 0:
+            return data + self._call(self._reader.read())
+        if len(data) < size:
+            try:
+                data += self._call(self._reader.readexactly(size - len(data)))
+            except asyncio.IncompleteReadError as e:
+                data += e.partial
+        return data
+
+    def close(self) -> None:
+        pass
+
+
+class _ResponseWriter:
+    """Блокирующие wfile и connection.sendfile() для обработчика поверх asyncio транспорта."""
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop,
+                 timeout: float):
+        self._writer = writer
+        self._loop = loop
+        self._timeout = timeout
+
+    def _call(self, coro):
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, self._timeout), self._loop)
+        return future.result()
+
+    async def _write(self, data: bytes) -> None:
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._call(self._write(bytes(data)))
+        return len(data)
+
+    def sendfile(self, file, offset: int = 0, count: int = None) -> int:
+        return self._call(self._loop.sendfile(self._writer.transport, file, offset, count))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _ServerInfo:
+    """То, что обработчик может ожидать от объекта server."""
+
+    def __init__(self, server_address: tuple):
+        self.server_address = server_address
+        self.server_name = socket.getfqdn(server_address[0])
+        self.server_port = server_address[1]
+
+
+class AsyncHTTPServer:
+    """HTTP/1.1 сервер на asyncio, вызывающий обработчик BaseHTTPRequestHandler в пуле потоков."""
+
+    def __init__(self, server_address: tuple, handler_class, threads: int = SERVER_THREADS,
+                 max_in_flight: int = MAX_IN_FLIGHT, keepalive_timeout: float = KEEPALIVE_TIMEOUT):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.keepalive_timeout = keepalive_timeout
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        self._server_info = _ServerInfo(server_address)
+        self._slots = None
+        self._server = None
+        self._idle = set()  # задачи соединений, ожидающих следующего запроса
+        self._connections = set()
+        self._in_flight = 0
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        """Обслуживает одно соединение: ждет запросы без потока, обрабатывает в пуле."""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        loop = asyncio.get_running_loop()
+        client_address = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while True:
+                # Ожидание запроса стоит только корутину - поток не занимается
+                self._idle.add(task)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                                  self.keepalive_timeout)
+                except asyncio.LimitOverrunError:
+                    writer.write(_HEADERS_TOO_LARGE_RESPONSE)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                finally:
+                    self._idle.discard(task)
+
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), IN_FLIGHT_WAIT)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Too many requests in flight, rejecting {client_address[0]}")
+                    writer.write(OVERLOADED_RESPONSE)
+                    break
+
+                self._in_flight += 1
+                try:
+                    close = await loop.run_in_executor(
+                        self._executor, self._run_handler, head, reader, writer, loop,
+                        client_address
+                    )
+                finally:
+                    self._in_flight -= 1
+                    self._slots.release()
+                if close:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Connection error from {client_address[0]}: {e}")
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def _run_handler(self, head: bytes, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop,
+                     client_address: tuple) -> bool:
+        """Обрабатывает один запрос обработчиком в потоке пула. Возвращает True, если соединение закрывается."""
+        response = _ResponseWriter(writer, loop, self.keepalive_timeout)
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.request = response
+        handler.connection = response
+        handler.client_address = client_address[:2]
+        handler.server = self._server_info
+        handler.rfile = _RequestReader(head, reader, loop, self.keepalive_timeout)
+        handler.wfile = response
+        handler.close_connection = True
+        try:
+            handler.handle_one_request()
+        except Exception as e:
+            logger.error(f"Request handling failed for {client_address[0]}: {e}")
+            return True
+        return handler.close_connection
+
+    async def serve(self) -> None:
+        """Принимает соединения до получения SIGTERM/SIGINT, затем корректно завершается."""
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.server_address[0], self.server_address[1],
+            limit=MAX_REQUEST_HEAD_SIZE, backlog=LISTEN_BACKLOG, reuse_address=True
+        )
+
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+
+        async with self._server:
+            await stop.wait()
+            logger.info("Received shutdown signal, draining connections...")
+            self._server.close()
+
+            # Простаивающие соединения закрываем сразу, активным даем закончить запрос
+            for task in list(self._idle):
+                task.cancel()
+            pending = [task for task in self._connections if not task.done()]
+            if pending:
+                _done, still_running = await asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT)
+                if still_running:
+                    logger.warning(f"Shutdown timeout: {self._in_flight} requests still in flight")
+                    for task in still_running:
+                        task.cancel()
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Server process {os.getpid()} stopped")
+
+
+def run_async_server(server_address: tuple, handler_class) -> None:
+    """Запускает сервер в режиме asyncio."""
+    server = AsyncHTTPServer(server_address, handler_class)
+    asyncio.run(server.serve())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Заполнение перцептивных хешей (images.phash) изображений, загруженных до их появления.
+Файлы обрабатываются параллельно в пуле процессов ImageProcessor; записи с общим
+файлом (дедупликация) получают хеш за одно вычисление.
+
+Запуск: python backfill_phash.py [--batch 500] [--limit N]
+Повторный запуск продолжает с незаполненных записей.
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import execute_values
+
+from image_processing import ImageProcessingError, ImageProcessor, image_phash
+from logger_config import get_logger
+from near_duplicates import to_db
+from schema import init_database
+from services import get_db_connection, storage
+from storage import StorageError
+
+logger = get_logger()
+
+image_processor = ImageProcessor()
+
+BATCH_SIZE = 500
+
+
+def compute(filename: str):
+    """Возвращает (filename, хеш или None, результат: hashed, missing, failed)."""
+    try:
+        path = storage.local_path(filename)
+        if path is None:
+            return filename, None, "missing"
+        return filename, image_processor.run(image_phash, path), "hashed"
+    except (ImageProcessingError, StorageError, OSError) as e:
+        logger.warning(f"Perceptual hash failed for {filename}: {e}")
+        return filename, None, "failed"
+
+
+def backfill(batch_size: int = BATCH_SIZE, limit: int = None) -> dict:
+    """Проходит записи без хеша по возрастанию id. Возвращает отчет."""
+    report = {"rows_updated": 0, "files_hashed": 0, "files_missing": 0, "files_failed": 0}
+    started = time.monotonic()
+    last_id = 0
+    seen = 0
+    with ThreadPoolExecutor(max_workers=image_processor.workers,
+                            thread_name_prefix="phash") as executor:
+        while limit is None or seen < limit:
+            size = batch_size if limit is None else min(batch_size, limit - seen)
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, filename FROM images
+                    WHERE phash IS NULL AND id > %s
+                    ORDER BY id LIMIT %s
+                """, (last_id, size))
+                rows = cursor.fetchall()
+                cursor.close()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            seen += len(rows)
+
+            hashes = []
+            for filename, phash, result in executor.map(compute, sorted({row[1] for row in rows})):
+                report[f"files_{result}"] += 1
+                if phash is not None:
+                    hashes.append((filename, to_db(phash)))
+
+            if hashes:
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    execute_values(cursor, """
+                        UPDATE images SET phash = v.phash
+                        FROM (VALUES %s) AS v(filename, phash)
+                        WHERE images.filename = v.filename AND images.phash IS NULL
+                    """, hashes, template="(%s, %s::bigint)", page_size=len(hashes))
+                    report["rows_updated"] += cursor.rowcount
+                    conn.commit()
+                    cursor.close()
+            logger.info(f"Perceptual hash backfill: up to id {last_id}, {report}")
+
+    report["seconds"] = round(time.monotonic() - started, 1)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заполнение перцептивных хешей изображений")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="Записей за одну выборку")
+    parser.add_argument("--limit", type=int, help="Обработать не больше стольких записей")
+    args = parser.parse_args()
+
+    init_database()
+    try:
+        report = backfill(args.batch, args.limit)
+    finally:
+        image_processor.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,534 @@
 #!/usr/bin/env python3
 """
-Скрипт для создания резервных копий базы данных
+Скрипт резервного копирования базы данных и файлов изображений.
+
+Каждый снимок - каталог BACKUP_DIR/snapshots/<id> с дампом базы в формате directory
+(pg_dump -Fd -j N, сжатие) и manifest.json, который связывает дамп с набором файлов.
+Сами файлы хранятся один раз в BACKUP_DIR/objects по SHA-256 содержимого, поэтому
+каждый новый снимок копирует только новые или измененные файлы.
+
+Команды:
+    python backup_script.py backup          # снимок + очистка по политике хранения
+    python backup_script.py list
+    python backup_script.py verify <id>
+    python backup_script.py restore <id>    # проверка снимка, восстановление, сверка
+    python backup_script.py prune
 """
 
+import argparse
+import datetime
+import fcntl
+import hashlib
+import json
 import os
+import shutil
 import subprocess
-import datetime
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+
+from content_store import blob_relpath, hash_file
+from list_cache import notify_changed
 from logger_config import get_logger
+from services import DB_CONFIG, storage
+from storage import LocalStorage, ObjectNotFoundError
 
 logger = get_logger()
 
+# Настройки (переопределяются переменными окружения)
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "/app/backups")
+BACKUP_JOBS = int(os.environ.get("BACKUP_JOBS", "4"))  # процессы pg_dump/pg_restore
+BACKUP_COPY_WORKERS = int(os.environ.get("BACKUP_COPY_WORKERS", "4"))  # потоки копирования файлов
+BACKUP_COMPRESS_LEVEL = int(os.environ.get("BACKUP_COMPRESS_LEVEL", "6"))  # 0-9
+BACKUP_KEEP_LAST = int(os.environ.get("BACKUP_KEEP_LAST", "7"))
+BACKUP_KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", "7"))
+BACKUP_KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", "4"))
+PG_DUMP = os.environ.get("PG_DUMP", "pg_dump")
+PG_RESTORE = os.environ.get("PG_RESTORE", "pg_restore")
+
+SNAPSHOTS_DIR = "snapshots"
+OBJECTS_DIR = "objects"
+MANIFEST_NAME = "manifest.json"
+DB_DUMP_NAME = "db"
+SNAPSHOT_ID_FORMAT = "%Y-%m-%d_%H%M%S"
+MANIFEST_VERSION = 1
+
+
+class BackupError(Exception):
+    """Снимок не удалось создать, проверить или восстановить."""
+
+
+def _snapshots_root() -> str:
+    return os.path.join(BACKUP_DIR, SNAPSHOTS_DIR)
+
+
+def _objects_root() -> str:
+    return os.path.join(BACKUP_DIR, OBJECTS_DIR)
+
+
+@contextmanager
+def _backup_lock():
+    """Эксклюзивная блокировка каталога бэкапов: снимок, очистка и восстановление не пересекаются."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    fd = os.open(os.path.join(BACKUP_DIR, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupError("Another backup operation is running")
+        yield
+    finally:
+        os.close(fd)
+
+
+def _pg_env() -> dict:
+    env = os.environ.copy()
+    env["PGPASSWORD"] = DB_CONFIG["password"]
+    return env
+
+
+def _pg_args(dbname: str = None) -> list:
+    return ["-h", DB_CONFIG["host"], "-p", str(DB_CONFIG["port"]), "-U", DB_CONFIG["user"],
+            "-d", dbname or DB_CONFIG["dbname"]]
+
 
-def create_backup():
-    """Создает резервную копию базы данных."""
+def _run(cmd: list) -> None:
+    result = subprocess.run(cmd, env=_pg_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise BackupError(f"{os.path.basename(cmd[0])} failed: {result.stderr.strip()}")
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def load_manifest(snapshot_id: str) -> dict:
+    """Читает manifest.json снимка. Снимок без манифеста считается незавершенным."""
+    path = os.path.join(_snapshots_root(), snapshot_id, MANIFEST_NAME)
     try:
-        # Создаем имя файла с timestamp
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
-        backup_filename = f"backup_{timestamp}.sql"
-        backup_path = os.path.join("/app/backups", backup_filename)
-
-        # Команда для создания бэкапа
-        cmd = [
-            'pg_dump',
-            '-h', 'db',
-            '-U', 'postgres',
-            '-d', 'images_db',
-            '-f', backup_path
-        ]
-
-        # Устанавливаем переменную окружения с паролем
-        env = os.environ.copy()
-        env['PGPASSWORD'] = 'password'
-
-        # Выполняем команду
-        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-
-        if result.returncode == 0:
-            logger.info(f"Backup created successfully: {backup_filename}")
-            return True
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f"Snapshot {snapshot_id} not found or incomplete")
+
+
+def _write_manifest(snapshot_dir: str, manifest: dict) -> None:
+    """Манифест пишется последним и атомарно - по нему снимок считается завершенным."""
+    fd, temp_path = tempfile.mkstemp(dir=snapshot_dir, prefix=".manifest-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(snapshot_dir, MANIFEST_NAME))
+    _fsync_dir(snapshot_dir)
+
+
+def _fsync_dir(path: str) -> None:
+    """Сбрасывает на диск запись каталога, чтобы переименование пережило сбой питания."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def list_snapshots() -> list:
+    """Идентификаторы завершенных снимков, от старых к новым."""
+    root = _snapshots_root()
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, MANIFEST_NAME)))
+
+
+class _HashingWriter:
+    """Файл-обертка: считает SHA-256 записываемых данных."""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> int:
+        self.digest.update(chunk)
+        return self.f.write(chunk)
+
+
+def _copy_object(key: str, object_path: str) -> str:
+    """
+    Копирует объект хранилища в хранилище бэкапа, считая SHA-256 за тот же проход.
+    Объект сбрасывается на диск до переименования: манифест не сошлется на недописанный файл.
+    Возвращает хеш скопированного содержимого.
+    """
+    object_dir = os.path.dirname(object_path)
+    os.makedirs(object_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=object_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = _HashingWriter(f)
+            storage.read_into(key, writer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, object_path)
+        _fsync_dir(object_dir)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return writer.digest.hexdigest()
+
+
+def _snapshot_file(filename: str, content_hash: str, size: int, previous: dict) -> dict:
+    """
+    Добавляет файл изображения в снимок. Файл читается из хранилища, только если
+    его объекта еще нет в бэкапе (или у старого имени без content_hash изменились размер/mtime).
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    entry = {"filename": filename, "size": size, "hashed": False, "copied": False}
+    if not content_hash:
+        # Файл со старым именем (только локальное хранилище): хеш берем из прошлого снимка,
+        # если файл не менялся
+        source = storage.local_path(filename)
+        if source is None:
+            return {"filename": filename, "missing": True}
+        st = os.stat(source)
+        entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+        known = previous.get(filename)
+        if known and known["size"] == st.st_size and known.get("mtime_ns") == st.st_mtime_ns:
+            content_hash = os.path.basename(known["object"])[:64]
         else:
-            logger.error(f"Backup failed: {result.stderr}")
-            return False
+            content_hash = hash_file(source)
+            entry["hashed"] = True
 
-    except Exception as e:
-        logger.error(f"Backup error: {e}")
+    entry["object"] = blob_relpath(content_hash, ext)
+    object_path = os.path.join(_objects_root(), entry["object"])
+    if os.path.exists(object_path):
+        return entry
+
+    try:
+        actual_hash = _copy_object(filename, object_path)
+    except ObjectNotFoundError:
+        return {"filename": filename, "missing": True}
+    entry.update(copied=True, size=os.path.getsize(object_path))
+    if actual_hash != content_hash:
+        # Содержимое не совпадает с именем - сохраняем то, что реально лежит в хранилище
+        logger.error(f"Backup: content of {filename} does not match its hash {content_hash}")
+        entry["object"] = blob_relpath(actual_hash, ext)
+        os.replace(object_path, os.path.join(_objects_root(), entry["object"]))
+    return entry
+
+
+def _export_snapshot(conn) -> tuple:
+    """
+    Открывает транзакцию REPEATABLE READ и экспортирует ее снимок: pg_dump и список
+    файлов видят одно и то же состояние базы. Возвращает (id снимка, [(filename, hash, size)], число строк).
+    """
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_export_snapshot()")
+    snapshot_name = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM images")
+    rows = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT filename, MAX(content_hash), MAX(size) FROM images GROUP BY filename ORDER BY filename
+    """)
+    files = cursor.fetchall()
+    cursor.close()
+    return snapshot_name, files, rows
+
+
+def create_backup(prune: bool = True) -> dict:
+    """
+    Создает снимок: сжатый дамп базы в формате directory и инкрементальный набор файлов.
+    Возвращает манифест снимка.
+    """
+    with _backup_lock():
+        started = time.perf_counter()
+        snapshot_id = datetime.datetime.now().strftime(SNAPSHOT_ID_FORMAT)
+        snapshot_dir = os.path.join(_snapshots_root(), snapshot_id)
+        if os.path.exists(snapshot_dir):
+            raise BackupError(f"Snapshot {snapshot_id} already exists")
+        os.makedirs(snapshot_dir)
+
+        existing = list_snapshots()
+        previous_id = existing[-1] if existing else None
+        previous = {}
+        if previous_id:
+            previous = {entry["filename"]: entry
+                        for entry in load_manifest(previous_id)["images"]}
+
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            try:
+                snapshot_name, files, db_rows = _export_snapshot(conn)
+
+                # Дамп базы в том же снимке транзакции, параллельно по таблицам
+                dump_started = time.perf_counter()
+                _run([PG_DUMP, *_pg_args(), "-Fd", "-j", str(BACKUP_JOBS),
+                      "-Z", str(BACKUP_COMPRESS_LEVEL), f"--snapshot={snapshot_name}",
+                      "-f", os.path.join(snapshot_dir, DB_DUMP_NAME)])
+                dump_seconds = time.perf_counter() - dump_started
+            finally:
+                conn.close()
+
+            files_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=BACKUP_COPY_WORKERS) as pool:
+                entries = list(pool.map(
+                    lambda row: _snapshot_file(*row, previous), files
+                ))
+            files_seconds = time.perf_counter() - files_started
+
+            images = [entry for entry in entries if not entry.get("missing")]
+            missing = [entry["filename"] for entry in entries if entry.get("missing")]
+            for filename in missing:
+                logger.error(f"Backup: file referenced by the database is missing: {filename}")
+
+            copied = [entry for entry in images if entry["copied"]]
+            manifest = {
+                "version": MANIFEST_VERSION,
+                "id": snapshot_id,
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "previous": previous_id,
+                "db": {"dump": DB_DUMP_NAME, "format": "directory", "rows": db_rows,
+                       "compress_level": BACKUP_COMPRESS_LEVEL},
+                "images": [{key: entry[key] for key in ("filename", "object", "size", "mtime_ns")
+                            if key in entry}
+                           for entry in images],
+                "missing": missing,
+                "stats": {
+                    "files": len(images),
+                    "files_bytes": sum(entry["size"] for entry in images),
+                    "copied_files": len(copied),
+                    "copied_bytes": sum(entry["size"] for entry in copied),
+                    "hashed_files": sum(1 for entry in images if entry["hashed"]),
+                    "db_dump_bytes": _dir_size(os.path.join(snapshot_dir, DB_DUMP_NAME)),
+                    "db_dump_seconds": round(dump_seconds, 3),
+                    "files_seconds": round(files_seconds, 3),
+                    "total_seconds": round(time.perf_counter() - started, 3),
+                },
+            }
+            _write_manifest(snapshot_dir, manifest)
+        except BaseException:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            raise
+
+        logger.info(f"Backup created successfully: {snapshot_id} {manifest['stats']}")
+        if prune:
+            _prune()
+        return manifest
+
+
+def select_kept(snapshot_ids: list, keep_last: int = BACKUP_KEEP_LAST,
+                keep_daily: int = BACKUP_KEEP_DAILY, keep_weekly: int = BACKUP_KEEP_WEEKLY) -> set:
+    """
+    Политика хранения: последние keep_last снимков, плюс самый новый снимок
+    за каждый из последних keep_daily дней и keep_weekly недель.
+    """
+    newest_first = sorted(snapshot_ids, reverse=True)
+    kept = set(newest_first[:keep_last])
+    for limit, period in ((keep_daily, lambda d: d.date()),
+                          (keep_weekly, lambda d: d.isocalendar()[:2])):
+        seen = []
+        for snapshot_id in newest_first:
+            key = period(datetime.datetime.strptime(snapshot_id, SNAPSHOT_ID_FORMAT))
+            if key in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.append(key)
+            kept.add(snapshot_id)
+    return kept
+
+
+def _collect_garbage() -> tuple:
+    """Удаляет объекты, на которые не ссылается ни один снимок. Возвращает (файлов, байт)."""
+    referenced = set()
+    for snapshot_id in list_snapshots():
+        referenced.update(entry["object"] for entry in load_manifest(snapshot_id)["images"])
+
+    removed = removed_bytes = 0
+    root = _objects_root()
+    for dirpath, _dirs, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if os.path.relpath(path, root) not in referenced:
+                removed_bytes += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+    return removed, removed_bytes
+
+
+def _prune() -> dict:
+    """Удаляет снимки вне политики хранения и незавершенные снимки, затем лишние объекты."""
+    root = _snapshots_root()
+    complete = list_snapshots()
+    kept = select_kept(complete)
+    removed = [snapshot_id for snapshot_id in complete if snapshot_id not in kept]
+    incomplete = [name for name in os.listdir(root)
+                  if name not in complete] if os.path.isdir(root) else []
+    for name in removed + incomplete:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    objects, objects_bytes = (0, 0)
+    if removed or incomplete:
+        objects, objects_bytes = _collect_garbage()
+    result = {"removed_snapshots": removed, "removed_incomplete": incomplete,
+              "removed_objects": objects, "freed_object_bytes": objects_bytes}
+    logger.info(f"Backup prune: kept {len(kept)} snapshots, {result}")
+    return result
+
+
+def prune() -> dict:
+    """Очистка по политике хранения (BACKUP_KEEP_LAST / DAILY / WEEKLY)."""
+    with _backup_lock():
+        return _prune()
+
+
+def verify_snapshot(snapshot_id: str, full: bool = True) -> list:
+    """
+    Проверяет снимок: оглавление дампа читается pg_restore, все объекты на месте,
+    размеры (и при full - SHA-256) совпадают. Возвращает список проблем.
+    """
+    manifest = load_manifest(snapshot_id)
+    problems = []
+    dump_dir = os.path.join(_snapshots_root(), snapshot_id, manifest["db"]["dump"])
+    result = subprocess.run([PG_RESTORE, "--list", dump_dir], capture_output=True, text=True)
+    if result.returncode != 0:
+        problems.append(f"database dump is unreadable: {result.stderr.strip()}")
+
+    def check(entry: dict):
+        path = os.path.join(_objects_root(), entry["object"])
+        try:
+            if os.path.getsize(path) != entry["size"]:
+                return f"size mismatch: {entry['object']}"
+        except FileNotFoundError:
+            return f"missing object: {entry['object']}"
+        if full and hash_file(path) != os.path.basename(entry["object"])[:64]:
+            return f"checksum mismatch: {entry['object']}"
+        return None
+
+    objects = {entry["object"]: entry for entry in manifest["images"]}
+    with ThreadPoolExecutor(max_workers=BACKUP_COPY_WORKERS) as pool:
+        problems.extend(problem for problem in pool.map(check, objects.values()) if problem)
+    return problems
+
+
+def _restore_file(entry: dict, target) -> bool:
+    """Возвращает файл из снимка в хранилище. Возвращает True, если файл был скопирован."""
+    if target.exists(entry["filename"]):
         return False
+    fd, temp_path = tempfile.mkstemp(dir=target.spool_dir, prefix=".restore-")
+    os.close(fd)
+    try:
+        shutil.copyfile(os.path.join(_objects_root(), entry["object"]), temp_path)
+        return target.put(temp_path, entry["filename"])
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def restore_backup(snapshot_id: str, dbname: str = None, image_dir: str = None) -> dict:
+    """
+    Восстанавливает снимок: сначала полная проверка, затем файлы (в хранилище приложения
+    или в каталог image_dir), затем база (pg_restore -j N --clean), и в конце сверка
+    числа строк и наличия файлов. Файлы, которых нет в снимке, не удаляются.
+    """
+    target = LocalStorage(image_dir) if image_dir else storage
+    with _backup_lock():
+        manifest = load_manifest(snapshot_id)
+        problems = verify_snapshot(snapshot_id, full=True)
+        if problems:
+            raise BackupError(f"Snapshot {snapshot_id} failed verification: {problems[:10]}")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=BACKUP_COPY_WORKERS) as pool:
+            copied = sum(pool.map(lambda entry: _restore_file(entry, target),
+                                  manifest["images"]))
+        dump_dir = os.path.join(_snapshots_root(), snapshot_id, manifest["db"]["dump"])
+        _run([PG_RESTORE, *_pg_args(dbname), "-j", str(BACKUP_JOBS), "--clean", "--if-exists",
+              "--no-owner", dump_dir])
+
+        # Сверка восстановленной базы с манифестом
+        config = dict(DB_CONFIG, dbname=dbname or DB_CONFIG["dbname"])
+        conn = psycopg2.connect(**config)
+        try:
+            cursor = conn.cursor()
+            # pg_restore загружает данные без триггеров уведомлений: кеши списка у запущенных
+            # серверов этой базы сбрасываются явным NOTIFY
+            notify_changed(cursor, "RESTORE")
+            conn.commit()
+            cursor.execute("SELECT COUNT(*) FROM images")
+            rows = cursor.fetchone()[0]
+            cursor.execute("SELECT DISTINCT filename FROM images")
+            absent = [filename for (filename,) in cursor.fetchall()
+                      if not target.exists(filename)]
+            cursor.close()
+        finally:
+            conn.close()
+
+        if rows != manifest["db"]["rows"]:
+            raise BackupError(f"Restored {rows} rows, manifest expects {manifest['db']['rows']}")
+        if absent and set(absent) - set(manifest["missing"]):
+            raise BackupError(f"Restored rows reference missing files: {absent[:10]}")
+
+        result = {"snapshot": snapshot_id, "rows": rows, "files": len(manifest["images"]),
+                  "copied_files": copied, "seconds": round(time.perf_counter() - started, 3)}
+        logger.info(f"Backup restored successfully: {result}")
+        return result
+
+
+def _print_snapshots() -> None:
+    for snapshot_id in list_snapshots():
+        manifest = load_manifest(snapshot_id)
+        stats = manifest["stats"]
+        print(f"{snapshot_id}  rows={manifest['db']['rows']}  files={stats['files']}  "
+              f"copied={stats['copied_files']} ({stats['copied_bytes']} B)  "
+              f"db_dump={stats['db_dump_bytes']} B  {stats['total_seconds']} s")
 
 
 if __name__ == "__main__":
-    create_backup()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    backup_parser = commands.add_parser("backup", help="Создать снимок")
+    backup_parser.add_argument("--no-prune", action="store_true",
+                               help="Не удалять старые снимки после создания")
+    commands.add_parser("list", help="Список снимков")
+    verify_parser = commands.add_parser("verify", help="Проверить снимок")
+    verify_parser.add_argument("snapshot")
+    verify_parser.add_argument("--quick", action="store_true",
+                               help="Проверять только наличие и размер объектов, без SHA-256")
+    restore_parser = commands.add_parser("restore", help="Восстановить снимок")
+    restore_parser.add_argument("snapshot")
+    restore_parser.add_argument("--dbname", help="Восстановить в другую базу (по умолчанию - рабочая)")
+    restore_parser.add_argument("--image-dir",
+                                help="Восстановить файлы в этот каталог, а не в хранилище приложения")
+    commands.add_parser("prune", help="Удалить снимки по политике хранения")
+    args = parser.parse_args()
+
+    try:
+        if args.command in (None, "backup"):
+            create_backup(prune=not getattr(args, "no_prune", False))
+        elif args.command == "list":
+            _print_snapshots()
+        elif args.command == "verify":
+            problems = verify_snapshot(args.snapshot, full=not args.quick)
+            for problem in problems:
+                print(problem)
+            print("OK" if not problems else f"{len(problems)} problems")
+            raise SystemExit(1 if problems else 0)
+        elif args.command == "restore":
+            restore_backup(args.snapshot, dbname=args.dbname, image_dir=args.image_dir)
+        elif args.command == "prune":
+            prune()
+    except BackupError as e:
+        logger.error(f"Backup error: {e}")
+        raise SystemExit(1)
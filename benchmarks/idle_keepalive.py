@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: задержка запросов при большом числе простаивающих keep-alive соединений.
+Запускается против сервера в разных режимах (SERVER_MODE=threaded / async) для сравнения.
+
+Пример:
+    SERVER_MODE=async python app.py
+    python benchmarks/idle_keepalive.py --url http://localhost:8000 --idle 2000 --clients 16
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+OPEN_CONCURRENCY = 100
+
+
+def read_response(sock: socket.socket) -> bytes:
+    """Читает один ответ целиком (заголовки и тело по Content-Length). Возвращает строку статуса."""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    head, body = data.split(b"\r\n\r\n", 1)
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    while len(body) < length:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        body += chunk
+    return head.split(b"\r\n", 1)[0]
+
+
+def open_idle_connection(host: str, port: int, path: str, timeout: float):
+    """Открывает соединение, делает один запрос и оставляет его открытым. Возвращает сокет или None."""
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode()
+    sock = None
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.sendall(request)
+        if b" 200" in read_response(sock):
+            sock.settimeout(10)
+            return sock
+    except OSError:
+        pass
+    if sock is not None:
+        sock.close()
+    return None
+
+
+def open_idle_connections(host: str, port: int, count: int, path: str, timeout: float) -> tuple:
+    """Параллельно открывает count простаивающих соединений. Возвращает (сокеты, отказы)."""
+    with ThreadPoolExecutor(max_workers=OPEN_CONCURRENCY) as pool:
+        results = list(pool.map(lambda _: open_idle_connection(host, port, path, timeout),
+                                range(count)))
+    sockets = [sock for sock in results if sock is not None]
+    return sockets, count - len(sockets)
+
+
+def client(host: str, port: int, path: str, deadline: float, latencies: list, errors: list) -> None:
+    """Последовательно отправляет запросы по одному keep-alive соединению."""
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+                conn.close()
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            errors.append(type(e).__name__)
+            conn.close()
+    conn.close()
+
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль по отсортированному списку."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--idle", type=int, default=2000, help="Число простаивающих соединений")
+    parser.add_argument("--clients", type=int, default=16, help="Число активных клиентов")
+    parser.add_argument("--duration", type=float, default=10.0, help="Длительность замера, с")
+    parser.add_argument("--open-timeout", type=float, default=2.0,
+                        help="Сколько ждать ответа при открытии простаивающего соединения, с")
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+
+    started = time.perf_counter()
+    idle, refused = open_idle_connections(host, port, args.idle, args.path,
+                                         args.open_timeout)
+    open_seconds = time.perf_counter() - started
+
+    latencies, errors = [], []
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=client, args=(host, port, args.path, deadline, latencies, errors))
+        for _ in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Сколько простаивающих соединений сервер держал до конца замера
+    alive = 0
+    probe = f"GET {args.path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+    for sock in idle:
+        try:
+            sock.sendall(probe)
+            if b" 200" in read_response(sock):
+                alive += 1
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    print(json.dumps({
+        "url": args.url,
+        "idle_requested": args.idle,
+        "idle_opened": len(idle),
+        "idle_refused": refused,
+        "idle_alive_after": alive,
+        "idle_open_seconds": round(open_seconds, 2),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / args.duration, 1),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: задержка /images-list во время параллельных больших загрузок.
+
+Пример:
+    python benchmarks/list_under_upload.py --url http://localhost:8000 --uploaders 8
+
+Загрузки идут с одного адреса, поэтому сервер запускается без лимита частоты (UPLOAD_RATE=0).
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.request
+import uuid
+
+from PIL import Image
+
+
+def make_upload_body(size_px: int) -> tuple:
+    """Создает multipart тело с PNG из случайного шума (почти несжимаемым)."""
+    img = Image.frombytes("RGB", (size_px, size_px), os.urandom(size_px * size_px * 3))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench.png"\r\n'
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode("utf-8") + buf.getvalue() + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def uploader(url: str, body: bytes, content_type: str, stop: threading.Event,
+             counter: list) -> None:
+    """Непрерывно отправляет загрузки, пока не установлен stop."""
+    while not stop.is_set():
+        req = urllib.request.Request(f"{url}/upload", data=body, method="POST",
+                                     headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                resp.read()
+            counter[0] += 1
+        except Exception:
+            counter[1] += 1
+
+
+def measure_list(url: str, duration: float) -> list:
+    """Последовательно запрашивает /images-list и возвращает задержки в мс."""
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{url}/images-list?page=1", timeout=60) as resp:
+            resp.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values: list, p: float) -> float:
+    """Возвращает p-й перцентиль списка."""
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(latencies: list) -> dict:
+    """Считает сводную статистику по задержкам."""
+    return {
+        "requests": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--uploaders", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--image-px", type=int, default=1200, help="Сторона тестового PNG")
+    args = parser.parse_args()
+
+    baseline = summarize(measure_list(args.url, args.duration))
+
+    body, content_type = make_upload_body(args.image_px)
+    stop = threading.Event()
+    counter = [0, 0]  # успешные, ошибочные загрузки
+    threads = [threading.Thread(target=uploader, args=(args.url, body, content_type, stop, counter),
+                                daemon=True) for _ in range(args.uploaders)]
+    for t in threads:
+        t.start()
+    try:
+        loaded = summarize(measure_list(args.url, args.duration))
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    print(json.dumps({
+        "upload_body_bytes": len(body),
+        "uploaders": args.uploaders,
+        "uploads_ok": counter[0],
+        "uploads_failed": counter[1],
+        "images_list_idle": baseline,
+        "images_list_under_upload": loaded,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,842 @@
+#!/usr/bin/env python3
+"""
+Набор нагрузочных тестов ImageServer. Запускает app.py против отдельной базы
+с таблицей images заданного размера, воспроизводит смешанную нагрузку (загрузки
+разных размеров, первая и глубокие страницы списка, отдача изображений и уменьшенных
+копий, удаления) и пишет результат в JSON: перцентили задержек, пропускную способность,
+память процессов сервера, время запуска и стоимость проб /livez, /readyz, /health.
+Результаты разных коммитов сравниваются командой compare.
+
+Примеры:
+    python benchmarks/suite.py run --rows 10000 --concurrency 16 --duration 30 --output base.json
+    python benchmarks/suite.py run --rows 1000000 --mix list=40,deep=20,cursor=20,get=20
+    python benchmarks/suite.py run --server-env SERVER_MODE=async --output async.json
+    python benchmarks/suite.py run --url http://localhost:8000 --server-pid 1234   # свой сервер
+    python benchmarks/suite.py compare base.json new.json --threshold 10
+"""
+
+import argparse
+import base64
+import datetime
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import parse_qs, urlparse
+
+import psycopg2
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "upload=10,list=20,deep=10,cursor=10,search=5,similar=5,get=30,thumb=5,delete=5"
+OPERATIONS = ("upload", "list", "deep", "cursor", "search", "similar", "get", "thumb", "delete")
+UPLOAD_PREFIX = "bench-"  # original_name загрузок теста (остальные строки - заполнение)
+SEED_VERSION = "bench-seed v3"  # комментарий таблицы images; при смене схемы заполнения оно пересоздается
+SEED_BATCH = 1_000_000  # строк на транзакцию при заполнении
+PAGE_LIMIT = 20
+CURSOR_SAMPLES = 1000  # случайных позиций для keyset-пагинации
+RSS_SAMPLE_INTERVAL = 0.5  # секунды
+STARTUP_POLL_INTERVAL = 0.005  # секунды между попытками /livez и /readyz при запуске
+PROBE_PATHS = ("/livez", "/readyz", "/health")
+PROBE_REQUESTS = 500
+PG_STATS_FLUSH_WAIT = 1.2  # секунды; статистика сессий сбрасывается в pg_stat не чаще раза в секунду
+BROWSER_ACCEPT = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+
+# Строки генерируются в базе: имя блоба - по SHA-256 номера, время - по секунде на строку,
+# тип (jpg 60%%, png 30%%, gif 10%%), размер до 5 МБ и исходное имя - для фильтров и поиска,
+# перцептивный хеш - случайные 64 бита из того же SHA-256
+SEED_SQL = """
+    INSERT INTO images (filename, original_name, size, upload_time, file_type, content_hash, phash)
+    SELECT substr(h, 1, 2) || '/' || substr(h, 3, 2) || '/' || h || ext,
+           (ARRAY['IMG_', 'photo-', 'screenshot ', 'holiday_', 'cat-', 'sunset_', 'scan', 'avatar-'])
+               [1 + i %% 8] || i || ext,
+           1024 + ('x' || substr(h, 1, 6))::bit(24)::int %% (5 * 1024 * 1024),
+           timestamp '2020-01-01' + i * interval '1 second', ext, h,
+           ('x' || substr(h, 7, 16))::bit(64)::bigint
+    FROM (
+        SELECT i, encode(sha256(convert_to('seed-' || i, 'UTF8')), 'hex') AS h,
+               CASE WHEN i %% 10 < 6 THEN '.jpg' WHEN i %% 10 < 9 THEN '.png' ELSE '.gif' END AS ext
+        FROM generate_series(%s, %s) AS i
+    ) seeded
+"""
+
+# Запросы с фильтрами: для операции search и проверки планов (EXPLAIN) после заполнения
+SEARCH_CASES = {
+    "type": "file_type=gif",
+    "size": "min_size=1000000&max_size=1100000",
+    "date": "date_from=2020-01-02&date_to=2020-01-02",
+    "type_date": "file_type=png&date_from=2020-01-05&date_to=2020-01-06",
+    "prefix": "prefix=sunset_12",
+    "substring": "q=shot%2012",
+    "combined": "file_type=jpg&min_size=4000000&prefix=img",
+}
+# Пороги поиска похожих: по индексам частей хеша (радиус 0 и 1) и сканированием таблицы
+SIMILAR_DISTANCES = (3, 4, 8, 12)
+
+
+def log(message: str) -> None:
+    print(f"[bench] {message}", file=sys.stderr, flush=True)
+
+
+# --- База данных ---
+
+def db_params(args, dbname: str) -> dict:
+    return {"dbname": dbname, "user": args.db_user, "password": args.db_password,
+            "host": args.db_host, "port": args.db_port, "connect_timeout": 5}
+
+
+def ensure_database(args) -> None:
+    """Создает базу для тестов, если ее нет (рабочая база не затрагивается)."""
+    conn = psycopg2.connect(**db_params(args, "postgres"))
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (args.db_name,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{args.db_name}"')
+            log(f"Created database {args.db_name}")
+    conn.close()
+
+
+def prepare_table(args) -> int:
+    """
+    Удаляет строки прошлых запусков и дозаполняет таблицу до args.rows строк.
+    Заполнение идет пачками по SEED_BATCH и продолжается с места остановки.
+    """
+    conn = psycopg2.connect(**db_params(args, args.db_name))
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM images WHERE original_name LIKE %s", (UPLOAD_PREFIX + "%",))
+        cursor.execute("TRUNCATE image_variants, jobs")
+        conn.commit()
+        cursor.execute("SELECT total_count, obj_description('images'::regclass) FROM images_counter")
+        seeded, version = cursor.fetchone()
+        if seeded > args.rows or version != SEED_VERSION:
+            cursor.execute("TRUNCATE images RESTART IDENTITY")
+            cursor.execute(f"COMMENT ON TABLE images IS '{SEED_VERSION}'")
+            conn.commit()
+            seeded = 0
+        inserted = seeded < args.rows
+        while seeded < args.rows:
+            batch = min(SEED_BATCH, args.rows - seeded)
+            cursor.execute(SEED_SQL, (seeded + 1, seeded + batch))
+            conn.commit()
+            seeded += batch
+            log(f"Seeded {seeded}/{args.rows} rows")
+        if inserted:
+            cursor.execute("ANALYZE images")
+            conn.commit()
+    conn.close()
+    return seeded
+
+
+def collect_pools(args, exclude: set = frozenset()) -> tuple:
+    """Файлы и id строк, созданных загрузками теста: для GET и DELETE."""
+    conn = psycopg2.connect(**db_params(args, args.db_name))
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, filename FROM images WHERE original_name LIKE %s ORDER BY id
+        """, (UPLOAD_PREFIX + "%",))
+        rows = [row for row in cursor.fetchall() if row[1] not in exclude]
+    conn.close()
+    return rows
+
+
+def sample_cursors(args) -> list:
+    """Случайные позиции (upload_time, id) для запросов со cursor=."""
+    conn = psycopg2.connect(**db_params(args, args.db_name))
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MIN(id), MAX(id) FROM images")
+        low, high = cursor.fetchone()
+        if low is None:
+            return []
+        ids = [random.randint(low, high) for _ in range(CURSOR_SAMPLES)]
+        cursor.execute("SELECT upload_time, id FROM images WHERE id = ANY(%s)", (ids,))
+        positions = cursor.fetchall()
+    conn.close()
+    # Тот же формат, что pagination.encode_cursor
+    return [base64.urlsafe_b64encode(f"{ts.isoformat()}|{image_id}".encode()).decode().rstrip("=")
+            for ts, image_id in positions]
+
+
+def _plan_summary(plan: dict) -> dict:
+    """Время выполнения, использованные индексы и наличие полного чтения images."""
+    indexes, seq_scan = set(), False
+    stack = [plan["Plan"]]
+    while stack:
+        node = stack.pop()
+        if "Index Name" in node:
+            indexes.add(node["Index Name"])
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") == "images":
+            seq_scan = True
+        stack.extend(node.get("Plans", []))
+    return {"ms": round(plan["Execution Time"], 3), "indexes": sorted(indexes), "seq_scan": seq_scan}
+
+
+def explain_searches(args) -> dict:
+    """
+    EXPLAIN ANALYZE запросов с фильтрами из SEARCH_CASES - тех же SQL, что строит /images-list.
+    Полное чтение таблицы отмечается в результате и в журнале.
+    """
+    os.environ.setdefault("LOG_FILE", os.path.join(args.data_dir, "suite.log"))
+    sys.path.insert(0, REPO_DIR)
+    from image_search import SEARCH_COUNT_LIMIT, count_query, list_query, parse_filters
+    from near_duplicates import similar_query
+
+    plans = {}
+    conn = psycopg2.connect(**db_params(args, args.db_name))
+    with conn.cursor() as cursor:
+        for name, query in SEARCH_CASES.items():
+            filters = parse_filters(parse_qs(query))
+            plans[name] = {"query": query}
+            # Как в /images-list: по результату подсчета выбирается вид запроса страницы
+            cursor.execute(*count_query(filters))
+            selective = cursor.fetchone()[0] <= SEARCH_COUNT_LIMIT
+            for kind, (sql, params) in (
+                    ("list", list_query(filters, PAGE_LIMIT + 1, selective=selective)),
+                    ("count", count_query(filters))):
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+                plans[name][kind] = _plan_summary(cursor.fetchone()[0][0])
+                if plans[name][kind]["seq_scan"]:
+                    log(f"Search '{name}' ({kind}) scans the whole images table")
+        cursor.execute("SELECT id, phash FROM images WHERE phash IS NOT NULL ORDER BY id LIMIT 1")
+        row = cursor.fetchone()
+        for distance in SIMILAR_DISTANCES if row else ():
+            image_id, phash = row
+            sql, params = similar_query(phash & (2 ** 64 - 1), distance, 20, exclude_id=image_id)
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            plans[f"similar_{distance}"] = {"distance": distance,
+                                            "list": _plan_summary(cursor.fetchone()[0][0])}
+    conn.rollback()
+    conn.close()
+    return plans
+
+
+# --- Сервер ---
+
+def start_server(args) -> tuple:
+    """
+    Запускает app.py с отдельными каталогами данных в args.data_dir.
+    Возвращает (процесс, время запуска до /livez и /readyz).
+    """
+    data_dir = args.data_dir
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    env = dict(os.environ)
+    env.update({
+        "DB_NAME": args.db_name, "DB_HOST": args.db_host, "DB_PORT": str(args.db_port),
+        "DB_USER": args.db_user, "DB_PASSWORD": args.db_password,
+        "SERVER_PORT": str(args.port),
+        "UPLOAD_DIR": os.path.join(data_dir, "image"),
+        "THUMBNAIL_DIR": os.path.join(data_dir, "thumbnails"),
+        "STORAGE_SPOOL_DIR": os.path.join(data_dir, "spool"),
+        "STORAGE_CACHE_DIR": os.path.join(data_dir, "storage_cache"),
+        "METRICS_DIR": os.path.join(data_dir, "metrics"),
+        "LOG_FILE": os.path.join(data_dir, "server.log"),
+        # Все загрузки идут с одного адреса; лимит частоты включается через --server-env
+        "UPLOAD_RATE": "0",
+    })
+    for item in args.server_env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    output = open(os.path.join(data_dir, "server.out"), "wb")
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "app.py")], cwd=data_dir,
+                               env=env, stdout=output, stderr=subprocess.STDOUT)
+    # Время от запуска процесса до ответа /livez (сокет слушается) и до готовности /readyz
+    deadline = started + args.startup_timeout
+    timings = {}
+    for name, path in (("listen_ms", "/livez"), ("ready_ms", "/readyz")):
+        body = _wait_for_status(process, args.port, path, deadline, output.name)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    # Этапы запуска по измерению самого сервера (проверка схемы, загрузка статики)
+    timings["server"] = body.get("startup", {})
+    return process, timings
+
+
+def _wait_for_status(process: subprocess.Popen, port: int, path: str, deadline: float,
+                     output_name: str) -> dict:
+    """Опрашивает path запускаемого сервера до ответа 200. Возвращает тело ответа."""
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}, see {output_name}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+            if response.status == 200:
+                return json.loads(body)
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(STARTUP_POLL_INTERVAL)
+    stop_server(process)
+    raise RuntimeError(f"Server did not answer {path} in time")
+
+
+def measure_startup(args, runs: int) -> dict:
+    """
+    Перезапускает сервер runs раз при уже актуальной схеме и заполненной таблице.
+    Возвращает медианы времени до /livez и /readyz и этапов запуска по данным сервера.
+    """
+    samples = []
+    for _ in range(runs):
+        process, timings = start_server(args)
+        stop_server(process)
+        samples.append(timings)
+    result = {name: round(statistics.median(sample[name] for sample in samples), 1)
+              for name in ("listen_ms", "ready_ms")}
+    result["server"] = {name: round(statistics.median(sample["server"].get(name, 0) for sample in samples), 1)
+                        for name in samples[0]["server"]}
+    result["runs"] = runs
+    return result
+
+
+def _xact_count(args) -> int:
+    """Завершенные транзакции базы теста (pg_stat_database обновляется с задержкой до секунды)."""
+    time.sleep(PG_STATS_FLUSH_WAIT)
+    conn = psycopg2.connect(**db_params(args, args.db_name))
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = %s",
+                       (args.db_name,))
+        count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+def measure_probes(args, host: str, port: int, count: int = PROBE_REQUESTS) -> dict:
+    """
+    Стоимость проб оркестратора: задержка последовательных /livez, /readyz, /health по
+    одному keep-alive соединению и транзакции Postgres на пробу (включая фоновые).
+    """
+    result = {}
+    for path in PROBE_PATHS:
+        before = _xact_count(args)
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            conn.request("GET", path)
+            conn.getresponse().read()
+            latencies.append((time.perf_counter() - started) * 1000)
+        conn.close()
+        result[path.lstrip("/")] = {
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "db_xacts_per_probe": round((_xact_count(args) - before - 1) / count, 3),
+        }
+    return result
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree(root_pid: int) -> list:
+    """PID процесса и всех его потомков (prefork-процессы, пул обработки изображений)."""
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def _read_kb(path: str, field: str) -> int:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class MemorySampler:
+    """
+    Периодически суммирует память дерева процессов сервера: RSS (общие страницы
+    prefork-процессов считаются несколько раз) и PSS (доля общих страниц).
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.samples = []  # (rss_kb, pss_kb, процессов)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return {}
+        rss = [sample[0] / 1024 for sample in self.samples]
+        pss = [sample[1] / 1024 for sample in self.samples]
+        return {
+            "rss_mb": {"start": round(rss[0], 1), "end": round(rss[-1], 1),
+                       "peak": round(max(rss), 1), "mean": round(sum(rss) / len(rss), 1)},
+            "pss_mb": {"end": round(pss[-1], 1), "peak": round(max(pss), 1)},
+            "processes": max(sample[2] for sample in self.samples),
+        }
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            pids = process_tree(self.pid)
+            rss = sum(_read_kb(f"/proc/{pid}/status", "VmRSS") for pid in pids)
+            pss = sum(_read_kb(f"/proc/{pid}/smaps_rollup", "Pss") for pid in pids)
+            if rss:
+                self.samples.append((rss, pss, len(pids)))
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+
+# --- Нагрузка ---
+
+def make_png(size_kb: int) -> bytes:
+    """PNG из шума (почти несжимаемый) размером около size_kb."""
+    side = max(8, int((size_kb * 1024 / 3) ** 0.5))
+    img = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def unique_png(png: bytes) -> bytes:
+    """Добавляет после IHDR чанк tEXt со случайным значением: каждая загрузка - новый блоб."""
+    data = b"bench\x00" + uuid.uuid4().hex.encode()
+    chunk = (struct.pack(">I", len(data)) + b"tEXt" + data
+             + struct.pack(">I", zlib.crc32(b"tEXt" + data) & 0xffffffff))
+    ihdr_end = 8 + 25  # сигнатура + чанк IHDR
+    return png[:ihdr_end] + chunk + png[ihdr_end:]
+
+
+def multipart_body(png: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+            f"filename=\"{UPLOAD_PREFIX}{boundary[:8]}.png\"\r\nContent-Type: image/png\r\n\r\n").encode()
+    body += png + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль с линейной интерполяцией между соседними значениями."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Workload:
+    """Общее состояние теста: пулы файлов и id, счетчики и задержки по операциям."""
+
+    def __init__(self, args, host: str, port: int, total_rows: int, get_pool: list,
+                 delete_pool: list, cursors: list):
+        self.args = args
+        self.host = host
+        self.port = port
+        self.total_rows = total_rows
+        self.get_pool = get_pool
+        self.delete_pool = delete_pool
+        self.cursors = cursors
+        self.bodies = [make_png(size_kb) for size_kb in args.upload_kb]
+        self.get_keys = {filename for _id, filename in get_pool}
+        self._lock = threading.Lock()
+        self.recording = False
+        self.results = {op: {"latencies": [], "statuses": {}, "errors": 0, "bytes_sent": 0}
+                        for op in OPERATIONS}
+        ops, weights = zip(*args.mix.items())
+        self.ops, self.weights = list(ops), list(weights)
+
+    def _record(self, op: str, status, latency: float, bytes_sent: int = 0) -> None:
+        if not self.recording:
+            return
+        with self._lock:
+            result = self.results[op]
+            result["statuses"][str(status)] = result["statuses"].get(str(status), 0) + 1
+            if isinstance(status, int) and status < 400:
+                result["latencies"].append(latency * 1000)
+                result["bytes_sent"] += bytes_sent
+            else:
+                result["errors"] += 1
+
+    def _request(self, conn_holder: list, op: str, method: str, path: str, body: bytes = None,
+                 headers: dict = None) -> tuple:
+        """Выполняет запрос по keep-alive соединению потока. Возвращает (статус, тело)."""
+        started = time.perf_counter()
+        try:
+            if conn_holder[0] is None:
+                conn_holder[0] = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            conn = conn_holder[0]
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+            status = response.status
+            if response.will_close:
+                conn.close()
+                conn_holder[0] = None
+        except (OSError, http.client.HTTPException) as e:
+            if conn_holder[0] is not None:
+                conn_holder[0].close()
+                conn_holder[0] = None
+            self._record(op, type(e).__name__, time.perf_counter() - started)
+            return None, b""
+        self._record(op, status, time.perf_counter() - started, len(body or b""))
+        return status, data
+
+    def run_one(self, conn_holder: list, op: str) -> None:
+        if op == "upload":
+            body, content_type = multipart_body(unique_png(random.choice(self.bodies)))
+            self._request(conn_holder, op, "POST", "/upload", body, {"Content-Type": content_type})
+        elif op == "list":
+            self._request(conn_holder, op, "GET", f"/images-list?limit={PAGE_LIMIT}")
+        elif op == "deep":
+            pages = max(1, self.total_rows // PAGE_LIMIT)
+            page = random.randint(max(1, pages // 2), pages)  # вторая половина таблицы: большой OFFSET
+            self._request(conn_holder, op, "GET", f"/images-list?limit={PAGE_LIMIT}&page={page}")
+        elif op == "cursor" and self.cursors:
+            self._request(conn_holder, op, "GET",
+                          f"/images-list?limit={PAGE_LIMIT}&cursor={random.choice(self.cursors)}")
+        elif op == "search":
+            query = random.choice(list(SEARCH_CASES.values()))
+            self._request(conn_holder, op, "GET", f"/images-list?limit={PAGE_LIMIT}&{query}")
+        elif op == "similar":
+            image_id = random.randint(1, max(1, self.total_rows))
+            self._request(conn_holder, op, "GET", f"/images-similar/{image_id}")
+        elif op in ("get", "thumb") and self.get_pool:
+            _id, filename = random.choice(self.get_pool)
+            query = "?w=160&fmt=webp" if op == "thumb" else ""
+            self._request(conn_holder, op, "GET", f"/images/{filename}{query}",
+                          headers={"Accept": BROWSER_ACCEPT})
+        elif op == "delete":
+            image_id = self._next_deletable()
+            if image_id is not None:
+                self._request(conn_holder, op, "DELETE", f"/delete/{image_id}")
+
+    def _next_deletable(self):
+        """id строки, созданной загрузкой теста; пул пополняется из базы."""
+        with self._lock:
+            if self.delete_pool:
+                return self.delete_pool.pop()[0]
+        refill = collect_pools(self.args, exclude=self.get_keys)
+        with self._lock:
+            if not self.delete_pool:
+                self.delete_pool.extend(refill)
+                random.shuffle(self.delete_pool)
+            return self.delete_pool.pop()[0] if self.delete_pool else None
+
+    def worker(self, deadline: float) -> None:
+        conn_holder = [None]
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            self.run_one(conn_holder, rng.choices(self.ops, self.weights)[0])
+        if conn_holder[0] is not None:
+            conn_holder[0].close()
+
+    def run_phase(self, seconds: float, concurrency: int) -> float:
+        """Запускает concurrency потоков на seconds секунд. Возвращает фактическую длительность."""
+        started = time.monotonic()
+        deadline = started + seconds
+        threads = [threading.Thread(target=self.worker, args=(deadline,)) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+    def summary(self, elapsed: float) -> dict:
+        operations = {}
+        total_requests = total_errors = 0
+        for op, result in self.results.items():
+            latencies = result["latencies"]
+            requests = len(latencies) + result["errors"]
+            if not requests:
+                continue
+            total_requests += requests
+            total_errors += result["errors"]
+            operations[op] = {
+                "requests": requests,
+                "errors": result["errors"],
+                "statuses": result["statuses"],
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                    "p50": round(percentile(latencies, 50), 3),
+                    "p90": round(percentile(latencies, 90), 3),
+                    "p99": round(percentile(latencies, 99), 3),
+                    "p999": round(percentile(latencies, 99.9), 3),
+                    "max": round(max(latencies), 3) if latencies else 0.0,
+                },
+            }
+            if op == "upload":
+                operations[op]["upload_mb_per_sec"] = round(result["bytes_sent"] / elapsed / 2 ** 20, 3)
+        return {
+            "totals": {"requests": total_requests, "errors": total_errors,
+                       "throughput_rps": round((total_requests - total_errors) / elapsed, 2),
+                       "duration_seconds": round(elapsed, 3)},
+            "operations": operations,
+        }
+
+
+def git_revision() -> dict:
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=REPO_DIR, capture_output=True, text=True,
+                                  timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def warm_up_uploads(workload: Workload, count: int, concurrency: int) -> None:
+    """Загрузки, файлы которых затем отдаются (GET) и удаляются (DELETE) во время теста."""
+    remaining = [count]
+    lock = threading.Lock()
+
+    def upload_loop():
+        conn_holder = [None]
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            workload.run_one(conn_holder, "upload")
+        if conn_holder[0] is not None:
+            conn_holder[0].close()
+
+    threads = [threading.Thread(target=upload_loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(args) -> dict:
+    process = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+        server_pid = args.server_pid
+    else:
+        host, port = "127.0.0.1", args.port
+        ensure_database(args)
+        log("Starting server...")
+        process, _timings = start_server(args)
+        server_pid = process.pid
+
+    try:
+        log(f"Preparing images table ({args.rows} rows)...")
+        prepare_table(args)
+        plans = explain_searches(args) if args.explain else {}
+        log("Measuring probe cost...")
+        probes = measure_probes(args, host, port)
+
+        workload = Workload(args, host, port, args.rows, [], [], [])
+        warm_up_uploads(workload, args.warmup_uploads, args.concurrency)
+        uploaded = collect_pools(args)
+        half = len(uploaded) // 2
+        workload.get_pool = uploaded[:half]
+        workload.get_keys = {filename for _id, filename in workload.get_pool}
+        workload.delete_pool = uploaded[half:]
+        workload.cursors = sample_cursors(args)
+
+        if args.warmup > 0:
+            log(f"Warm-up {args.warmup}s...")
+            workload.run_phase(args.warmup, args.concurrency)
+
+        sampler = MemorySampler(server_pid) if server_pid else None
+        if sampler:
+            sampler.start()
+        log(f"Measuring {args.duration}s with concurrency {args.concurrency}...")
+        workload.recording = True
+        elapsed = workload.run_phase(args.duration, args.concurrency)
+        workload.recording = False
+        memory = sampler.stop() if sampler else {}
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    startup = {}
+    if process is not None and args.startup_runs > 0:
+        log(f"Measuring startup ({args.startup_runs} restarts)...")
+        startup = measure_startup(args, args.startup_runs)
+
+    result = {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "rows": args.rows,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+            "upload_kb": args.upload_kb,
+            "server_env": args.server_env,
+            "external_server": bool(args.url),
+        },
+        **workload.summary(elapsed),
+        "memory": memory,
+        "startup": startup,
+        "probes": probes,
+        "search_plans": plans,
+    }
+    return result
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """Печатает изменения по операциям. Возвращает True, если есть регрессия больше threshold %."""
+    regressed = False
+    print(f"baseline {baseline['meta'].get('commit', '')[:10]}  ->  "
+          f"current {current['meta'].get('commit', '')[:10]}")
+    print(f"{'operation':<10} {'rps':>10} {'change':>8} {'p50 ms':>10} {'change':>8} "
+          f"{'p99 ms':>10} {'change':>8}")
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
+
+    for op in OPERATIONS:
+        old, new = baseline["operations"].get(op), current["operations"].get(op)
+        if not old or not new:
+            continue
+        rps = change(old["throughput_rps"], new["throughput_rps"])
+        p50 = change(old["latency_ms"]["p50"], new["latency_ms"]["p50"])
+        p99 = change(old["latency_ms"]["p99"], new["latency_ms"]["p99"])
+        flag = ""
+        if rps < -threshold or p99 > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{op:<10} {new['throughput_rps']:>10.1f} {rps:>+7.1f}% "
+              f"{new['latency_ms']['p50']:>10.2f} {p50:>+7.1f}% "
+              f"{new['latency_ms']['p99']:>10.2f} {p99:>+7.1f}%{flag}")
+    old_rss = baseline.get("memory", {}).get("rss_mb", {}).get("peak")
+    new_rss = current.get("memory", {}).get("rss_mb", {}).get("peak")
+    if old_rss and new_rss:
+        print(f"{'peak RSS':<10} {new_rss:>10.1f} MB {change(old_rss, new_rss):>+7.1f}%")
+
+    old_startup, new_startup = baseline.get("startup") or {}, current.get("startup") or {}
+    for name in ("listen_ms", "ready_ms"):
+        if old_startup.get(name) and new_startup.get(name):
+            delta = change(old_startup[name], new_startup[name])
+            flag = "  REGRESSION" if delta > threshold else ""
+            regressed = regressed or bool(flag)
+            print(f"{'startup ' + name:<18} {new_startup[name]:>10.1f} ms {delta:>+7.1f}%{flag}")
+    for probe, new in (current.get("probes") or {}).items():
+        old = (baseline.get("probes") or {}).get(probe)
+        if not old:
+            continue
+        delta = change(old["p99_ms"], new["p99_ms"])
+        # Новые обращения к базе на пробу - регрессия независимо от задержки
+        flag = "  REGRESSION" if delta > threshold or \
+            new["db_xacts_per_probe"] > old["db_xacts_per_probe"] + 0.5 else ""
+        regressed = regressed or bool(flag)
+        print(f"{'probe ' + probe:<18} {new['p99_ms']:>10.3f} ms p99 {delta:>+7.1f}%  "
+              f"{new['db_xacts_per_probe']:.2f} db xacts/probe{flag}")
+    return regressed
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'. Allowed: {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Запустить тест")
+    run_parser.add_argument("--rows", type=int, default=10_000, help="Строк в таблице images")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="Параллельных клиентов")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Секунд измерения")
+    run_parser.add_argument("--warmup", type=float, default=5.0, help="Секунд прогрева без записи")
+    run_parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                            help=f"Веса операций (по умолчанию {DEFAULT_MIX})")
+    run_parser.add_argument("--upload-kb", type=lambda v: [int(x) for x in v.split(",")],
+                            default=[32, 256, 1024], help="Размеры загружаемых PNG, КБ")
+    run_parser.add_argument("--warmup-uploads", type=int, default=200,
+                            help="Загрузок до теста (файлы для GET и DELETE)")
+    run_parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                            help="Переменная окружения сервера (например SERVER_MODE=prefork)")
+    run_parser.add_argument("--url", help="Тестировать уже запущенный сервер (с той же базой)")
+    run_parser.add_argument("--server-pid", type=int, help="PID уже запущенного сервера для замера памяти")
+    run_parser.add_argument("--port", type=int, default=8099, help="Порт запускаемого сервера")
+    run_parser.add_argument("--startup-timeout", type=float, default=60.0)
+    run_parser.add_argument("--startup-runs", type=int, default=3,
+                            help="Перезапусков для замера времени старта (0 - без замера)")
+    run_parser.add_argument("--data-dir", default="/tmp/image_hosting_bench",
+                            help="Каталог файлов запускаемого сервера (очищается)")
+    run_parser.add_argument("--db-host", default=os.environ.get("DB_HOST", "127.0.0.1"))
+    run_parser.add_argument("--db-port", type=int, default=int(os.environ.get("DB_PORT", "5432")))
+    run_parser.add_argument("--db-user", default=os.environ.get("DB_USER", "postgres"))
+    run_parser.add_argument("--db-password", default=os.environ.get("DB_PASSWORD", "password"))
+    run_parser.add_argument("--db-name", default="images_bench", help="База для теста (создается)")
+    run_parser.add_argument("--no-explain", dest="explain", action="store_false",
+                            help="Не проверять планы запросов с фильтрами")
+    run_parser.add_argument("--output", help="Файл для JSON результата (по умолчанию stdout)")
+
+    compare_parser = commands.add_parser("compare", help="Сравнить два результата")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="Регрессия: падение rps или рост p99 больше, %%")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        raise SystemExit(1 if compare(baseline, current, args.threshold) else 0)
+
+    result = run(args)
+    body = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+        log(f"Results written to {args.output}")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Контентно-адресуемое хранилище: файлы именуются по SHA-256 содержимого
+и раскладываются по шардированным подкаталогам UPLOAD_DIR.
+"""
+
+import hashlib
+import os
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 МБ
+
+
+def blob_relpath(content_hash: str, ext: str) -> str:
+    """Относительный путь блоба: ab/cd/abcd...<ext> (не более 65536 каталогов, в каждом мало файлов)."""
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}"
+
+
+def hash_file(path: str) -> str:
+    """Считает SHA-256 файла, читая его кусками."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lock_blob(cursor, relpath: str) -> None:
+    """
+    Транзакционная advisory-блокировка блоба. Загрузка и удаление одного и того же
+    блоба сериализуются, поэтому удаление не может стереть файл, на который
+    параллельно появляется новая ссылка.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))", (relpath,))
+
+
+def place_blob(temp_path: str, blob_path: str) -> bool:
+    """
+    Переносит временный файл на место блоба. Если такой блоб уже есть, временный
+    файл удаляется. Возвращает True, если блоб был создан (а не найден готовым).
+    """
+    if os.path.exists(blob_path):
+        os.remove(temp_path)
+        return False
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    # mkstemp создает файл с правами 0600 - открываем на чтение для nginx
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, blob_path)
+    return True
+
+
+def count_references(cursor, relpath: str) -> int:
+    """Сколько записей в images ссылается на блоб."""
+    cursor.execute("SELECT COUNT(*) FROM images WHERE filename = %s", (relpath,))
+    return cursor.fetchone()[0]
+
+
+def delete_unreferenced(connection_factory, storage, relpath: str, keys: list) -> list:
+    """
+    Удаляет из хранилища объекты keys (блоб relpath и его варианты) после commit удаления
+    записей о них. Удаление идет отдельной транзакцией под блокировкой блоба: если за это
+    время появилась новая ссылка (повторная загрузка того же содержимого), объекты остаются.
+    Если удалить не удалось, записей о файлах уже нет - их соберет сверка (reconcile.py).
+    Возвращает ключи удаленных объектов.
+    """
+    with connection_factory() as conn:
+        cursor = conn.cursor()
+        try:
+            lock_blob(cursor, relpath)
+            if count_references(cursor, relpath) > 0:
+                return []
+            return [key for key in keys if storage.delete(key)]
+        finally:
+            # Транзакция только держала блокировку
+            conn.rollback()
+            cursor.close()
+
+
+def remove_blob(upload_dir: str, relpath: str) -> bool:
+    """Удаляет файл блоба. Каталоги шардов не удаляются: их число ограничено. Возвращает True, если файл был."""
+    try:
+        os.remove(os.path.join(upload_dir, relpath))
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,296 @@
+"""
+Пул подключений к PostgreSQL, безопасный для многопоточного сервера.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from logger_config import get_logger
+from metrics import DB_CONNECT_DURATION, DB_QUERY_DURATION
+
+logger = get_logger()
+
+# Настройки пула (переопределяются переменными окружения)
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", "5"))  # секунды
+POOL_VALIDATE_IDLE_AFTER = float(os.environ.get("DB_POOL_VALIDATE_IDLE_AFTER", "10"))  # секунды
+POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "1800"))  # секунды
+
+
+# Типы запросов, различаемые в метрике времени выполнения (остальные - "other")
+_STATEMENT_TYPES = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить подключение из пула за отведенное время."""
+
+
+def _statement_type(query) -> str:
+    """Тип запроса по первому слову - метка с ограниченным числом значений."""
+    if isinstance(query, bytes):
+        query = query[:16].decode("ascii", errors="ignore")
+    words = str(query).lstrip()[:16].split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in _STATEMENT_TYPES else "other"
+
+
+class TimedCursor(extensions.cursor):
+    """Курсор, замеряющий время выполнения запросов."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            DB_QUERY_DURATION.observe(time.perf_counter() - started,
+                                      statement=_statement_type(query))
+
+
+class _PooledConnection:
+    """Подключение вместе со служебными отметками времени."""
+
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class ConnectionPool:
+    """Пул подключений psycopg2 с ограничением размера и проверкой при выдаче."""
+
+    def __init__(self, db_config: dict, min_size: int = POOL_MIN_SIZE,
+                 max_size: int = POOL_MAX_SIZE, checkout_timeout: float = POOL_CHECKOUT_TIMEOUT,
+                 validate_idle_after: float = POOL_VALIDATE_IDLE_AFTER,
+                 max_lifetime: float = POOL_MAX_LIFETIME):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size limits: min={min_size}, max={max_size}")
+
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.validate_idle_after = validate_idle_after
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        """Сбрасывает состояние пула (при создании и после fork)."""
+        self._pid = os.getpid()
+        self._idle = []  # LIFO: последние использованные подключения "теплее"
+        self._in_use = 0
+        self._checked_out = {}  # id(conn) -> _PooledConnection
+        self._warmed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "validation_failures": 0,
+        }
+
+    def _check_fork(self) -> None:
+        """Подключения не переживают fork: дочерний процесс строит свой пул."""
+        if self._pid != os.getpid():
+            # Сокеты родителя не закрываем - ими продолжает пользоваться родитель
+            self._cond = threading.Condition()
+            self._reset_state()
+
+    @property
+    def size(self) -> int:
+        """Общее число открытых подключений."""
+        return len(self._idle) + self._in_use
+
+    def _connect(self) -> _PooledConnection:
+        """Открывает новое подключение к базе данных."""
+        with DB_CONNECT_DURATION.time():
+            conn = psycopg2.connect(**self.db_config, cursor_factory=TimedCursor)
+        self._stats["created"] += 1
+        return _PooledConnection(conn)
+
+    def _close(self, pooled: _PooledConnection) -> None:
+        """Закрывает подключение, игнорируя ошибки уже разорванного сокета."""
+        self._stats["discarded"] += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        """Проверяет подключение перед выдачей."""
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        now = time.monotonic()
+        if self.max_lifetime and now - pooled.created_at > self.max_lifetime:
+            return False
+
+        # Пингуем только давно простаивавшие подключения, чтобы не платить round trip всегда
+        if now - pooled.last_used_at >= self.validate_idle_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        """Выдает проверенное подключение, при необходимости открывая новое."""
+        deadline = None
+        with self._cond:
+            self._check_fork()
+            self._stats["checkouts"] += 1
+            warm_up = not self._warmed and self.min_size > 1
+            self._warmed = True
+
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self._in_use += 1
+                    break
+
+                if self.size < self.max_size:
+                    # Резервируем слот, подключение откроем вне блокировки
+                    pooled = None
+                    self._in_use += 1
+                    break
+
+                if deadline is None:
+                    deadline = time.monotonic() + self.checkout_timeout
+                    self._stats["waits"] += 1
+                    wait_started = time.monotonic()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.checkout_timeout}s waiting for a DB connection "
+                        f"(max_size={self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            if deadline is not None:
+                self._stats["wait_time_total"] += time.monotonic() - wait_started
+
+        # Слот уже зарезервирован (in_use += 1): проверяем или создаем подключение без блокировки
+        while pooled is not None and not self._is_usable(pooled):
+            self._stats["validation_failures"] += 1
+            self._close(pooled)
+            pooled = self._pop_idle_nowait()
+
+        if pooled is None:
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._checked_out[id(pooled.conn)] = pooled
+        if warm_up:
+            # Остальные подключения до min_size открываем в фоне, не задерживая запрос
+            threading.Thread(target=self.fill, name="db-pool-fill", daemon=True).start()
+        return pooled.conn
+
+    def _pop_idle_nowait(self):
+        """Забирает еще одно простаивающее подключение, не меняя счетчик in_use."""
+        with self._cond:
+            return self._idle.pop() if self._idle else None
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        """Возвращает подключение в пул или закрывает его, если оно неисправно."""
+        if not broken and not conn.closed:
+            try:
+                # Незавершенная транзакция не должна "перетечь" к следующему пользователю
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            pooled = self._checked_out.pop(id(conn), None) or _PooledConnection(conn)
+            self._in_use -= 1
+            if broken or conn.closed:
+                self._close(pooled)
+                # После разрыва (например, рестарта Postgres) простаивающие подключения
+                # скорее всего тоже мертвы - принудительно проверим их при следующей выдаче
+                for idle in self._idle:
+                    idle.last_used_at = 0.0
+            else:
+                pooled.last_used_at = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: выдает подключение и гарантированно возвращает его в пул."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken or bool(conn.closed))
+
+    def fill(self) -> None:
+        """Открывает подключения до минимального размера пула."""
+        while True:
+            with self._cond:
+                self._check_fork()
+                if self.size >= self.min_size:
+                    return
+                self._in_use += 1
+            try:
+                pooled = self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._in_use -= 1
+                logger.warning(f"Could not pre-open DB connection: {e}")
+                return
+            with self._cond:
+                self._in_use -= 1
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def close_all(self) -> None:
+        """Закрывает все простаивающие подключения."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self) -> dict:
+        """Возвращает статистику пула для мониторинга."""
+        with self._cond:
+            self._check_fork()
+            data = dict(self._stats)
+            data.update({
+                "pid": self._pid,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        data["wait_time_total"] = round(data["wait_time_total"], 6)
+        return data
@@ -0,0 +1,152 @@
+"""
+Вспомогательные функции для отдачи файлов: ETag, условные запросы и Range.
+"""
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+# Политика кеширования, совпадающая с nginx.conf
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_CONTROL_HTML = "public, max-age=3600"
+
+# Не больше стольких диапазонов в одном запросе (защита от "range bomb")
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Ни один из запрошенных диапазонов не попадает в файл."""
+
+
+def make_etag(stat: os.stat_result) -> str:
+    """Строгий ETag по inode, размеру и времени изменения файла."""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def encode_headers(headers: dict) -> bytes:
+    """Заголовки ответа в виде готового блока строк (как их кодирует send_header)."""
+    return "".join(f"{name}: {value}\r\n" for name, value in headers.items()).encode("latin-1", "strict")
+
+
+def http_date(timestamp: float) -> str:
+    """Форматирует время в формате HTTP-date."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Проверяет, есть ли etag в списке If-None-Match (слабое сравнение)."""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    """Проверяет If-Modified-Since с точностью до секунды."""
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    return int(mtime) <= since
+
+
+def is_not_modified(headers, etag: str, mtime: float) -> bool:
+    """Возвращает True, если клиент может использовать свою копию (ответ 304)."""
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-None-Match имеет приоритет над If-Modified-Since (RFC 9110, 13.2.2)
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        return _not_modified_since(if_modified_since, mtime)
+    return False
+
+
+def range_applies(headers, etag: str, mtime: float) -> bool:
+    """Проверяет If-Range: диапазон отдается, только если файл не изменился."""
+    if_range = headers.get("If-Range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Для If-Range допустимо только строгое сравнение
+        return if_range == etag
+    try:
+        return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+
+
+def parse_range(header: str, size: int):
+    """
+    Разбирает заголовок Range. Возвращает список (start, end) включительно
+    или None, если заголовок нужно проигнорировать и отдать файл целиком.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+
+    ranges = []
+    for spec in header[6:].split(","):
+        spec = spec.strip()
+        if not spec or "-" not in spec:
+            return None
+        first, last = spec.split("-", 1)
+        try:
+            if first == "":
+                # Суффикс: последние N байт
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(first)
+                if last:
+                    end = int(last)
+                    if start > end:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list) -> list:
+    """Объединяет пересекающиеся и соседние диапазоны."""
+    ordered = sorted(ranges)
+    merged = [ordered[0]]
+    for start, end in ordered[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def multipart_byteranges(ranges: list, size: int, content_type: str, boundary: str) -> tuple:
+    """
+    Готовит части ответа multipart/byteranges.
+    Возвращает список (заголовок части, start, end), завершающую строку и общую длину тела.
+    """
+    parts = []
+    total = 0
+    for start, end in ranges:
+        head = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        parts.append((head, start, end))
+        total += len(head) + (end - start + 1)
+    tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    total += len(tail)
+    return parts, tail, total
@@ -0,0 +1,220 @@
+"""
+Кеш содержимого часто запрашиваемых файлов в памяти процесса (первая страница галереи,
+статика). Вместе с байтами хранятся готовые заголовки ответа; попадание проверяется
+одним stat(), поэтому измененный или удаленный файл не будет отдан из кеша.
+Допуск в кеш - по частоте обращений (TinyLFU): новый файл вытесняет старые, только
+если к нему обращались чаще, чем к вытесняемым.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from file_response import encode_headers, http_date, make_etag
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+HOT_CACHE_MAX_BYTES = int(os.environ.get("HOT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 0 - выключен
+HOT_CACHE_MAX_FILE_SIZE = int(os.environ.get("HOT_CACHE_MAX_FILE_SIZE", str(1024 * 1024)))
+HOT_CACHE_ADMIT_HITS = int(os.environ.get("HOT_CACHE_ADMIT_HITS", "2"))  # обращений до допуска
+# Сколько файлов помнит счетчик частот; после 10x обращений счетчики делятся пополам
+HOT_CACHE_SKETCH_ENTRIES = int(os.environ.get("HOT_CACHE_SKETCH_ENTRIES", "100000"))
+
+
+class CachedFile:
+    """
+    Содержимое файла и готовые заголовки ответа (для файла, отдаваемого с диска, body пустое).
+    Блок заголовков полного ответа 200 кодируется при допуске в кеш для content_type
+    и затем отправляется на каждом попадании как есть.
+    """
+
+    __slots__ = ("body", "etag", "last_modified", "mtime", "identity", "content_type", "_blocks")
+
+    def __init__(self, stat: os.stat_result, body: bytes = b"", content_type: str = None,
+                 headers: dict = None):
+        self.body = body
+        self.etag = make_etag(stat)
+        self.last_modified = http_date(stat.st_mtime)
+        self.mtime = stat.st_mtime
+        self.identity = _identity(stat)
+        self.content_type = content_type
+        self._blocks = {}  # тип содержимого -> закодированные заголовки ответа 200
+        if content_type is not None:
+            self.build_header_block(content_type, headers or {})
+
+    def header_block(self, content_type: str):
+        """Готовый блок заголовков ответа 200 для типа содержимого или None."""
+        return self._blocks.get(content_type)
+
+    def build_header_block(self, content_type: str, headers: dict) -> bytes:
+        """
+        Кодирует заголовки ответа 200: Content-Type, Content-Length, валидаторы и headers
+        (Cache-Control, CORS и т.п. - постоянные для файла). Тот же файл может отдаваться
+        с другим типом (например, index.html для "/"), поэтому блоки хранятся по типу.
+        """
+        block = encode_headers({
+            "Content-Type": content_type,
+            "Content-Length": str(len(self.body)),
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+            **headers,
+        })
+        self._blocks[content_type] = block
+        return block
+
+
+def _identity(stat: os.stat_result) -> tuple:
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class HotFileCache:
+    """
+    LRU по объему с допуском TinyLFU. Общий для потоков процесса; в режиме prefork
+    файлы, загруженные до fork (статика), делят страницы памяти между процессами.
+    """
+
+    def __init__(self, max_bytes: int = HOT_CACHE_MAX_BYTES,
+                 max_file_size: int = HOT_CACHE_MAX_FILE_SIZE,
+                 admit_hits: int = HOT_CACHE_ADMIT_HITS,
+                 sketch_entries: int = HOT_CACHE_SKETCH_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.admit_hits = admit_hits
+        self.sketch_entries = sketch_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # путь -> CachedFile
+        self._bytes = 0
+        self._frequency = {}  # путь -> число обращений (с периодическим старением)
+        self._accesses = 0
+        self._stats = {"hits": 0, "misses": 0, "admissions": 0, "rejections": 0,
+                       "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, path: str):
+        """CachedFile для пути или None. Запись, не совпадающая с файлом на диске, удаляется."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            self._record_access(path)
+        if entry is not None:
+            try:
+                current = _identity(os.stat(path))
+            except OSError:
+                current = None
+            if current == entry.identity:
+                with self._lock:
+                    if path in self._entries:
+                        self._entries.move_to_end(path)
+                    self._stats["hits"] += 1
+                return entry
+            self.invalidate(path)
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def admit(self, path: str, f, stat: os.stat_result, content_type: str = None,
+              headers: dict = None):
+        """
+        Решает, кешировать ли открытый файл после промаха. Если да - читает его
+        и возвращает CachedFile с заголовками ответа для content_type и headers,
+        иначе None (файл отдается с диска как обычно).
+        """
+        if not self.enabled or stat.st_size > self.max_file_size:
+            return None
+        with self._lock:
+            if not self._should_admit(path, stat.st_size):
+                self._stats["rejections"] += 1
+                return None
+        body = os.pread(f.fileno(), stat.st_size, 0)
+        if len(body) != stat.st_size:
+            return None
+        entry = CachedFile(stat, body, content_type, headers)
+        with self._lock:
+            self._store(path, entry)
+            self._stats["admissions"] += 1
+        return entry
+
+    def preload(self, root: str, describe=None) -> int:
+        """
+        Загружает все подходящие по размеру файлы каталога (статика) без проверки частоты.
+        describe(путь) -> (content_type, заголовки) - для заголовков ответа, как в admit.
+        """
+        if not self.enabled:
+            return 0
+        loaded = 0
+        for dirpath, _dirnames, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    with open(path, "rb") as f:
+                        stat = os.fstat(f.fileno())
+                        if stat.st_size > self.max_file_size:
+                            continue
+                        content_type, headers = describe(path) if describe else (None, None)
+                        entry = CachedFile(stat, f.read(), content_type, headers)
+                except OSError:
+                    continue
+                with self._lock:
+                    if self._bytes + stat.st_size > self.max_bytes:
+                        continue
+                    self._store(path, entry)
+                    # Статика нужна каждой странице: ее не должен вытеснить файл, запрошенный пару раз
+                    self._frequency[path] = max(self._frequency.get(path, 0), self.admit_hits)
+                loaded += 1
+        logger.info(f"Hot cache preloaded {loaded} files from {root} ({self._bytes} bytes)")
+        return loaded
+
+    def invalidate(self, path: str) -> None:
+        """Удаляет файл и его варианты (<путь>.webp, <путь>.avif) из кеша."""
+        with self._lock:
+            for key in [key for key in self._entries if key == path or key.startswith(path + ".")]:
+                self._bytes -= len(self._entries.pop(key).body)
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        """Статистика кеша для мониторинга."""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"entries": len(self._entries), "bytes": self._bytes,
+                         "max_bytes": self.max_bytes})
+        return data
+
+    def _record_access(self, path: str) -> None:
+        """Счетчик частот TinyLFU: ограничен по числу путей и периодически стареет."""
+        self._frequency[path] = self._frequency.get(path, 0) + 1
+        self._accesses += 1
+        if self._accesses >= self.sketch_entries * 10 or len(self._frequency) > self.sketch_entries:
+            self._accesses = 0
+            self._frequency = {key: count // 2 for key, count in self._frequency.items()
+                               if count > 1}
+
+    def _should_admit(self, path: str, size: int) -> bool:
+        """Допуск: файл запрашивался достаточно часто и чаще файлов, которые он вытеснит."""
+        frequency = self._frequency.get(path, 0)
+        if frequency < self.admit_hits:
+            return False
+        free = self.max_bytes - self._bytes
+        for victim, entry in self._entries.items():
+            if free >= size:
+                break
+            if self._frequency.get(victim, 0) >= frequency:
+                return False
+            free += len(entry.body)
+        return free >= size
+
+    def _store(self, path: str, entry: CachedFile) -> None:
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self._bytes -= len(old.body)
+        self._entries[path] = entry
+        self._bytes += len(entry.body)
+        while self._bytes > self.max_bytes:
+            _victim, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.body)
+            self._stats["evictions"] += 1
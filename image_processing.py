@@ -0,0 +1,265 @@
+"""
+Проверка и обработка изображений в пуле процессов: CPU-затратная работа Pillow
+не занимает потоки обработчиков и не упирается в GIL.
+"""
+
+import os
+import signal
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки пула (переопределяются переменными окружения)
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+IMAGE_QUEUE_SIZE = int(os.environ.get("IMAGE_QUEUE_SIZE", str(IMAGE_WORKERS * 4)))  # задач в пуле
+IMAGE_QUEUE_WAIT = float(os.environ.get("IMAGE_QUEUE_WAIT", "5"))  # секунды ожидания места
+IMAGE_JOB_TIMEOUT = float(os.environ.get("IMAGE_JOB_TIMEOUT", "10"))  # секунды на задачу
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+# Задача, не вернувшаяся за это время, убивается по лимиту процессорного времени
+HARD_TIMEOUT_FACTOR = 2
+PARENT_CHECK_INTERVAL = 1.0  # секунды
+
+
+class ImageProcessingError(Exception):
+    """Изображение не удалось обработать."""
+
+
+class ImageRejectedError(ImageProcessingError):
+    """Файл не является допустимым изображением; сообщение можно вернуть клиенту."""
+
+
+class ImageQueueFullError(ImageProcessingError):
+    """Очередь пула переполнена."""
+
+
+class ImageJobTimeoutError(ImageProcessingError):
+    """Задача не уложилась в отведенное время."""
+
+
+def _raise_timeout(signum, frame):
+    raise ImageJobTimeoutError("Image processing timed out")
+
+
+def _watch_parent(parent_pid: int) -> None:
+    """
+    Завершает процесс пула, если серверный процесс умер: иначе он остается сиротой
+    и держит унаследованный слушающий сокет, на котором соединения повисают.
+    """
+    while True:
+        time.sleep(PARENT_CHECK_INTERVAL)
+        if os.getppid() != parent_pid:
+            os._exit(0)
+
+
+def _init_worker(max_pixels: int, parent_pid: int) -> None:
+    """
+    Настройка процесса пула: лимит пикселей и сигналы (обработчики сервера не наследуются).
+    Pillow импортируется здесь, а не при старте сервера: он нужен только процессам пула.
+    """
+    from PIL import Image
+
+    threading.Thread(target=_watch_parent, args=(parent_pid,), daemon=True).start()
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает родительский процесс
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.signal(signal.SIGVTALRM, signal.SIG_DFL)
+
+
+def _run_job(timeout: float, func, args: tuple):
+    """
+    Выполняет задачу в процессе пула. По истечении timeout задача прерывается исключением;
+    если она застряла в C-коде, процесс завершается по лимиту процессорного времени.
+    """
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    signal.setitimer(signal.ITIMER_VIRTUAL, timeout * HARD_TIMEOUT_FACTOR)
+    started = time.perf_counter()
+    try:
+        return func(*args), time.perf_counter() - started
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+
+
+def dhash(img) -> int:
+    """
+    Перцептивный хеш (dHash, 64 бита): знаки разности яркости соседних пикселей
+    уменьшенной до 9x8 серой копии. У уменьшенных и пережатых копий он почти не меняется.
+    """
+    from PIL import Image
+
+    small = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_phash(path: str) -> int:
+    """Перцептивный хеш файла (для заполнения хешей уже загруженных изображений)."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.load()
+        return dhash(img)
+
+
+def validate_image(path: str) -> dict:
+    """
+    Проверяет изображение: размеры по заголовку (до декодирования), структуру файла
+    и полное декодирование. Возвращает {"width", "height", "format", "phash"}.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if width * height > Image.MAX_IMAGE_PIXELS:
+                raise ImageRejectedError("Image dimensions too large")
+            img.verify()
+        # После verify() объект непригоден для чтения - открываем заново
+        with Image.open(path) as img:
+            image_format = img.format
+            img.load()
+            phash = dhash(img)
+    except ImageProcessingError:
+        raise
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ImageRejectedError("Image dimensions too large")
+    except Exception:
+        raise ImageRejectedError("Invalid image file")
+    return {"width": width, "height": height, "format": image_format, "phash": phash}
+
+
+class ImageProcessor:
+    """Пул процессов с ограниченной очередью, таймаутами задач и статистикой."""
+
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_size: int = IMAGE_QUEUE_SIZE,
+                 queue_wait: float = IMAGE_QUEUE_WAIT, job_timeout: float = IMAGE_JOB_TIMEOUT,
+                 max_pixels: int = MAX_IMAGE_PIXELS):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_wait = queue_wait
+        self.job_timeout = job_timeout
+        self.max_pixels = max_pixels
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._executor_pid = None
+        self._queued = 0
+        self._stats = {
+            "submitted": 0, "completed": 0, "invalid": 0, "failed": 0, "rejected": 0,
+            "timeouts": 0, "pool_restarts": 0,
+            "processing_seconds_total": 0.0, "wait_seconds_total": 0.0,
+            "processing_seconds_max": 0.0,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Создает пул при первом использовании в каждом процессе (в том числе после fork)."""
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker,
+                    initargs=(self.max_pixels, pid)
+                )
+                self._executor_pid = pid
+            return self._executor
+
+    def _restart_executor(self, broken: ProcessPoolExecutor) -> None:
+        """Заменяет сломанный пул (процесс убит по таймауту или упал) новым."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._stats["pool_restarts"] += 1
+        logger.warning("Image processing pool is broken, restarting")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func, *args):
+        """
+        Выполняет func(*args) в пуле и возвращает результат. Если очередь занята дольше
+        queue_wait, бросает ImageQueueFullError; по таймауту - ImageJobTimeoutError.
+        """
+        if not self._slots.acquire(timeout=self.queue_wait):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise ImageQueueFullError("Image processing queue is full")
+
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._stats["submitted"] += 1
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_job, self.job_timeout, func, args)
+            result, processing = future.result(
+                timeout=self.queue_wait + self.job_timeout * (HARD_TIMEOUT_FACTOR + 1)
+            )
+        except (ImageJobTimeoutError, FutureTimeoutError):
+            self._record_failure(timeout=True)
+            raise ImageJobTimeoutError("Image processing timed out")
+        except ImageRejectedError:
+            with self._lock:
+                self._stats["invalid"] += 1
+            raise
+        except BrokenProcessPool:
+            self._restart_executor(executor)
+            self._record_failure(timeout=False)
+            raise ImageProcessingError("Image processing worker crashed")
+        except Exception:
+            self._record_failure(timeout=False)
+            raise
+        finally:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+
+        elapsed = time.perf_counter() - submitted
+        with self._lock:
+            self._stats["completed"] += 1
+            self._stats["processing_seconds_total"] += processing
+            self._stats["wait_seconds_total"] += max(0.0, elapsed - processing)
+            self._stats["processing_seconds_max"] = max(self._stats["processing_seconds_max"],
+                                                        processing)
+        return result
+
+    def _record_failure(self, timeout: bool) -> None:
+        with self._lock:
+            self._stats["failed"] += 1
+            if timeout:
+                self._stats["timeouts"] += 1
+
+    def validate(self, path: str) -> dict:
+        """Проверяет изображение в пуле (см. validate_image)."""
+        return self.run(validate_image, path)
+
+    def shutdown(self) -> None:
+        """Останавливает процессы пула."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """Статистика пула для мониторинга: глубина очереди и время обработки."""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._queued,
+            })
+        return data
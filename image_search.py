@@ -0,0 +1,256 @@
+"""
+Фильтры и поиск для /images-list: тип файла, диапазоны размера и даты загрузки,
+поиск по исходному имени (префикс или подстрока). Индексы под эти запросы создает
+миграция create_search_indexes (CREATE INDEX CONCURRENTLY - без блокировки записи).
+"""
+
+import datetime
+import os
+import re
+import time
+
+import psycopg2
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+# Для запросов с фильтрами строки считаются не дальше этого числа (счетчик images_counter не подходит)
+SEARCH_COUNT_LIMIT = int(os.environ.get("SEARCH_COUNT_LIMIT", "10000"))
+MAX_SEARCH_LENGTH = 100
+MAX_FILE_TYPES = 10
+
+FILE_TYPE_RE = re.compile(r'^[a-z0-9]{1,10}$')
+# Синонимы расширений: при загрузке сохраняется расширение исходного файла
+FILE_TYPE_ALIASES = {".jpg": (".jpg", ".jpeg"), ".jpeg": (".jpg", ".jpeg")}
+
+LIST_COLUMNS = "id, filename, original_name, size, upload_time, file_type"
+
+# Имя индекса -> определение. Индекс по триграммам нужен для поиска подстроки (ILIKE '%...%')
+# и создается, только если доступно расширение pg_trgm
+SEARCH_INDEXES = {
+    "idx_images_type_time": "ON images (file_type, upload_time DESC, id DESC)",
+    "idx_images_size": "ON images (size)",
+    "idx_images_name_prefix": "ON images (lower(original_name) text_pattern_ops)",
+    "idx_images_name_trgm": "ON images USING gin (original_name gin_trgm_ops)",
+}
+TRIGRAM_INDEXES = ("idx_images_name_trgm",)
+
+
+class SearchParamsError(ValueError):
+    """Некорректные параметры фильтрации в запросе."""
+
+
+class ImageFilter:
+    """Условия отбора изображений из параметров запроса."""
+
+    __slots__ = ("file_types", "min_size", "max_size", "date_from", "date_to", "prefix", "contains")
+
+    def __init__(self, file_types: tuple = (), min_size: int = None, max_size: int = None,
+                 date_from: datetime.datetime = None, date_to: datetime.datetime = None,
+                 prefix: str = None, contains: str = None):
+        self.file_types = file_types
+        self.min_size = min_size
+        self.max_size = max_size
+        self.date_from = date_from
+        self.date_to = date_to  # не включительно
+        self.prefix = prefix
+        self.contains = contains
+
+    @property
+    def active(self) -> bool:
+        return bool(self.conditions()[0])
+
+    def cache_key(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def conditions(self) -> tuple:
+        """Условия WHERE и их параметры."""
+        clauses, params = [], []
+        if self.file_types:
+            clauses.append("file_type = ANY(%s)")
+            params.append(list(self.file_types))
+        if self.min_size is not None:
+            clauses.append("size >= %s")
+            params.append(self.min_size)
+        if self.max_size is not None:
+            clauses.append("size <= %s")
+            params.append(self.max_size)
+        if self.date_from is not None:
+            clauses.append("upload_time >= %s")
+            params.append(self.date_from)
+        if self.date_to is not None:
+            clauses.append("upload_time < %s")
+            params.append(self.date_to)
+        if self.prefix:
+            # Совпадает с выражением индекса idx_images_name_prefix
+            clauses.append("lower(original_name) LIKE %s")
+            params.append(escape_like(self.prefix.lower()) + "%")
+        if self.contains:
+            clauses.append("original_name ILIKE %s")
+            params.append("%" + escape_like(self.contains) + "%")
+        return clauses, params
+
+
+def escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE (экранирующий символ по умолчанию - обратная косая черта)."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _single(query_params: dict, name: str):
+    values = query_params.get(name)
+    return values[0].strip() if values and values[0].strip() else None
+
+
+def _parse_size(query_params: dict, name: str):
+    value = _single(query_params, name)
+    if value is None:
+        return None
+    try:
+        size = int(value)
+    except ValueError:
+        raise SearchParamsError(f"Parameter '{name}' must be an integer (bytes)")
+    if size < 0:
+        raise SearchParamsError(f"Parameter '{name}' must not be negative")
+    return size
+
+
+def _parse_date(query_params: dict, name: str, end: bool = False):
+    """Дата или дата со временем в ISO 8601. Для конца диапазона дата без времени включает весь день."""
+    value = _single(query_params, name)
+    if value is None:
+        return None
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            return datetime.datetime.combine(day + datetime.timedelta(days=1 if end else 0),
+                                             datetime.time())
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise SearchParamsError(f"Parameter '{name}' must be an ISO 8601 date or datetime")
+    # upload_time хранится без часового пояса (часовой пояс базы, в контейнере db - UTC)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _parse_text(query_params: dict, name: str):
+    value = _single(query_params, name)
+    if value is not None and len(value) > MAX_SEARCH_LENGTH:
+        raise SearchParamsError(f"Parameter '{name}' is longer than {MAX_SEARCH_LENGTH} characters")
+    return value
+
+
+def parse_filters(query_params: dict) -> ImageFilter:
+    """
+    Разбирает параметры фильтрации /images-list:
+    file_type=png,jpg, min_size/max_size (байты), date_from/date_to (ISO 8601),
+    prefix= (начало исходного имени), q= (подстрока имени), без учета регистра.
+    """
+    file_types = []
+    for value in query_params.get("file_type", []):
+        for item in value.split(","):
+            item = item.strip().lower().lstrip(".")
+            if not item:
+                continue
+            if not FILE_TYPE_RE.match(item):
+                raise SearchParamsError(f"Invalid file_type '{item}'")
+            for file_type in FILE_TYPE_ALIASES.get("." + item, ("." + item,)):
+                if file_type not in file_types:
+                    file_types.append(file_type)
+    if len(file_types) > MAX_FILE_TYPES:
+        raise SearchParamsError(f"No more than {MAX_FILE_TYPES} file types are allowed")
+
+    filters = ImageFilter(
+        file_types=tuple(sorted(file_types)),
+        min_size=_parse_size(query_params, "min_size"),
+        max_size=_parse_size(query_params, "max_size"),
+        date_from=_parse_date(query_params, "date_from"),
+        date_to=_parse_date(query_params, "date_to", end=True),
+        prefix=_parse_text(query_params, "prefix"),
+        contains=_parse_text(query_params, "q"),
+    )
+    if filters.min_size is not None and filters.max_size is not None \
+            and filters.min_size > filters.max_size:
+        raise SearchParamsError("min_size must not be greater than max_size")
+    if filters.date_from and filters.date_to and filters.date_from >= filters.date_to:
+        raise SearchParamsError("date_from must be earlier than date_to")
+    return filters
+
+
+def list_query(filters: ImageFilter, limit: int, after: tuple = None, offset: int = 0,
+               selective: bool = False) -> tuple:
+    """
+    Запрос страницы изображений: keyset после after=(upload_time, id) или OFFSET.
+    selective - подходящих строк не больше SEARCH_COUNT_LIMIT (известно из count_query):
+    тогда строки сначала отбираются по индексам фильтров и потом сортируются. Иначе
+    планировщик может идти по idx_upload_time_id в надежде быстро набрать страницу и
+    прочитать почти всю таблицу, если подходящие строки собраны в старой ее части.
+    Возвращает (sql, параметры).
+    """
+    clauses, params = filters.conditions()
+    if after:
+        clauses.append("(upload_time, id) < (%s, %s)")
+        params.extend(after)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    order = "ORDER BY upload_time DESC, id DESC LIMIT %s"
+    if selective and clauses:
+        sql = (f"WITH matched AS MATERIALIZED (SELECT {LIST_COLUMNS} FROM images {where}) "
+               f"SELECT {LIST_COLUMNS} FROM matched {order}")
+    else:
+        sql = f"SELECT {LIST_COLUMNS} FROM images {where} {order}"
+    params.append(limit)
+    if not after:
+        sql += " OFFSET %s"
+        params.append(offset)
+    return sql, params
+
+
+def count_query(filters: ImageFilter, cap: int = SEARCH_COUNT_LIMIT) -> tuple:
+    """Подсчет подходящих строк, не дальше cap + 1 (больше - значит "более cap")."""
+    clauses, params = filters.conditions()
+    sql = f"SELECT COUNT(*) FROM (SELECT 1 FROM images WHERE {' AND '.join(clauses)} LIMIT %s) matched"
+    return sql, params + [cap + 1]
+
+
+def create_search_indexes(db_config: dict) -> None:
+    """Миграция: создает индексы поиска без блокировки записи в images."""
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                trigram = True
+            except psycopg2.Error as e:
+                logger.warning(f"pg_trgm is not available, substring search will scan the table: "
+                               f"{str(e).strip()}")
+                trigram = False
+
+            for name, definition in SEARCH_INDEXES.items():
+                if name in TRIGRAM_INDEXES and not trigram:
+                    continue
+                ensure_index(cursor, name, definition)
+    finally:
+        conn.close()
+
+
+def ensure_index(cursor, name: str, definition: str) -> None:
+    """
+    Создает индекс через CREATE INDEX CONCURRENTLY (курсор в режиме autocommit).
+    Индекс, оставшийся невалидным после прерванного построения, пересоздается.
+    """
+    cursor.execute("""
+        SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s
+    """, (name,))
+    row = cursor.fetchone()
+    if row is not None and row[0]:
+        return
+    if row is not None:
+        logger.warning(f"Rebuilding invalid index {name}")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    started = time.monotonic()
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+    logger.info(f"Created index {name} in {time.monotonic() - started:.1f}s")
@@ -1,11 +1,137 @@
 -- init.sql
 CREATE TABLE IF NOT EXISTS images (
     id SERIAL PRIMARY KEY,
-    filename TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
     original_name TEXT NOT NULL,
     size INTEGER NOT NULL,
     upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    file_type TEXT NOT NULL
+    file_type TEXT NOT NULL,
+    content_hash TEXT,
+    phash BIGINT
 );
 
-CREATE INDEX IF NOT EXISTS idx_upload_time ON images(upload_time DESC);
\ No newline at end of file
+-- Контентно-адресуемое хранилище: несколько записей могут ссылаться на один файл
+CREATE INDEX IF NOT EXISTS idx_images_filename ON images(filename);
+
+-- Составной индекс для сортировки и keyset-пагинации
+CREATE INDEX IF NOT EXISTS idx_upload_time_id ON images(upload_time DESC, id DESC);
+
+-- Фильтры и поиск /images-list (image_search.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_images_type_time ON images (file_type, upload_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_images_size ON images (size);
+CREATE INDEX IF NOT EXISTS idx_images_name_prefix ON images (lower(original_name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_images_name_trgm ON images USING gin (original_name gin_trgm_ops);
+
+-- Поиск почти одинаковых изображений: индексы 16-битных частей перцептивного хеша (near_duplicates.py)
+CREATE INDEX IF NOT EXISTS idx_images_phash_0 ON images (((phash >> 48) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_phash_1 ON images (((phash >> 32) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_phash_2 ON images (((phash >> 16) & 65535)) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_phash_3 ON images (((phash >> 0) & 65535)) WHERE phash IS NOT NULL;
+
+-- Счетчик изображений, поддерживаемый триггерами
+CREATE TABLE IF NOT EXISTS images_counter (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    total_count BIGINT NOT NULL
+);
+
+INSERT INTO images_counter (total_count)
+SELECT COUNT(*) FROM images
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION images_counter_insert() RETURNS trigger AS $$
+BEGIN
+    UPDATE images_counter SET total_count = total_count + (SELECT COUNT(*) FROM new_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION images_counter_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE images_counter SET total_count = total_count - (SELECT COUNT(*) FROM old_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION images_counter_truncate() RETURNS trigger AS $$
+BEGIN
+    UPDATE images_counter SET total_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_images_counter_insert
+    AFTER INSERT ON images REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION images_counter_insert();
+
+CREATE OR REPLACE TRIGGER trg_images_counter_delete
+    AFTER DELETE ON images REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION images_counter_delete();
+
+CREATE OR REPLACE TRIGGER trg_images_counter_truncate
+    AFTER TRUNCATE ON images
+    FOR EACH STATEMENT EXECUTE FUNCTION images_counter_truncate();
+
+-- Уведомление процессов приложения об изменениях (сброс кеша /images-list)
+CREATE OR REPLACE FUNCTION images_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('images_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_images_notify_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON images
+    FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
+
+-- Варианты изображений в современных форматах (WebP/AVIF) и их размеры
+CREATE TABLE IF NOT EXISTS image_variants (
+    filename TEXT NOT NULL,
+    format TEXT NOT NULL,
+    key TEXT,
+    size INTEGER NOT NULL,
+    original_size INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (filename, format)
+);
+
+CREATE OR REPLACE TRIGGER trg_image_variants_notify_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON image_variants
+    FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
+
+-- Очередь фоновых задач после загрузки (исполнитель - worker.py)
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UNIQUE (job_type, filename)
+);
+
+-- Выборка исполнителями идет только по незавершенным задачам
+CREATE INDEX IF NOT EXISTS idx_jobs_pending
+    ON jobs(job_type, run_after, id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs(filename);
+
+CREATE OR REPLACE FUNCTION jobs_notify_added() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('jobs_added', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_jobs_notify_added
+    AFTER INSERT OR UPDATE OF run_after ON jobs
+    FOR EACH STATEMENT EXECUTE FUNCTION jobs_notify_added();
+
+-- Состояние задач есть в /images-list, поэтому его изменения сбрасывают кеш списка
+CREATE OR REPLACE TRIGGER trg_jobs_notify_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON jobs
+    FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
@@ -0,0 +1,384 @@
+"""
+Очередь фоновых задач в PostgreSQL: задачи ставятся в той же транзакции, что и запись
+о загрузке, и выбираются исполнителями (worker.py) через SELECT ... FOR UPDATE SKIP LOCKED.
+Повторы с экспоненциальной задержкой, ограничение одновременных задач каждого типа.
+"""
+
+import os
+import random
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+# Задачи, которые ставятся для каждого нового файла после загрузки
+UPLOAD_JOBS = [job_type.strip() for job_type in
+               os.environ.get("UPLOAD_JOBS", "transcode,thumbnail").split(",") if job_type.strip()]
+# Число одновременных задач каждого типа на все исполнители: "transcode=2,thumbnail=4"
+JOB_CONCURRENCY = {
+    job_type.strip(): int(limit)
+    for job_type, _, limit in (item.partition("=") for item in
+                               os.environ.get("JOB_CONCURRENCY", "transcode=2,thumbnail=2").split(","))
+    if job_type.strip() and limit.strip()
+}
+JOB_DEFAULT_CONCURRENCY = 1
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.environ.get("JOB_BACKOFF_BASE", "5"))  # секунды до первого повтора
+JOB_BACKOFF_MAX = float(os.environ.get("JOB_BACKOFF_MAX", "600"))  # секунды
+JOB_LEASE = int(os.environ.get("JOB_LEASE", "300"))  # секунды; потом задачу заберет другой исполнитель
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "5"))  # секунды между опросами
+JOB_STATS_TTL = 5.0  # секунды кеширования счетчиков для /metrics
+
+# Канал уведомлений о новых задачах; NOTIFY отправляет триггер на таблице jobs
+JOBS_CHANNEL = "jobs_added"
+LISTENER_RECONNECT_DELAY = 2.0  # секунды
+
+# Одна задача каждого типа на файл; повторная постановка возвращает ее в очередь
+JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id BIGSERIAL PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+        locked_until TIMESTAMPTZ,
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (job_type, filename)
+    );
+
+    -- Выборка исполнителями идет только по незавершенным задачам
+    CREATE INDEX IF NOT EXISTS idx_jobs_pending
+        ON jobs(job_type, run_after, id) WHERE status IN ('queued', 'running');
+    CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs(filename);
+
+    CREATE OR REPLACE FUNCTION jobs_notify_added() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('jobs_added', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER trg_jobs_notify_added
+        AFTER INSERT OR UPDATE OF run_after ON jobs
+        FOR EACH STATEMENT EXECUTE FUNCTION jobs_notify_added();
+
+    -- Состояние задач есть в /images-list, поэтому его изменения сбрасывают кеш списка
+    CREATE OR REPLACE TRIGGER trg_jobs_notify_change
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON jobs
+        FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
+"""
+
+
+class PermanentJobError(Exception):
+    """Задачу бессмысленно повторять (например, файл не является изображением)."""
+
+
+class Job:
+    """Задача, выданная исполнителю."""
+
+    __slots__ = ("id", "job_type", "filename", "attempts", "max_attempts")
+
+    def __init__(self, id: int, job_type: str, filename: str, attempts: int, max_attempts: int):
+        self.id = id
+        self.job_type = job_type
+        self.filename = filename
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+
+def enqueue_jobs(cursor, job_types: list, filenames: list,
+                 max_attempts: int = JOB_MAX_ATTEMPTS) -> None:
+    """
+    Ставит задачи в транзакции вызывающего: они станут видны исполнителям только
+    вместе с записью о файле и пропадут при откате.
+    """
+    rows = [(job_type, filename, max_attempts) for filename in filenames for job_type in job_types]
+    if not rows:
+        return
+    execute_values(cursor, """
+        INSERT INTO jobs (job_type, filename, max_attempts) VALUES %s
+        ON CONFLICT (job_type, filename) DO UPDATE
+        SET status = 'queued', attempts = 0, max_attempts = EXCLUDED.max_attempts,
+            run_after = now(), locked_until = NULL, last_error = NULL, updated_at = now()
+    """, rows, page_size=len(rows))
+
+
+def delete_jobs(cursor, filename: str) -> None:
+    """Удаляет задачи файла (при удалении блоба, в транзакции вызывающего)."""
+    cursor.execute("DELETE FROM jobs WHERE filename = %s", (filename,))
+
+
+def job_statuses(cursor, filenames: list) -> dict:
+    """Состояние задач файлов для /images-list: {файл: {тип: {status, attempts[, error]}}}."""
+    if not filenames:
+        return {}
+    cursor.execute("""
+        SELECT filename, job_type, status, attempts, last_error FROM jobs
+        WHERE filename = ANY(%s)
+    """, (list(set(filenames)),))
+    statuses = {}
+    for filename, job_type, status, attempts, last_error in cursor.fetchall():
+        entry = {"status": status, "attempts": attempts}
+        if status == "failed" and last_error:
+            entry["error"] = last_error
+        statuses.setdefault(filename, {})[job_type] = entry
+    return statuses
+
+
+def backoff_delay(attempts: int, base: float = JOB_BACKOFF_BASE,
+                  maximum: float = JOB_BACKOFF_MAX) -> float:
+    """Задержка перед повтором: base * 2^(attempts-1) с разбросом, не больше maximum."""
+    delay = min(maximum, base * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    """Выдача задач исполнителям и запись результатов."""
+
+    def __init__(self, connection_factory, concurrency: dict = None, lease: int = JOB_LEASE):
+        self.connection_factory = connection_factory
+        self.concurrency = dict(JOB_CONCURRENCY if concurrency is None else concurrency)
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._counts = None
+        self._counts_time = 0.0
+
+    def limit(self, job_type: str) -> int:
+        return self.concurrency.get(job_type, JOB_DEFAULT_CONCURRENCY)
+
+    def claim(self, job_type: str):
+        """
+        Забирает готовую к выполнению задачу типа job_type или возвращает None.
+        Задача с истекшей арендой (исполнитель упал) выдается повторно.
+        """
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            try:
+                # Выдача задач одного типа сериализуется, чтобы лимит не превысили
+                # параллельные исполнители; сами строки выбираются с SKIP LOCKED
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ("jobs:" + job_type,))
+                cursor.execute("""
+                    SELECT COUNT(*) FROM jobs
+                    WHERE job_type = %s AND status = 'running' AND locked_until > now()
+                """, (job_type,))
+                if cursor.fetchone()[0] >= self.limit(job_type):
+                    conn.rollback()
+                    return None
+                cursor.execute("""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                        locked_until = now() + make_interval(secs => %s), updated_at = now()
+                    WHERE id = (
+                        SELECT id FROM jobs
+                        WHERE job_type = %s AND status IN ('queued', 'running')
+                          AND run_after <= now()
+                          AND (status = 'queued' OR locked_until <= now())
+                        ORDER BY run_after, id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, job_type, filename, attempts, max_attempts
+                """, (self.lease, job_type))
+                row = cursor.fetchone()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        return Job(*row) if row else None
+
+    def complete(self, job: Job) -> None:
+        """Отмечает задачу выполненной."""
+        self._finish(job, """
+            UPDATE jobs SET status = 'done', locked_until = NULL, last_error = NULL,
+                updated_at = now()
+            WHERE id = %s AND status = 'running'
+        """, (job.id,))
+
+    def fail(self, job: Job, error: Exception, permanent: bool = False) -> bool:
+        """
+        Записывает ошибку. Возвращает True, если задача будет повторена
+        (через backoff_delay), и False, если попытки исчерпаны.
+        """
+        message = f"{type(error).__name__}: {error}"[:1000]
+        if permanent or job.attempts >= job.max_attempts:
+            self._finish(job, """
+                UPDATE jobs SET status = 'failed', locked_until = NULL, last_error = %s,
+                    updated_at = now()
+                WHERE id = %s AND status = 'running'
+            """, (message, job.id))
+            return False
+        self._finish(job, """
+            UPDATE jobs SET status = 'queued', locked_until = NULL, last_error = %s,
+                run_after = now() + make_interval(secs => %s), updated_at = now()
+            WHERE id = %s AND status = 'running'
+        """, (message, backoff_delay(job.attempts), job.id))
+        return True
+
+    def _finish(self, job: Job, query: str, params: tuple) -> None:
+        # Задача могла быть удалена вместе с файлом или поставлена заново - тогда это no-op
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def counts(self, max_age: float = JOB_STATS_TTL) -> dict:
+        """Число незавершенных и неудавшихся задач по состояниям (кешируется на max_age)."""
+        with self._lock:
+            if self._counts is not None and time.monotonic() - self._counts_time < max_age:
+                return dict(self._counts)
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT status, COUNT(*) FROM jobs
+                WHERE status IN ('queued', 'running', 'failed')
+                GROUP BY status
+            """)
+            counts = {status: 0 for status in ("queued", "running", "failed")}
+            counts.update(dict(cursor.fetchall()))
+            cursor.close()
+        with self._lock:
+            self._counts = counts
+            self._counts_time = time.monotonic()
+        return dict(counts)
+
+
+class JobWorker:
+    """
+    Исполнитель: по JOB_CONCURRENCY потоков на каждый тип задач. Потоки ждут
+    уведомления о новых задачах (LISTEN) или опрашивают очередь раз в JOB_POLL_INTERVAL.
+    """
+
+    def __init__(self, queue: JobQueue, handlers: dict, db_config: dict,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handlers = handlers  # тип задачи -> функция(имя файла)
+        self.db_config = db_config
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {"completed": 0, "retried": 0, "failed": 0}
+
+    def start(self) -> None:
+        threading.Thread(target=self._listen_loop, name="jobs-listener", daemon=True).start()
+        for job_type in self.handlers:
+            for index in range(self.queue.limit(job_type)):
+                thread = threading.Thread(target=self._run_loop, args=(job_type,),
+                                          name=f"job-{job_type}-{index}")
+                thread.start()
+                self._threads.append(thread)
+        logger.info("Job worker started: " + ", ".join(
+            f"{job_type} x{self.queue.limit(job_type)}" for job_type in self.handlers))
+
+    def stop(self) -> None:
+        """Останавливает потоки после текущих задач."""
+        self._stop.set()
+        self._notify()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _notify(self) -> None:
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _run_loop(self, job_type: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(job_type)
+            except Exception as e:
+                logger.warning(f"Could not claim {job_type} job: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not self._stop.is_set():
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _execute(self, job: Job) -> None:
+        started = time.perf_counter()
+        try:
+            self.handlers[job.job_type](job.filename)
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError)
+            try:
+                retried = self.queue.fail(job, e, permanent=permanent)
+            except Exception as db_error:
+                # Задачу заберет другой исполнитель после окончания аренды
+                logger.error(f"Could not record failure of job {job.id}: {db_error}")
+                return
+            with self._lock:
+                self._stats["retried" if retried else "failed"] += 1
+            if retried:
+                logger.warning(f"Job {job.job_type} for {job.filename} failed "
+                               f"(attempt {job.attempts}/{job.max_attempts}), will retry: {e}")
+            else:
+                logger.error(f"Job {job.job_type} for {job.filename} failed permanently "
+                             f"after {job.attempts} attempt(s): {e}")
+            return
+
+        try:
+            self.queue.complete(job)
+        except Exception as e:
+            logger.error(f"Could not mark job {job.id} as done: {e}")
+            return
+        with self._lock:
+            self._stats["completed"] += 1
+        logger.info(f"Job {job.job_type} done for {job.filename} "
+                    f"in {time.perf_counter() - started:.3f}s", extra={"sample": True})
+
+    def _listen_loop(self) -> None:
+        """Будит потоки по уведомлениям о новых задачах."""
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {JOBS_CHANNEL}")
+                # Задачи, поставленные до подписки, потоки заберут при ближайшем опросе
+                self._notify()
+                while not self._stop.is_set():
+                    ready, _, _ = select.select([conn], [], [], self.poll_interval)
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self._notify()
+                    elif not ready:
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT 1")
+            except Exception as e:
+                logger.warning(f"Job listener disconnected: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(LISTENER_RECONNECT_DELAY)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
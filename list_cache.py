@@ -0,0 +1,175 @@
+"""
+Кеш готовых ответов /images-list с инвалидацией через PostgreSQL LISTEN/NOTIFY.
+"""
+
+import hashlib
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2 import extensions
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки кеша (переопределяются переменными окружения)
+LIST_CACHE_TTL = float(os.environ.get("LIST_CACHE_TTL", "30"))  # секунды
+LIST_CACHE_MAX_ENTRIES = int(os.environ.get("LIST_CACHE_MAX_ENTRIES", "256"))
+LIST_CACHE_MAX_BYTES = int(os.environ.get("LIST_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Канал уведомлений; NOTIFY отправляет триггер на таблице images
+CHANGES_CHANNEL = "images_changed"
+LISTENER_POLL_INTERVAL = 5.0  # секунды
+LISTENER_RECONNECT_DELAY = 2.0  # секунды
+
+
+def notify_changed(cursor, reason: str) -> None:
+    """
+    Сбрасывает кеши списка во всех процессах для изменений, которые не вызывают триггер
+    на images (счетчик, pg_restore). Уведомление уходит при commit транзакции cursor.
+    """
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, reason))
+
+
+def make_etag(body: bytes) -> str:
+    """ETag по содержимому: одинаковый во всех процессах для одинаковых данных."""
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+class ListResponseCache:
+    """Версионированный кеш закодированных ответов с ограничением по TTL, числу и объему."""
+
+    def __init__(self, db_config: dict, ttl: float = LIST_CACHE_TTL,
+                 max_entries: int = LIST_CACHE_MAX_ENTRIES, max_bytes: int = LIST_CACHE_MAX_BYTES):
+        self.db_config = db_config
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> (тело, etag, время создания)
+        self._bytes = 0
+        self._version = 0
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        self._listener_pid = None
+        self._listening = False
+
+    @property
+    def version(self) -> int:
+        """Текущая версия данных; увеличивается при каждой инвалидации."""
+        return self._version
+
+    def get(self, key):
+        """Возвращает (тело, etag) или None. Без активного LISTEN кеш не используется."""
+        self._ensure_listener()
+        with self._lock:
+            if not self._listening:
+                self._stats["misses"] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[2] > self.ttl:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0], entry[1]
+
+    def put(self, key, version: int, body: bytes) -> str:
+        """
+        Сохраняет ответ, построенный по данным версии version. Возвращает ETag.
+        Если за время построения данные изменились, ответ не кешируется.
+        """
+        etag = make_etag(body)
+        if len(body) > self.max_bytes:
+            return etag
+        with self._lock:
+            if version != self._version or not self._listening:
+                return etag
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (body, etag, time.monotonic())
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _key, (old_body, _etag, _created) = self._entries.popitem(last=False)
+                self._bytes -= len(old_body)
+                self._stats["evictions"] += 1
+        return etag
+
+    def invalidate(self) -> None:
+        """Сбрасывает кеш и увеличивает версию данных."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        """Статистика кеша для мониторинга."""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "version": self._version,
+                "listening": self._listening,
+            })
+        return data
+
+    def _ensure_listener(self) -> None:
+        """Запускает поток LISTEN один раз в каждом процессе (в том числе после fork)."""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            self._listening = False
+            self._entries.clear()
+            self._bytes = 0
+        threading.Thread(target=self._listen_loop, name="list-cache-listener", daemon=True).start()
+
+    def _set_listening(self, value: bool) -> None:
+        """Меняет состояние подписки; при любой смене кеш сбрасывается."""
+        self.invalidate()
+        with self._lock:
+            self._listening = value
+
+    def _listen_loop(self) -> None:
+        """Держит отдельное подключение с LISTEN и сбрасывает кеш по уведомлениям."""
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+                # Пока подписки не было, изменения могли пройти мимо - начинаем с чистого кеша
+                self._set_listening(True)
+                logger.info(f"List cache listening on '{CHANGES_CHANNEL}' (pid {os.getpid()})")
+
+                while True:
+                    ready, _, _ = select.select([conn], [], [], LISTENER_POLL_INTERVAL)
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidate()
+                    elif not ready:
+                        # Периодическая проверка, что подключение живо
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT 1")
+            except Exception as e:
+                if self._listening:
+                    logger.warning(f"List cache listener disconnected: {e}")
+                self._set_listening(False)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(LISTENER_RECONNECT_DELAY)
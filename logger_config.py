@@ -1,46 +1,281 @@
+"""
+Настройка логирования: асинхронная запись через QueueHandler/QueueListener,
+JSON-строки с request id, выборочная запись частых успешных сообщений
+и ротация файла, безопасная при записи из нескольких процессов.
+"""
+
+import atexit
+import contextvars
+import datetime
+import fcntl
+import json
 import logging
+import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
+# Настройки логирования (переопределяются переменными окружения)
+LOG_FILE = os.environ.get("LOG_FILE", "server.log")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(5 * 1024 * 1024)))  # 5 МБ
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "3"))
+LOG_MODE = os.environ.get("LOG_MODE", "async")  # async | sync
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Доля записываемых сообщений, помеченных как выборочные (успешные операции, access log)
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get("LOG_SUCCESS_SAMPLE_RATE", "1.0"))
 
-def get_logger():
+# Контекст текущего запроса: id и длительности этапов
+_request_id = contextvars.ContextVar("request_id", default=None)
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+# Дополнительные поля записи, которые попадают в JSON
+_EXTRA_FIELDS = (
+    "method", "route", "path", "status", "duration_ms", "bytes_in", "bytes_out", "client",
+    "stages",
+)
+
+
+def start_request(request_id: str) -> None:
+    """Начинает контекст запроса в текущем потоке."""
+    _request_id.set(request_id)
+    _request_stages.set({})
+
+
+def end_request() -> None:
+    """Завершает контекст запроса."""
+    _request_id.set(None)
+    _request_stages.set(None)
+
+
+def request_stages() -> dict:
+    """Длительности этапов текущего запроса в миллисекундах."""
+    return dict(_request_stages.get() or {})
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Добавляет длительность этапа к текущему запросу (повторные этапы суммируются)."""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 3)
+
+
+class RequestContextFilter(logging.Filter):
+    """Добавляет request id и выполняет выборку сообщений с extra={"sample": True}."""
+
+    def __init__(self, sample_rate: float = LOG_SUCCESS_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False) and self.sample_rate < 1.0 \
+                and random.random() >= self.sample_rate:
+            return False
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        for field in _EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат с request id, если он есть."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                         datefmt='%Y-%m-%d %H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{line} [rid={request_id}]" if request_id else line
+
+
+class ProcessSafeRotatingFileHandler(RotatingFileHandler):
     """
-    Создает и настраивает логгер для приложения.
+    RotatingFileHandler для нескольких процессов, пишущих в один файл: проверка размера,
+    ротация и запись выполняются под flock, а после ротации чужим процессом файл переоткрывается.
     """
-    # Создание логгера
-    logger = logging.getLogger("ImageServer")
-    logger.setLevel(logging.INFO)
 
-    # Проверяем, чтобы не добавлять обработчики повторно
-    if logger.handlers:
-        return logger
+    def __init__(self, filename: str, maxBytes: int = 0, backupCount: int = 0,
+                 encoding: str = None):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount,
+                         encoding=encoding, delay=True)
+        self._lock_fd = None
+        self._lock_pid = None
+
+    def _acquire_file_lock(self) -> None:
+        """flock на отдельном lock-файле; дескриптор свой в каждом процессе (после fork - новый)."""
+        if self._lock_pid != os.getpid():
+            # Унаследованный дескриптор разделяет блокировку с родителем - открываем заново
+            self._lock_fd = os.open(self.baseFilename + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _reopen_if_rotated(self) -> None:
+        """Переоткрывает файл, если его переименовал другой процесс."""
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+            opened = os.fstat(self.stream.fileno())
+            if (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                return
+        except FileNotFoundError:
+            pass
+        self.stream.close()
+        self.stream = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._acquire_file_lock()
+            try:
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        super().close()
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = None
 
-    # Форматтер для логов
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не блокирует запрос."""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+_output_handlers = []
+
+
+def _create_output_handlers(formatter: logging.Formatter) -> list:
+    """Обработчики, выполняющие фактическую запись (консоль и файл)."""
+    handlers = []
 
     # Обработчик для вывода в консоль
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
-    # Обработчик для записи в файл (с ротацией)
+    # Обработчик для записи в файл (с ротацией, общей для всех процессов)
     try:
-        file_handler = RotatingFileHandler(
-            "server.log",
-            maxBytes=5 * 1024 * 1024,  # 5 МБ
-            backupCount=3,
+        file_handler = ProcessSafeRotatingFileHandler(
+            LOG_FILE,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
             encoding='utf-8'
         )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
-        logger.warning(f"Could not create file handler: {e}")
+        print(f"Could not create file handler: {e}", file=sys.stderr)
+
+    return handlers
+
+
+def _start_listener() -> None:
+    """Запускает поток записи логов для текущего процесса."""
+    global _listener
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *_output_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    """Дописывает оставшиеся в очереди записи (при завершении процесса)."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def flush_logs() -> None:
+    """
+    Дописывает записи из очереди и сбрасывает файлы - для процессов, которые завершаются
+    через os._exit (обработчики atexit, в том числе остановка потока записи, не вызываются).
+    """
+    _stop_listener()
+    for handler in _output_handlers:
+        handler.flush()
+
+
+def _restart_listener_after_fork() -> None:
+    """После fork поток записи не существует - дочернему процессу нужен свой."""
+    global _listener
+    if _queue_handler is None:
+        return
+    _listener = None
+    for handler in _output_handlers:
+        handler.createLock()
+    _start_listener()
+
+
+def get_logger():
+    """
+    Создает и настраивает логгер для приложения.
+    """
+    global _queue_handler, _output_handlers
+
+    # Создание логгера
+    logger = logging.getLogger("ImageServer")
+    logger.setLevel(logging.INFO)
+
+    # Проверяем, чтобы не добавлять обработчики повторно
+    if logger.handlers:
+        return logger
+
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter()
+    _output_handlers = _create_output_handlers(formatter)
+    context_filter = RequestContextFilter()
+
+    if LOG_MODE == "async":
+        # Запрос только кладет запись в очередь; форматирование и запись - в отдельном потоке
+        _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(context_filter)
+        logger.addHandler(_queue_handler)
+        _start_listener()
+        atexit.register(_stop_listener)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_restart_listener_after_fork)
+    else:
+        for handler in _output_handlers:
+            handler.addFilter(context_filter)
+            logger.addHandler(handler)
 
     return logger
 
 
 # Для удобства можно также создать предварительно настроенный логгер
-logger = get_logger()
\ No newline at end of file
+logger = get_logger()
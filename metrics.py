@@ -0,0 +1,378 @@
+"""
+Метрики в формате Prometheus: счетчики, gauge и гистограммы задержек.
+Каждый процесс периодически сбрасывает свои значения в файл METRICS_DIR/<pid>.json,
+а /metrics суммирует файлы всех процессов (pre-fork, пул потоков и asyncio одинаково).
+Gauge с aggregate="max" не суммируются: так экспортируются общие для всех процессов
+значения (например, глубина очереди задач в базе), которые каждый процесс видит целиком.
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from logger_config import get_logger, record_stage
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+METRICS_DIR = os.environ.get("METRICS_DIR", "/tmp/image_hosting_metrics")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))  # секунды
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Способы объединения gauge между процессами
+GAUGE_AGGREGATIONS = ("sum", "max")
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки и значения по наборам меток."""
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # кортеж значений меток -> значение
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self) -> list:
+        """Список [значения меток, значение] для записи в файл процесса."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение (например, число запросов в обработке). aggregate - как объединять
+    значения процессов: "sum" для значений процесса, "max" для общих значений.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 aggregate: str = "sum"):
+        if aggregate not in GAUGE_AGGREGATIONS:
+            raise ValueError(f"Unknown gauge aggregation: {aggregate}")
+        self.aggregate = aggregate
+        super().__init__(name, documentation, labelnames)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Последняя корзина - значения больше всех границ (+Inf)
+                entry = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1),
+                                             "sum": 0.0, "count": 0}
+            entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), {"buckets": list(value["buckets"]), "sum": value["sum"],
+                                 "count": value["count"]}]
+                    for key, value in self._values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока with."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор: замеряет длительность вызова функции и добавляет ее как этап текущего запроса."""
+    def decorator(func):
+        stage = labels.get("stage", func.__name__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                histogram.observe(elapsed, **labels)
+                record_stage(stage, elapsed)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    """Метрики процесса и их агрегация между процессами через файлы."""
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._collectors = []
+        self._flusher_started = False
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def register_collector(self, collector) -> None:
+        """
+        Добавляет функцию, возвращающую {имя: (тип, описание, значение)} - значения,
+        которые считаются в другом месте (статистика пулов и кешей). Для общих между
+        процессами gauge - (тип, описание, значение, "max").
+        """
+        self._collectors.append(collector)
+
+    def _after_fork(self) -> None:
+        """Дочерний процесс начинает с нуля: значения родителя учтены в его файле."""
+        self._lock = threading.Lock()
+        self._flusher_started = False
+        for metric in self._metrics:
+            metric._lock = threading.Lock()
+            metric.reset()
+
+    def ensure_started(self) -> None:
+        """Запускает фоновый сброс метрик процесса в файл (один раз на процесс)."""
+        if self._flusher_started:
+            return
+        with self._lock:
+            if self._flusher_started:
+                return
+            self._flusher_started = True
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+
+    def clear(self) -> None:
+        """Удаляет файлы процессов прошлого запуска (вызывается при старте сервера)."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _flush_loop(self) -> None:
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Could not write metrics file: {e}")
+            time.sleep(self.flush_interval)
+
+    def _snapshot(self) -> dict:
+        data = {}
+        for metric in self._metrics:
+            entry = {"type": metric.type, "help": metric.documentation,
+                     "labelnames": list(metric.labelnames), "samples": metric.snapshot()}
+            if metric.type == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            elif metric.type == "gauge":
+                entry["aggregate"] = metric.aggregate
+            data[metric.name] = entry
+        for collector in self._collectors:
+            try:
+                for name, (metric_type, documentation, value, *aggregate) in collector().items():
+                    data[name] = {"type": metric_type, "help": documentation, "labelnames": [],
+                                  "samples": [[[], value]]}
+                    if metric_type == "gauge":
+                        data[name]["aggregate"] = aggregate[0] if aggregate else "sum"
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return data
+
+    def flush(self) -> None:
+        """Атомарно записывает значения текущего процесса в его файл."""
+        body = json.dumps({"pid": os.getpid(), "metrics": self._snapshot()})
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(body)
+            os.replace(temp_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _read_all(self) -> list:
+        """Читает снимки всех процессов; свой снимок берется из памяти."""
+        own_pid = os.getpid()
+        snapshots = [{"pid": own_pid, "metrics": self._snapshot()}]
+        if not os.path.isdir(self.directory):
+            return snapshots
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{own_pid}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> bytes:
+        """Текст в формате Prometheus, просуммированный по всем процессам (общие gauge - максимум)."""
+        merged = {}
+        for snapshot in self._read_all():
+            alive = _process_alive(snapshot["pid"])
+            for name, entry in snapshot["metrics"].items():
+                # Значения gauge умерших процессов устарели; счетчики и гистограммы сохраняются
+                if entry["type"] == "gauge" and not alive:
+                    continue
+                target = merged.setdefault(name, {**entry, "samples": {}})
+                for labels, value in entry["samples"]:
+                    key = tuple(labels)
+                    if entry["type"] == "histogram":
+                        current = target["samples"].setdefault(
+                            key, {"buckets": [0] * len(value["buckets"]), "sum": 0.0, "count": 0}
+                        )
+                        current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                        current["sum"] += value["sum"]
+                        current["count"] += value["count"]
+                    elif entry.get("aggregate") == "max":
+                        target["samples"][key] = max(target["samples"].get(key, value), value)
+                    else:
+                        target["samples"][key] = target["samples"].get(key, 0) + value
+
+        lines = []
+        for name in sorted(merged):
+            entry = merged[name]
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            labelnames = entry["labelnames"]
+            for key, value in sorted(entry["samples"].items()):
+                if entry["type"] == "histogram":
+                    cumulative = 0
+                    bounds = [_format_value(b) for b in entry["buckets"]] + ["+Inf"]
+                    for bound, count in zip(bounds, value["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labelnames, key, le=bound)} "
+                                     f"{cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, key)} "
+                                 f"{_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, key)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: list, values: tuple, **extra) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+REGISTRY = Registry()
+
+# Метрики HTTP запросов
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by method, route and status",
+                        ("method", "route", "status"))
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds",
+                                  "HTTP request latency by method and route", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being processed")
+HTTP_REQUEST_BYTES = Counter("http_request_bytes_total",
+                             "Request body bytes (declared Content-Length) by route", ("route",))
+HTTP_RESPONSE_BYTES = Counter("http_response_bytes_total", "Response body bytes by route",
+                              ("route",))
+
+# Этапы загрузки
+UPLOAD_STAGE_DURATION = Histogram("upload_stage_duration_seconds",
+                                  "Upload processing time by stage", ("stage",))
+
+# База данных
+DB_CONNECT_DURATION = Histogram("db_connect_duration_seconds",
+                                "Time to open a new PostgreSQL connection")
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds",
+                              "PostgreSQL statement execution time by statement type",
+                              ("statement",))
+
+# Варианты изображений в современных форматах
+VARIANT_RESPONSES = Counter("image_variant_responses_total",
+                            "Originals served as a transcoded variant by format", ("format",))
+VARIANT_BYTES_SAVED = Counter("image_variant_bytes_saved_total",
+                              "Bytes saved by serving transcoded variants instead of originals",
+                              ("format",))
+
+# Почти одинаковые изображения
+NEAR_DUPLICATE_REJECTIONS = Counter("uploads_rejected_near_duplicate_total",
+                                    "Uploads rejected as near-duplicates of existing images")
+
+# Контроль допуска загрузок
+UPLOAD_REJECTIONS = Counter("uploads_rejected_total",
+                            "Uploads rejected before reading the body by reason", ("reason",))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Скрипт миграции существующих изображений в контентно-адресуемое хранилище:
+пересчитывает SHA-256 файлов, переносит их в шардированные каталоги
+и обновляет filename/content_hash в таблице images.
+"""
+
+import argparse
+import os
+
+from content_store import blob_relpath, hash_file, lock_blob
+from logger_config import get_logger
+from schema import init_database
+from services import UPLOAD_DIR, get_db_connection
+from thumbnails import remove_derivatives
+
+logger = get_logger()
+
+BATCH_SIZE = 500
+
+
+def migrate_row(image_id: int, filename: str, dry_run: bool, keep_legacy_links: bool) -> str:
+    """Переносит файл одной записи. Возвращает результат: migrated, deduplicated, missing."""
+    old_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(old_path):
+        logger.error(f"Migration: file not found for image {image_id}: {filename}")
+        return "missing"
+
+    content_hash = hash_file(old_path)
+    ext = os.path.splitext(filename)[1].lower()
+    relpath = blob_relpath(content_hash, ext)
+    new_path = os.path.join(UPLOAD_DIR, relpath)
+
+    if dry_run:
+        return "deduplicated" if os.path.exists(new_path) else "migrated"
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        lock_blob(cursor, relpath)
+
+        moved = False
+        if os.path.exists(new_path):
+            result = "deduplicated"
+        else:
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.rename(old_path, new_path)
+            moved = True
+            result = "migrated"
+
+        try:
+            cursor.execute("""
+                UPDATE images SET filename = %s, content_hash = %s WHERE id = %s
+            """, (relpath, content_hash, image_id))
+            conn.commit()
+        except Exception:
+            if moved:
+                os.rename(new_path, old_path)
+            raise
+        finally:
+            cursor.close()
+
+    # Старое имя больше не нужно: либо оставляем жесткую ссылку для старых URL, либо удаляем
+    if os.path.exists(old_path) and not moved:
+        os.remove(old_path)
+    if keep_legacy_links:
+        os.link(new_path, old_path)
+    remove_derivatives(filename)
+    return result
+
+
+def migrate(dry_run: bool = False, keep_legacy_links: bool = False) -> dict:
+    """Мигрирует все записи без content_hash пачками по BATCH_SIZE."""
+    totals = {"migrated": 0, "deduplicated": 0, "missing": 0, "failed": 0}
+    last_id = 0
+
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, filename FROM images
+                WHERE content_hash IS NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, BATCH_SIZE))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        if not rows:
+            break
+
+        for image_id, filename in rows:
+            last_id = image_id
+            try:
+                totals[migrate_row(image_id, filename, dry_run, keep_legacy_links)] += 1
+            except Exception as e:
+                totals["failed"] += 1
+                logger.error(f"Migration failed for image {image_id} ({filename}): {e}")
+
+        logger.info(f"Migration progress: last id {last_id}, {totals}")
+
+    logger.info(f"Migration finished{' (dry run)' if dry_run else ''}: {totals}")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Только посчитать, ничего не менять")
+    parser.add_argument("--keep-legacy-links", action="store_true",
+                        help="Оставить жесткие ссылки со старыми именами, чтобы работали старые URL")
+    args = parser.parse_args()
+
+    init_database()
+    migrate(dry_run=args.dry_run, keep_legacy_links=args.keep_legacy_links)
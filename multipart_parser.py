@@ -0,0 +1,197 @@
+"""
+Потоковый парсер multipart/form-data: читает тело запроса частями и не держит его в памяти.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024  # 64 КБ
+MAX_PART_HEADERS_SIZE = 16 * 1024  # 16 КБ на заголовки одной части
+
+_PARAM_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+class MultipartError(Exception):
+    """Тело запроса не является корректным multipart сообщением."""
+
+
+class FileTooLargeError(MultipartError):
+    """Файл в запросе превышает допустимый размер."""
+
+
+class MultipartPart:
+    """Одна часть multipart сообщения. Данные читаются потоково через iter_chunks()."""
+
+    def __init__(self, reader: "MultipartReader", headers: dict):
+        self._reader = reader
+        self.headers = headers
+        disposition = headers.get("content-disposition", "")
+        params = dict(_PARAM_RE.findall(disposition))
+        self.name = params.get("name")
+        self.filename = params.get("filename")
+        self.content_type = headers.get("content-type", "application/octet-stream")
+
+    def iter_chunks(self):
+        """Отдает данные части кусками до следующего boundary."""
+        return self._reader._iter_part_data()
+
+    def read(self, limit: int) -> bytes:
+        """Читает небольшую часть (обычное поле формы) целиком, но не более limit байт."""
+        data = bytearray()
+        for chunk in self.iter_chunks():
+            data += chunk
+            if len(data) > limit:
+                raise MultipartError(f"Form field '{self.name}' is too large")
+        return bytes(data)
+
+
+class MultipartReader:
+    """Итератор по частям multipart тела, читаемого из потока с известной длиной."""
+
+    def __init__(self, stream, boundary: str, content_length: int, chunk_size: int = CHUNK_SIZE):
+        self._stream = stream
+        self._remaining = content_length
+        self._chunk_size = chunk_size
+        self._delimiter = b"\r\n--" + boundary.encode("latin-1")
+        # Первый boundary может идти без предшествующего CRLF - добавляем его искусственно
+        self._buffer = bytearray(b"\r\n")
+        self._in_part = False
+        self._finished = False
+
+    @property
+    def bytes_remaining(self) -> int:
+        """Сколько байт тела еще не прочитано из сокета."""
+        return self._remaining
+
+    def _fill(self) -> bool:
+        """Дочитывает следующий кусок тела в буфер. Возвращает False, если тело закончилось."""
+        if self._remaining <= 0:
+            return False
+        chunk = self._stream.read(min(self._chunk_size, self._remaining))
+        if not chunk:
+            raise MultipartError("Request body ended unexpectedly")
+        self._remaining -= len(chunk)
+        self._buffer += chunk
+        return True
+
+    def _iter_part_data(self):
+        """Отдает данные текущей части; останавливается перед delimiter."""
+        if not self._in_part:
+            return
+        keep = len(self._delimiter) - 1
+        while True:
+            idx = self._buffer.find(self._delimiter)
+            if idx != -1:
+                if idx:
+                    yield bytes(self._buffer[:idx])
+                del self._buffer[:idx]
+                self._in_part = False
+                return
+            # Хвост длиной delimiter-1 оставляем: boundary может быть разрезан между чтениями
+            if len(self._buffer) > keep:
+                yield bytes(self._buffer[:-keep])
+                del self._buffer[:-keep]
+            if not self._fill():
+                raise MultipartError("Closing boundary not found")
+
+    def _skip_to_delimiter(self) -> None:
+        """Пропускает преамбулу или непрочитанные данные текущей части."""
+        self._in_part = True
+        for _ in self._iter_part_data():
+            pass
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> MultipartPart:
+        if self._finished:
+            raise StopIteration
+
+        # Данные предыдущей части (или преамбула) могли быть прочитаны не полностью
+        self._skip_to_delimiter()
+        del self._buffer[:len(self._delimiter)]
+
+        # После boundary идет либо "--" (конец сообщения), либо CRLF и заголовки части
+        while len(self._buffer) < 2 and self._fill():
+            pass
+        if self._buffer[:2] == b"--":
+            self._finished = True
+            raise StopIteration
+
+        while True:
+            header_end = self._buffer.find(b"\r\n\r\n")
+            if header_end != -1:
+                break
+            if len(self._buffer) > MAX_PART_HEADERS_SIZE:
+                raise MultipartError("Multipart part headers are too large")
+            if not self._fill():
+                raise MultipartError("Multipart part headers are incomplete")
+
+        headers_text = self._buffer[:header_end].decode("utf-8", errors="ignore")
+        del self._buffer[:header_end + 4]
+
+        headers = {}
+        for line in headers_text.split("\r\n"):
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        self._in_part = True
+        return MultipartPart(self, headers)
+
+    def discard_remaining(self, limit: int = CHUNK_SIZE) -> bool:
+        """Дочитывает эпилог тела, если он не больше limit. Возвращает True, если тело прочитано."""
+        if self._remaining > limit:
+            return False
+        while self._remaining > 0:
+            self._buffer.clear()
+            self._fill()
+        self._buffer.clear()
+        return True
+
+
+class UploadedFile:
+    """Файл, сохраненный во временный файл рядом с местом назначения."""
+
+    __slots__ = ("path", "filename", "size", "sha256", "phash")
+
+    def __init__(self, path: str, filename: str, size: int, sha256: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.phash = None  # перцептивный хеш, заполняется при проверке изображения
+
+    def discard(self) -> None:
+        """Удаляет временный файл."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def save_part_to_temp(part: MultipartPart, directory: str, max_size: int) -> UploadedFile:
+    """
+    Потоково пишет файловую часть во временный файл, проверяя размер по мере поступления
+    и считая SHA-256 содержимого без повторного чтения файла.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in part.iter_chunks():
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLargeError(f"File exceeds {max_size} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return UploadedFile(temp_path, part.filename, size, digest.hexdigest())
@@ -0,0 +1,141 @@
+"""
+Поиск почти одинаковых изображений (уменьшенные, пережатые копии) по перцептивному
+хешу images.phash (dHash, image_processing.dhash).
+
+Индекс - multi-index hashing: 64 бита хеша делятся на 4 части по 16 бит, на каждую
+часть - свой btree-индекс. Если хеши отличаются не больше чем на d бит, хотя бы одна
+часть отличается не больше чем на d // 4 бит, поэтому кандидаты выбираются по индексам
+частей (значения в этом радиусе), а точное расстояние Хэмминга считается только для них.
+"""
+
+import itertools
+import os
+
+import psycopg2
+
+from image_search import ensure_index
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+# off - только поиск через /images-similar, reject - отклонять загрузку почти одинаковых изображений
+NEAR_DUPLICATE_MODE = os.environ.get("NEAR_DUPLICATE_MODE", "off")
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_DISTANCE", "4"))  # бит из 64
+MAX_SIMILAR_DISTANCE = 16
+DEFAULT_SIMILAR_RESULTS = 20
+MAX_SIMILAR_RESULTS = 100
+
+PHASH_BITS = 64
+CHUNK_BITS = 16
+CHUNKS = PHASH_BITS // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# При большем радиусе по части (порог от 8 бит) перебор значений медленнее, чем
+# сканирование таблицы с подсчетом расстояния (1M строк: 410 против 235 мс)
+MAX_CHUNK_RADIUS = 1
+
+
+class SimilarParamsError(ValueError):
+    """Некорректные параметры поиска похожих изображений."""
+
+
+def _chunk_expr(index: int) -> str:
+    """Выражение части хеша; должно совпадать с выражением индекса."""
+    shift = PHASH_BITS - CHUNK_BITS * (index + 1)
+    return f"((phash >> {shift}) & {CHUNK_MASK})"
+
+
+PHASH_INDEXES = {
+    f"idx_images_phash_{index}": f"ON images ({_chunk_expr(index)}) WHERE phash IS NOT NULL"
+    for index in range(CHUNKS)
+}
+
+
+def to_db(phash: int) -> int:
+    """Беззнаковый 64-битный хеш -> значение BIGINT."""
+    return phash - (1 << PHASH_BITS) if phash >= 1 << (PHASH_BITS - 1) else phash
+
+
+def _chunk(phash: int, index: int) -> int:
+    return (phash >> (PHASH_BITS - CHUNK_BITS * (index + 1))) & CHUNK_MASK
+
+
+def _neighbours(value: int, radius: int) -> list:
+    """Все значения части, отличающиеся от value не больше чем на radius бит."""
+    values = [value]
+    for distance in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def similar_query(phash: int, distance: int, limit: int, exclude_id: int = None) -> tuple:
+    """
+    Запрос изображений с расстоянием Хэмминга до phash не больше distance,
+    ближайшие первыми. Возвращает (sql, параметры).
+    """
+    signed = to_db(phash)
+    clauses = ["phash IS NOT NULL", "bit_count((phash # %s)::bit(64)) <= %s"]
+    params = [signed, signed, distance]
+    radius = distance // CHUNKS
+    if radius <= MAX_CHUNK_RADIUS:
+        clauses.append("(" + " OR ".join(f"{_chunk_expr(index)} = ANY(%s::bigint[])"
+                                         for index in range(CHUNKS)) + ")")
+        params.extend(_neighbours(_chunk(phash, index), radius) for index in range(CHUNKS))
+    if exclude_id is not None:
+        clauses.append("id <> %s")
+        params.append(exclude_id)
+    sql = f"""
+        SELECT id, filename, original_name, upload_time, bit_count((phash # %s)::bit(64)) AS distance
+        FROM images
+        WHERE {" AND ".join(clauses)}
+        ORDER BY distance, id
+        LIMIT %s
+    """
+    params.append(limit)
+    return sql, params
+
+
+def find_similar(cursor, phash: int, distance: int = NEAR_DUPLICATE_DISTANCE,
+                 limit: int = DEFAULT_SIMILAR_RESULTS, exclude_id: int = None) -> list:
+    """Почти одинаковые изображения: список (id, filename, original_name, upload_time, расстояние)."""
+    cursor.execute(*similar_query(phash, distance, limit, exclude_id))
+    return cursor.fetchall()
+
+
+def image_phash(cursor, image_id: int):
+    """
+    Хеш изображения по id. Возвращает (найдено, хеш): хеш None, если он еще не посчитан
+    (изображение загружено до появления хешей - см. backfill_phash.py).
+    """
+    cursor.execute("SELECT phash FROM images WHERE id = %s", (image_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return False, None
+    return True, None if row[0] is None else row[0] & ((1 << PHASH_BITS) - 1)
+
+
+def parse_distance(query_params: dict) -> int:
+    """Порог расстояния из параметра distance (по умолчанию NEAR_DUPLICATE_DISTANCE)."""
+    try:
+        distance = int(query_params.get("distance", [NEAR_DUPLICATE_DISTANCE])[0])
+    except ValueError:
+        raise SimilarParamsError("Parameter 'distance' must be an integer")
+    if not 0 <= distance <= MAX_SIMILAR_DISTANCE:
+        raise SimilarParamsError(f"Parameter 'distance' must be between 0 and {MAX_SIMILAR_DISTANCE}")
+    return distance
+
+
+def create_phash_indexes(db_config: dict) -> None:
+    """Миграция: индексы частей хеша, без блокировки записи в images."""
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for name, definition in PHASH_INDEXES.items():
+                ensure_index(cursor, name, definition)
+    finally:
+        conn.close()
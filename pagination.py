@@ -0,0 +1,46 @@
+"""
+Параметры пагинации /images-list: размер страницы и курсоры keyset-пагинации.
+"""
+
+import base64
+import binascii
+import datetime
+
+
+class PaginationParamsError(ValueError):
+    """Некорректные параметры пагинации в запросе."""
+
+
+def parse_limit(query_params: dict, default: int, maximum: int) -> int:
+    """Возвращает размер страницы из параметра limit, ограниченный сверху maximum."""
+    try:
+        limit = int(query_params.get("limit", [default])[0])
+    except ValueError:
+        raise PaginationParamsError("Parameter 'limit' must be an integer")
+    return min(max(1, limit), maximum)
+
+
+def parse_page(query_params: dict) -> int:
+    """Возвращает номер страницы (не меньше 1)."""
+    try:
+        page = int(query_params.get("page", [1])[0])
+    except ValueError:
+        raise PaginationParamsError("Parameter 'page' must be an integer")
+    return max(1, page)  # Страница не может быть меньше 1
+
+
+def encode_cursor(upload_time: datetime.datetime, image_id: int) -> str:
+    """Кодирует позицию (upload_time, id) последней записи страницы в непрозрачный курсор."""
+    raw = f"{upload_time.isoformat()}|{image_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Декодирует курсор в (upload_time, id)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        time_part, id_part = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(time_part), int(id_part)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise PaginationParamsError("Invalid cursor")
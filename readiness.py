@@ -0,0 +1,148 @@
+"""
+Готовность процесса к приему трафика для /readyz. Состояние базы данных проверяет
+фоновый поток раз в READINESS_INTERVAL через собственное подключение, а проба только
+читает результат: частые проверки оркестратора не нагружают Postgres и не занимают
+подключения пула.
+"""
+
+import os
+import threading
+import time
+
+import psycopg2
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+READINESS_INTERVAL = float(os.environ.get("READINESS_INTERVAL", "5"))  # секунды между проверками
+READINESS_TIMEOUT = int(os.environ.get("READINESS_TIMEOUT", "3"))  # секунды на подключение и запрос
+# Результат старше стольких интервалов считается устаревшим (поток проверки завис)
+READINESS_STALE_INTERVALS = 3
+
+
+class ReadinessMonitor:
+    """
+    Фоновая проверка базы данных (одна на процесс, запускается после fork при первом
+    запросе). prepare - функция, возвращающая True, когда схема базы актуальна;
+    пока она не вернула True, вызывается на каждой проверке.
+    """
+
+    def __init__(self, db_config: dict, prepare=None, interval: float = READINESS_INTERVAL,
+                 timeout: int = READINESS_TIMEOUT):
+        self.db_config = db_config
+        self.prepare = prepare
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._checked = threading.Event()
+        self._started_pid = None
+        self._conn = None
+        self._prepared = prepare is None
+        self._state = {"database": "unknown", "error": None, "checked_at": None,
+                       "check_ms": None, "checks": 0, "failures": 0}
+
+    def ensure_started(self) -> None:
+        """Запускает поток проверки в текущем процессе (после fork - заново)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            if self._started_pid is not None:
+                # Унаследованные от родителя подключение и результат не относятся к этому процессу
+                self._lock = threading.Lock()
+                self._checked = threading.Event()
+                self._conn = None
+            self._started_pid = pid
+        threading.Thread(target=self._loop, name="readiness", daemon=True).start()
+
+    def _loop(self) -> None:
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self) -> bool:
+        """Проверяет схему и подключение к базе; результат читают status() и пробы."""
+        started = time.monotonic()
+        error = None
+        try:
+            self._ping()
+            if not self._prepared:
+                self._prepared = bool(self.prepare())
+                if not self._prepared:
+                    raise RuntimeError("Database schema is not up to date")
+        except Exception as e:
+            error = str(e).strip() or type(e).__name__
+            self._close()
+
+        with self._lock:
+            if error is not None and self._state["error"] != error:
+                logger.warning(f"Readiness check failed: {error}")
+            elif error is None and self._state["database"] == "disconnected":
+                logger.info("Readiness check recovered")
+            self._state.update({
+                "database": "connected" if error is None else "disconnected",
+                "error": error,
+                "checked_at": time.monotonic(),
+                "check_ms": round((time.monotonic() - started) * 1000, 3),
+                "checks": self._state["checks"] + 1,
+                "failures": self._state["failures"] + (error is not None),
+            })
+        self._checked.set()
+        return error is None
+
+    def _ping(self) -> None:
+        """SELECT 1 через постоянное подключение; разорванное (рестарт Postgres) открывается заново сразу."""
+        reused = self._conn is not None and not self._conn.closed
+        if not reused:
+            self._connect()
+        try:
+            self._select_one()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if not reused:
+                raise
+            self._close()
+            self._connect()
+            self._select_one()
+
+    def _connect(self) -> None:
+        config = {**self.db_config, "connect_timeout": self.timeout,
+                  "options": f"-c statement_timeout={self.timeout * 1000}",
+                  "application_name": "readiness"}
+        self._conn = psycopg2.connect(**config)
+        self._conn.autocommit = True
+
+    def _select_one(self) -> None:
+        with self._conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+
+    def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def status(self) -> tuple:
+        """
+        (готов ли процесс, состояние). Первая проба в процессе ждет первой проверки;
+        дальше - только чтение последнего результата.
+        """
+        self.ensure_started()
+        self._checked.wait(self.timeout * 2 + 1)
+        with self._lock:
+            state = dict(self._state)
+        checked_at = state.pop("checked_at")
+        if checked_at is None:
+            state["error"] = state["error"] or "Readiness check has not completed yet"
+            return False, state
+        state["checked_ago"] = round(time.monotonic() - checked_at, 3)
+        if state["checked_ago"] > self.interval * READINESS_STALE_INTERVALS + self.timeout * 2:
+            state["error"] = "Readiness check result is stale"
+            return False, state
+        return state["error"] is None, state
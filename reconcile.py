@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Сверка хранилища файлов с базой данных: файлы без записей ("сироты"), записи без
+файлов, незавершенные временные файлы и расхождение счетчика images_counter.
+
+Обе стороны читаются потоком в порядке байтов ключа - хранилище через os.scandir
+(или ListObjectsV2 для S3), база через серверный курсор с ORDER BY ... COLLATE "C" -
+и сравниваются слиянием отсортированных последовательностей. Память не зависит
+от числа файлов.
+
+Команды:
+    python reconcile.py                 # только отчет
+    python reconcile.py --repair        # отчет и исправление
+    python reconcile.py --schedule      # исправление раз в RECONCILE_INTERVAL секунд
+"""
+
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from content_store import delete_unreferenced, lock_blob
+from job_queue import UPLOAD_JOBS, delete_jobs, enqueue_jobs
+from list_cache import notify_changed
+from logger_config import get_logger
+from services import DB_CONFIG, get_db_connection, storage
+from storage import is_hidden_key
+from thumbnails import remove_derivatives
+from transcoding import VARIANT_FORMATS, Transcoder
+
+logger = get_logger()
+
+# Только для записей о вариантах: сверка ничего не перекодирует, пул процессов не нужен
+transcoder = Transcoder(None, storage, get_db_connection)
+
+# Настройки (переопределяются переменными окружения)
+# Файлы моложе этого возраста не считаются сиротами: загрузка может быть еще не закоммичена
+RECONCILE_GRACE = float(os.environ.get("RECONCILE_GRACE", "3600"))  # секунды
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", "86400"))  # секунды, для --schedule
+RECONCILE_FETCH_SIZE = int(os.environ.get("RECONCILE_FETCH_SIZE", "10000"))  # строк за раз с курсора
+RECONCILE_SAMPLE_SIZE = 20  # примеров ключей каждого вида в отчете
+
+VARIANT_EXTENSIONS = tuple(ext for _pil_format, ext, _mime in VARIANT_FORMATS.values())
+
+# Одновременно выполняется только одна сверка (блокировка на время транзакции сканирования)
+RECONCILE_LOCK_KEY = "reconcile"
+
+# Ожидаемые объекты хранилища: файлы записей images и сохраненные варианты.
+# COLLATE "C" - порядок байтов, как у ключей хранилища
+EXPECTED_KEYS_SQL = """
+    SELECT key, kind, filename, refs FROM (
+        SELECT filename AS key, 'image' AS kind, filename, COUNT(*) AS refs
+        FROM images GROUP BY filename
+        UNION ALL
+        SELECT key, 'variant', filename, 0 FROM image_variants WHERE key IS NOT NULL
+    ) expected
+    ORDER BY key COLLATE "C"
+"""
+
+
+class ReconcileReport:
+    """Счетчики расхождений и несколько примеров каждого вида."""
+
+    KINDS = ("orphan_files", "missing_files", "missing_variants", "stale_temp_files",
+             "recent_files")
+
+    def __init__(self):
+        self.counts = {kind: 0 for kind in self.KINDS}
+        self.bytes = {"orphan_files": 0, "stale_temp_files": 0}
+        self.samples = {kind: [] for kind in self.KINDS}
+        self.repaired = {"orphan_files": 0, "missing_files": 0, "missing_variants": 0,
+                         "stale_temp_files": 0, "rows_deleted": 0, "counter": 0,
+                         "orphans_kept": 0}
+        self.scanned = {"objects": 0, "expected": 0, "rows": 0}
+        self.counter = None  # {"stored", "actual"} по снимку сканирования
+        self.errors = 0
+
+    def add(self, kind: str, key: str, size: int = 0) -> None:
+        self.counts[kind] += 1
+        if kind in self.bytes:
+            self.bytes[kind] += size
+        if len(self.samples[kind]) < RECONCILE_SAMPLE_SIZE:
+            self.samples[kind].append(key)
+
+    def as_dict(self) -> dict:
+        return {"scanned": self.scanned, "counts": self.counts, "bytes": self.bytes,
+                "counter": self.counter, "repaired": self.repaired, "errors": self.errors,
+                "samples": {kind: keys for kind, keys in self.samples.items() if keys}}
+
+
+def merge_sorted(stored, expected):
+    """
+    Слияние двух последовательностей, отсортированных по ключу (первому элементу).
+    Выдает (объект хранилища или None, ожидаемый объект или None).
+    """
+    obj = next(stored, None)
+    exp = next(expected, None)
+    while obj is not None or exp is not None:
+        if exp is None or (obj is not None and obj[0] < exp[0]):
+            yield obj, None
+            obj = next(stored, None)
+        elif obj is None or exp[0] < obj[0]:
+            yield None, exp
+            exp = next(expected, None)
+        else:
+            yield obj, exp
+            obj = next(stored, None)
+            exp = next(expected, None)
+
+
+def _original_of(key: str):
+    """Исходный файл для ключа варианта (ab/cd/<sha256>.png.webp -> ...png) или None."""
+    base, ext = os.path.splitext(key)
+    return base if ext in VARIANT_EXTENSIONS and os.path.splitext(base)[1] else None
+
+
+def repair_orphan(key: str, grace: float) -> bool:
+    """
+    Удаляет файл без записей. Под блокировкой блоба (и его оригинала для варианта)
+    заново проверяет, что ссылок нет: загрузка или перекодирование могли успеть.
+    """
+    original = _original_of(key)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for locked in sorted({key, original} - {None}):
+                lock_blob(cursor, locked)
+            cursor.execute("""
+                SELECT EXISTS (SELECT 1 FROM images WHERE filename = %s)
+                    OR EXISTS (SELECT 1 FROM image_variants WHERE key = %s)
+            """, (key, key))
+            if cursor.fetchone()[0]:
+                return False
+            path = storage.local_path(key) if storage.name == "local" else None
+            if path is not None:
+                stat = os.stat(path)
+                # Жесткая ссылка со старым именем (migrate_content_store --keep-legacy-links)
+                if stat.st_nlink > 1 or time.time() - stat.st_mtime < grace:
+                    return False
+            removed = storage.delete(key)
+        finally:
+            conn.rollback()
+            cursor.close()
+    if removed and original is None:
+        remove_derivatives(key)
+    return removed
+
+
+def repair_missing_file(key: str) -> int:
+    """
+    Удаляет записи images, файла которых нет, вместе с их вариантами и задачами.
+    Возвращает число удаленных записей (0, если файл успел появиться).
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            lock_blob(cursor, key)
+            if storage.exists(key):
+                conn.rollback()
+                return 0
+            cursor.execute("DELETE FROM images WHERE filename = %s", (key,))
+            deleted = cursor.rowcount
+            variant_keys = transcoder.delete_variants(cursor, key)
+            delete_jobs(cursor, key)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    if variant_keys:
+        delete_unreferenced(get_db_connection, storage, key, variant_keys)
+    remove_derivatives(key)
+    return deleted
+
+
+def repair_missing_variant(key: str, filename: str) -> bool:
+    """Удаляет запись о пропавшем варианте и ставит перекодирование оригинала заново."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            lock_blob(cursor, filename)
+            if storage.exists(key):
+                conn.rollback()
+                return False
+            cursor.execute("DELETE FROM image_variants WHERE key = %s", (key,))
+            deleted = cursor.rowcount > 0
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM images WHERE filename = %s)", (filename,))
+            if deleted and cursor.fetchone()[0] and "transcode" in UPLOAD_JOBS \
+                    and transcoder.enabled:
+                enqueue_jobs(cursor, ["transcode"], [filename])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return deleted
+
+
+def repair_counter(delta: int) -> None:
+    """
+    Исправляет images_counter на расхождение, найденное в снимке сканирования.
+    Изменения после снимка триггеры уже учли, поэтому счетчик сдвигается, а не перезаписывается.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE images_counter SET total_count = total_count + %s", (delta,))
+            # Счетчик есть в ответах /images-list, а триггера уведомлений на нем нет
+            notify_changed(cursor, "RECONCILE")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def reconcile(repair: bool = False, grace: float = RECONCILE_GRACE) -> dict:
+    """Сверяет хранилище с базой. Возвращает отчет; с repair=True исправляет расхождения."""
+    report = ReconcileReport()
+    started = time.time()
+    now = time.time()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        # Ключи и счетчик читаются из одного снимка
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (RECONCILE_LOCK_KEY,))
+            if not cursor.fetchone()[0]:
+                logger.warning("Reconcile skipped: another reconciliation is running")
+                return {"skipped": True}
+            cursor.execute("SELECT total_count FROM images_counter")
+            row = cursor.fetchone()
+            stored_count = row[0] if row else None
+
+        # Серверный курсор: в памяти не больше itersize строк
+        expected_cursor = conn.cursor(name="reconcile_expected")
+        expected_cursor.itersize = RECONCILE_FETCH_SIZE
+        expected_cursor.execute(EXPECTED_KEYS_SQL)
+
+        for step, (obj, exp) in enumerate(merge_sorted(storage.iter_objects(), iter(expected_cursor)), 1):
+            if step % 1_000_000 == 0:
+                logger.info(f"Reconcile progress: {report.scanned}")
+            if exp is not None:
+                report.scanned["expected"] += 1
+                if exp[1] == "image":
+                    report.scanned["rows"] += exp[3]
+            if obj is not None:
+                report.scanned["objects"] += 1
+            if obj is not None and exp is not None:
+                continue
+            try:
+                if obj is not None:
+                    _check_orphan(report, obj, now, grace, repair)
+                elif exp[1] == "image":
+                    report.add("missing_files", exp[0])
+                    if repair:
+                        deleted = repair_missing_file(exp[0])
+                        report.repaired["missing_files"] += int(deleted > 0)
+                        report.repaired["rows_deleted"] += deleted
+                else:
+                    report.add("missing_variants", exp[0])
+                    if repair:
+                        repaired = repair_missing_variant(exp[0], exp[2])
+                        report.repaired["missing_variants"] += int(repaired)
+            except Exception as e:
+                report.errors += 1
+                logger.error(f"Reconcile could not handle {(obj or exp)[0]}: {e}")
+        expected_cursor.close()
+        conn.rollback()
+    finally:
+        conn.close()
+
+    if stored_count is not None:
+        report.counter = {"stored": stored_count, "actual": report.scanned["rows"]}
+        if repair and stored_count != report.scanned["rows"]:
+            repair_counter(report.scanned["rows"] - stored_count)
+            report.repaired["counter"] = report.scanned["rows"] - stored_count
+
+    result = report.as_dict()
+    result["duration_seconds"] = round(time.time() - started, 3)
+    logger.info(f"Reconcile finished{' with repair' if repair else ''}: "
+                f"{json.dumps({key: result[key] for key in ('counts', 'repaired', 'errors')})}")
+    return result
+
+
+def _check_orphan(report: ReconcileReport, obj: tuple, now: float, grace: float,
+                  repair: bool) -> None:
+    """Классифицирует объект хранилища без записи в базе."""
+    key, size, mtime = obj
+    if is_hidden_key(key):
+        # Временные файлы незавершенных загрузок и перекодирования
+        if now - mtime >= grace:
+            report.add("stale_temp_files", key, size)
+            if repair and storage.delete(key):
+                report.repaired["stale_temp_files"] += 1
+        return
+    if now - mtime < grace:
+        report.add("recent_files", key)
+        return
+    report.add("orphan_files", key, size)
+    if repair:
+        # Не удаляется, если ссылка появилась после снимка или это жесткая ссылка со старым именем
+        removed = repair_orphan(key, grace)
+        report.repaired["orphan_files" if removed else "orphans_kept"] += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repair", action="store_true", help="Исправить найденные расхождения")
+    parser.add_argument("--schedule", action="store_true",
+                        help="Повторять сверку с исправлением раз в RECONCILE_INTERVAL секунд")
+    parser.add_argument("--grace", type=float, default=RECONCILE_GRACE,
+                        help="Минимальный возраст файла-сироты в секундах")
+    args = parser.parse_args()
+
+    if args.schedule:
+        while True:
+            try:
+                reconcile(repair=True, grace=args.grace)
+            except Exception as e:
+                logger.error(f"Reconcile failed: {e}")
+            time.sleep(RECONCILE_INTERVAL)
+    else:
+        print(json.dumps(reconcile(repair=args.repair, grace=args.grace), indent=2))
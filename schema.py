@@ -0,0 +1,238 @@
+"""
+Версионированные миграции схемы базы данных. Примененные версии записываются в
+schema_migrations, поэтому на старте при актуальной схеме выполняется один запрос
+вместо всего DDL. Одновременно стартующие процессы (app, backfill, сверка)
+применяют миграции по очереди под advisory-блокировкой.
+"""
+
+import time
+
+import psycopg2
+from psycopg2 import errors
+
+from image_search import create_search_indexes
+from job_queue import JOBS_TABLE_SQL
+from logger_config import get_logger
+from near_duplicates import create_phash_indexes
+from services import DB_CONFIG, get_db_connection
+from transcoding import VARIANTS_TABLE_SQL
+
+logger = get_logger()
+
+# Ключ pg_advisory_lock, которым сериализуются миграции
+SCHEMA_LOCK_ID = 7_203_114_501
+
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        duration_ms INTEGER NOT NULL
+    )
+"""
+
+
+class Migration:
+    """Шаг схемы: версия, описание и функция без аргументов, выполняющая DDL."""
+
+    __slots__ = ("version", "description", "apply")
+
+    def __init__(self, version: int, description: str, apply):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+def _current_version(cursor) -> int:
+    try:
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    except errors.UndefinedTable:
+        return 0
+    return cursor.fetchone()[0]
+
+
+def migrate(db_config: dict, migrations: list) -> dict:
+    """
+    Применяет миграции новее записанной версии, каждую - отдельно: прерванная миграция
+    повторится при следующем запуске, поэтому DDL в них идемпотентный.
+    Возвращает {"version": текущая версия, "applied": [примененные версии]}.
+    """
+    latest = max(migration.version for migration in migrations)
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            current = _current_version(cursor)
+            if current >= latest:
+                return {"version": current, "applied": []}
+
+            cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+            try:
+                cursor.execute(MIGRATIONS_TABLE_SQL)
+                # Пока ждали блокировку, миграции мог применить другой процесс
+                current = _current_version(cursor)
+                applied = []
+                for migration in sorted(migrations, key=lambda item: item.version):
+                    if migration.version <= current:
+                        continue
+                    logger.info(f"Applying schema migration {migration.version}: "
+                                f"{migration.description}")
+                    started = time.monotonic()
+                    migration.apply()
+                    duration_ms = int((time.monotonic() - started) * 1000)
+                    cursor.execute("""
+                        INSERT INTO schema_migrations (version, description, duration_ms)
+                        VALUES (%s, %s, %s)
+                    """, (migration.version, migration.description, duration_ms))
+                    applied.append(migration.version)
+                    logger.info(f"Schema migration {migration.version} applied in {duration_ms} ms")
+                return {"version": max([current] + applied), "applied": applied}
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
+    finally:
+        conn.close()
+
+
+def _create_base_schema() -> None:
+    """Миграция 1: таблицы, счетчик и триггеры уведомлений (DDL, выполнявшийся раньше на каждом старте)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id SERIAL PRIMARY KEY,
+                filename TEXT NOT NULL UNIQUE,
+                original_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                file_type TEXT NOT NULL
+            )
+        """)
+
+        # Контентно-адресуемое хранилище: несколько записей могут ссылаться на один файл
+        cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash TEXT")
+        cursor.execute("ALTER TABLE images DROP CONSTRAINT IF EXISTS images_filename_key")
+        # Перцептивный хеш для поиска почти одинаковых изображений (near_duplicates.py)
+        cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS phash BIGINT")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_images_filename 
+            ON images(filename)
+        """)
+
+        # Составной индекс для сортировки и keyset-пагинации по (upload_time, id);
+        # заменяет прежний idx_upload_time
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_upload_time_id 
+            ON images(upload_time DESC, id DESC)
+        """)
+        cursor.execute("DROP INDEX IF EXISTS idx_upload_time")
+
+        # Счетчик изображений, поддерживаемый триггерами, вместо COUNT(*) на каждый запрос
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS images_counter (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                total_count BIGINT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO images_counter (total_count)
+            SELECT COUNT(*) FROM images
+            ON CONFLICT (id) DO NOTHING
+        """)
+        cursor.execute(IMAGES_COUNTER_TRIGGERS_SQL)
+        cursor.execute(IMAGES_NOTIFY_TRIGGER_SQL)
+
+        # Размеры вариантов в современных форматах (после триггера уведомлений - он общий)
+        cursor.execute(VARIANTS_TABLE_SQL)
+        cursor.execute(JOBS_TABLE_SQL)
+
+        conn.commit()
+        cursor.close()
+
+
+# Миграции схемы по возрастанию версии. Изменение схемы - новая миграция в конце списка;
+# уже примененные не меняются. DDL идемпотентный: базы, созданные до появления версий
+# (и init.sql), проходят все миграции без изменений
+SCHEMA_MIGRATIONS = [
+    Migration(1, "images, counter, variants and jobs tables", _create_base_schema),
+    # Индексы фильтров и поиска /images-list (строятся без блокировки записи)
+    Migration(2, "search indexes for /images-list", lambda: create_search_indexes(DB_CONFIG)),
+    Migration(3, "perceptual hash chunk indexes", lambda: create_phash_indexes(DB_CONFIG)),
+]
+
+# Версия схемы, проверенная этим процессом (после fork наследуется - повторная проверка не нужна)
+schema_state = {"version": None, "check_ms": None}
+
+
+def init_database() -> bool:
+    """
+    Приводит схему базы данных к последней версии (при актуальной схеме - один запрос).
+    Возвращает True, если схема актуальна; ошибка логируется, сервер продолжает работу.
+    """
+    if schema_state["version"] is not None:
+        return True
+    started = time.perf_counter()
+    try:
+        result = migrate(DB_CONFIG, SCHEMA_MIGRATIONS)
+    except Exception as e:
+        logger.error(f"Database initialization failed: {e}")
+        return False
+    schema_state.update(version=result["version"],
+                        check_ms=round((time.perf_counter() - started) * 1000, 3))
+    if result["applied"]:
+        logger.info(f"Database schema migrated to version {result['version']}")
+    else:
+        logger.info(f"Database schema is up to date (version {result['version']})")
+    return True
+
+
+# Триггеры уровня оператора: одно обновление счетчика на INSERT/DELETE, а не на строку
+IMAGES_COUNTER_TRIGGERS_SQL = """
+    CREATE OR REPLACE FUNCTION images_counter_insert() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images_counter SET total_count = total_count + (SELECT COUNT(*) FROM new_rows);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION images_counter_delete() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images_counter SET total_count = total_count - (SELECT COUNT(*) FROM old_rows);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION images_counter_truncate() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images_counter SET total_count = 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER trg_images_counter_insert
+        AFTER INSERT ON images REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION images_counter_insert();
+
+    CREATE OR REPLACE TRIGGER trg_images_counter_delete
+        AFTER DELETE ON images REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION images_counter_delete();
+
+    CREATE OR REPLACE TRIGGER trg_images_counter_truncate
+        AFTER TRUNCATE ON images
+        FOR EACH STATEMENT EXECUTE FUNCTION images_counter_truncate();
+"""
+
+
+# Уведомление других процессов об изменении таблицы images (для сброса кеша списка)
+IMAGES_NOTIFY_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION images_notify_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('images_changed', TG_OP);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER trg_images_notify_change
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON images
+        FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
+"""
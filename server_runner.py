@@ -0,0 +1,202 @@
+"""
+Режимы запуска HTTP сервера: однопоточный, пул потоков, pre-fork и asyncio.
+"""
+
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+from logger_config import flush_logs, get_logger
+
+logger = get_logger()
+
+# Настройки конкурентности (переопределяются переменными окружения)
+SERVER_MODE = os.environ.get("SERVER_MODE", "threaded")  # single | threaded | prefork | async
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "16"))
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", str(os.cpu_count() or 1)))
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "64"))
+IN_FLIGHT_WAIT = float(os.environ.get("IN_FLIGHT_WAIT", "0.5"))  # секунды
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "30"))  # секунды
+KEEPALIVE_TIMEOUT = float(os.environ.get("KEEPALIVE_TIMEOUT", "15"))  # секунды
+
+# Ответ, отправляемый при превышении лимита одновременных запросов
+_OVERLOADED_BODY = b'{"status": "error", "message": "Server is overloaded, retry later"}'
+OVERLOADED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: " + str(len(_OVERLOADED_BODY)).encode() + b"\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n" + _OVERLOADED_BODY
+)
+
+
+class BoundedThreadPoolServer(HTTPServer):
+    """HTTP сервер, обрабатывающий соединения в ограниченном пуле потоков."""
+
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, bind_and_activate: bool = True,
+                 threads: int = SERVER_THREADS, max_in_flight: int = MAX_IN_FLIGHT):
+        # До super().__init__: при ошибке bind он вызывает server_close(), которому нужен пул
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight = 0
+        self._in_flight_cond = threading.Condition()
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    @property
+    def in_flight(self) -> int:
+        """Количество соединений, обрабатываемых в данный момент."""
+        return self._in_flight
+
+    def process_request(self, request, client_address) -> None:
+        """Передает соединение в пул потоков, соблюдая лимит in-flight."""
+        if not self._slots.acquire(timeout=IN_FLIGHT_WAIT):
+            logger.warning(f"Too many requests in flight, rejecting {client_address[0]}")
+            self._reject_overloaded(request)
+            return
+
+        with self._in_flight_cond:
+            self._in_flight += 1
+        try:
+            self._executor.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # Пул уже остановлен - сервер завершает работу
+            self._release_slot()
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address) -> None:
+        """Обрабатывает соединение в потоке пула."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._release_slot()
+
+    def _release_slot(self) -> None:
+        """Освобождает слот in-flight и будит ожидающих завершения."""
+        self._slots.release()
+        with self._in_flight_cond:
+            self._in_flight -= 1
+            self._in_flight_cond.notify_all()
+
+    def _reject_overloaded(self, request) -> None:
+        """Быстро отвечает 503 без передачи соединения обработчику."""
+        try:
+            request.sendall(OVERLOADED_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout: float = SHUTDOWN_TIMEOUT) -> bool:
+        """Ожидает завершения обрабатываемых запросов. Возвращает True, если все завершились."""
+        with self._in_flight_cond:
+            drained = self._in_flight_cond.wait_for(lambda: self._in_flight == 0, timeout)
+        self._executor.shutdown(wait=drained, cancel_futures=True)
+        return drained
+
+    def server_close(self) -> None:
+        """Закрывает слушающий сокет и дожидается текущих запросов."""
+        super().server_close()
+        if not self.drain():
+            logger.warning(f"Shutdown timeout: {self._in_flight} requests still in flight")
+
+
+def _install_shutdown_handlers(httpd: HTTPServer) -> None:
+    """Останавливает serve_forever по SIGTERM/SIGINT."""
+    def handle_signal(signum, frame):
+        logger.info(f"Received signal {signum}, draining connections...")
+        # shutdown() блокируется до выхода из serve_forever, поэтому вызываем из другого потока
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+
+def _serve(httpd: HTTPServer) -> None:
+    """Запускает цикл обработки запросов и корректно закрывает сервер."""
+    _install_shutdown_handlers(httpd)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        logger.info(f"Server process {os.getpid()} stopped")
+
+
+def _prefork(server_address: tuple, handler_class, processes: int) -> None:
+    """Создает слушающий сокет и разделяет его между дочерними процессами."""
+    listener = BoundedThreadPoolServer(server_address, handler_class)
+    children = []
+
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            # Дочерний процесс: копия пула потоков из __init__ (потоки запускаются при первых
+            # запросах) поверх общего сокета. os._exit не вызывает atexit - очередь логов
+            # дописывается явно
+            try:
+                _serve(listener)
+            finally:
+                flush_logs()
+                os._exit(0)
+        children.append(pid)
+
+    logger.info(f"Started {processes} worker processes: {children}")
+
+    def forward_signal(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+
+    # Родитель не принимает соединения, только ждет завершения воркеров
+    for child in children:
+        while True:
+            try:
+                os.waitpid(child, 0)
+                break
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+    listener.socket.close()
+
+
+def run_server(server_address: tuple, handler_class, mode: str = SERVER_MODE) -> None:
+    """Запускает сервер в выбранном режиме конкурентности."""
+    handler_class.timeout = KEEPALIVE_TIMEOUT
+
+    if mode == "single":
+        httpd = HTTPServer(server_address, handler_class)
+        logger.info("Server mode: single-threaded")
+        _serve(httpd)
+    elif mode == "threaded":
+        httpd = BoundedThreadPoolServer(server_address, handler_class)
+        logger.info(f"Server mode: thread pool ({SERVER_THREADS} threads, "
+                    f"max in flight {MAX_IN_FLIGHT})")
+        _serve(httpd)
+    elif mode == "prefork":
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Prefork mode requires os.fork()")
+        logger.info(f"Server mode: prefork ({SERVER_PROCESSES} processes x "
+                    f"{SERVER_THREADS} threads, max in flight {MAX_IN_FLIGHT} per process)")
+        _prefork(server_address, handler_class, SERVER_PROCESSES)
+    elif mode == "async":
+        # Импорт здесь: async_server сам использует настройки этого модуля
+        from async_server import run_async_server
+        logger.info(f"Server mode: asyncio ({SERVER_THREADS} handler threads, "
+                    f"max in flight {MAX_IN_FLIGHT})")
+        run_async_server(server_address, handler_class)
+    else:
+        raise ValueError(f"Unknown server mode: {mode}")
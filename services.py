@@ -0,0 +1,34 @@
+"""
+Общие для сервера и служебных скриптов (worker.py, reconcile.py, backup_script.py,
+backfill_phash.py, migrate_content_store.py) настройки базы данных, пул подключений
+и хранилище оригиналов. Скрипты импортируют этот модуль, а не app.py: им не нужны
+пул процессов, кеши, подписка LISTEN и проверка готовности HTTP сервера.
+"""
+
+import os
+
+from db_pool import ConnectionPool
+from storage import create_storage
+
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/app/image")  # корень локального хранилища
+
+# Настройки базы данных (переопределяются переменными окружения)
+DB_CONFIG = {
+    "dbname": os.environ.get("DB_NAME", "images_db"),
+    "user": os.environ.get("DB_USER", "postgres"),
+    "password": os.environ.get("DB_PASSWORD", "password"),
+    "host": os.environ.get("DB_HOST", "db"),
+    "port": os.environ.get("DB_PORT", "5432"),
+    "connect_timeout": 5
+}
+
+# Пул подключений к базе данных, общий для всех потоков процесса
+db_pool = ConnectionPool(DB_CONFIG)
+
+# Хранилище оригиналов: локальный каталог или S3-совместимое (STORAGE_BACKEND)
+storage = create_storage(UPLOAD_DIR)
+
+
+def get_db_connection():
+    """Выдает подключение из пула (контекстный менеджер, возвращает подключение в пул)."""
+    return db_pool.connection()
@@ -535,6 +535,7 @@ class ImageHostingApp {
             <tr>
                 <td>
                     <a href="/images/${image.filename}" class="image-link" target="_blank">
+                        ${image.thumbnail_url ? `<img src="${image.thumbnail_url}" class="image-thumb" alt="" loading="lazy" width="64" height="64">` : ''}
                         ${image.filename}
                     </a>
                 </td>
@@ -0,0 +1,651 @@
+"""
+Хранилище файлов изображений: локальный каталог или S3-совместимое объектное
+хранилище (AWS S3, MinIO) с локальным кешем горячих файлов перед ним.
+Ключ файла - путь блоба вида ab/cd/<sha256>.<ext> (см. content_store).
+"""
+
+import datetime
+import hashlib
+import hmac
+import http.client
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from urllib.parse import quote, urlparse
+
+from content_store import HASH_CHUNK_SIZE, hash_file, place_blob, remove_blob
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки хранилища (переопределяются переменными окружения)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")  # local | s3
+# Как отдаются оригиналы: direct - приложением (sendfile), redirect - 302 на подписанный URL S3,
+# accel - заголовком X-Accel-Redirect, байты отдает nginx
+STORAGE_SERVE = os.environ.get("STORAGE_SERVE", "direct")
+STORAGE_ACCEL_PREFIX = os.environ.get("STORAGE_ACCEL_PREFIX", "/_storage/")
+STORAGE_SPOOL_DIR = os.environ.get("STORAGE_SPOOL_DIR", "/app/cache/uploads")
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", "/app/cache/storage")
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+S3_ENDPOINT = os.environ.get("S3_ENDPOINT", "http://minio:9000")
+# Адрес S3, доступный клиентам (для redirect), если он отличается от внутреннего
+S3_PUBLIC_ENDPOINT = os.environ.get("S3_PUBLIC_ENDPOINT", S3_ENDPOINT)
+S3_BUCKET = os.environ.get("S3_BUCKET", "images")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY", "minioadmin")
+S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY", "minioadmin")
+S3_PRESIGN_EXPIRES = int(os.environ.get("S3_PRESIGN_EXPIRES", "3600"))  # секунды
+S3_MULTIPART_THRESHOLD = int(os.environ.get("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))))
+S3_TIMEOUT = float(os.environ.get("S3_TIMEOUT", "30"))
+S3_ACCEL_PREFIX = os.environ.get("S3_ACCEL_PREFIX", "/_s3")
+
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+
+class StorageError(Exception):
+    """Ошибка хранилища файлов."""
+
+
+class ObjectNotFoundError(StorageError):
+    """Объекта с таким ключом нет."""
+
+
+def is_safe_key(key: str) -> bool:
+    """Ключ - нормализованный относительный путь без выхода за корень хранилища."""
+    return (bool(key) and "\\" not in key and "\x00" not in key
+            and not key.startswith(("/", "../")) and key != ".."
+            and posixpath.normpath(key) == key)
+
+
+def is_hidden_key(key: str) -> bool:
+    """Скрытые файлы (незавершенные загрузки и временные файлы) не отдаются."""
+    return any(part.startswith(".") for part in key.split("/"))
+
+
+def _scan_sorted(root: str, prefix: str = ""):
+    """
+    Обходит каталог через os.scandir, выдавая (ключ, размер, mtime) в порядке байтов ключа.
+    В памяти - только записи текущего каталога и стек подкаталогов.
+    """
+    try:
+        with os.scandir(os.path.join(root, prefix)) as it:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False), entry) for entry in it]
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    # Каталог сравнивается как "имя/": тогда порядок обхода совпадает с порядком полных ключей
+    entries.sort(key=lambda item: item[0] + "/" if item[1] else item[0])
+    for name, is_dir, entry in entries:
+        key = prefix + name
+        if is_dir:
+            yield from _scan_sorted(root, key + "/")
+        elif entry.is_file(follow_symlinks=False):
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            yield key, stat.st_size, stat.st_mtime
+
+
+class ReadThroughCache:
+    """
+    Локальный дисковый кеш объектов удаленного хранилища с вытеснением LRU
+    по суммарному размеру. Одновременные промахи по одному ключу объединяются.
+    """
+
+    def __init__(self, cache_dir: str = STORAGE_CACHE_DIR, max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> размер, от самых старых к самым свежим
+        self._total_bytes = 0
+        self._pending = {}  # ключ -> Event для объединения одинаковых запросов
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "fetched_bytes": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """Восстанавливает индекс кеша с диска, упорядочивая файлы по времени доступа."""
+        found = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_atime, os.path.relpath(path, self.cache_dir), stat.st_size))
+        for _atime, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _add(self, key: str, size: int) -> None:
+        """Учитывает файл в индексе. Вызывать под блокировкой."""
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+
+    def get(self, key: str, fetch) -> str:
+        """
+        Возвращает путь к локальной копии объекта. При промахе вызывает fetch(путь_временного_файла),
+        который должен записать содержимое объекта.
+        """
+        path = self.path(key)
+        while True:
+            with self._lock:
+                if os.path.exists(path):
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    else:
+                        # Файл скачан другим процессом - учитываем его в своем индексе
+                        self._add(key, os.path.getsize(path))
+                    self._stats["hits"] += 1
+                    return path
+                event = self._pending.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._pending[key] = event
+                    self._stats["misses"] += 1
+                    break
+                self._stats["coalesced"] += 1
+            event.wait()
+            # Загрузка могла завершиться ошибкой - тогда повторяем попытку сами
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".fetch-")
+            os.close(fd)
+            try:
+                fetch(temp_path)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+            size = os.path.getsize(path)
+            with self._lock:
+                self._stats["fetched_bytes"] += size
+                self._add(key, size)
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            event.set()
+
+    def adopt(self, key: str, source_path: str) -> None:
+        """Переносит только что загруженный файл в кеш: первый просмотр не пойдет в хранилище."""
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(source_path, 0o644)
+            os.replace(source_path, path)
+        except OSError as e:
+            # Например, кеш на другом разделе - файл просто скачается при первом запросе
+            logger.warning(f"Could not place {key} into storage cache: {e}")
+            return
+        with self._lock:
+            self._add(key, os.path.getsize(path))
+
+    def discard(self, key: str) -> None:
+        """Удаляет локальную копию объекта."""
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        """Удаляет самые давно использованные файлы, пока кеш больше лимита. Вызывать под блокировкой."""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """Статистика кеша для мониторинга."""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            })
+        return data
+
+
+class S3Client:
+    """Минимальный клиент S3 API с подписью AWS Signature V4 (path-style адреса, как у MinIO)."""
+
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, region: str = S3_REGION,
+                 timeout: float = S3_TIMEOUT):
+        url = urlparse(endpoint)
+        self.secure = url.scheme == "https"
+        self.host = url.netloc
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+        self._local = threading.local()  # keep-alive соединение на поток
+
+    # --- Подпись ---
+
+    def _signing_key(self, date: str) -> bytes:
+        key = ("AWS4" + self.secret_key).encode("utf-8")
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        return key
+
+    def sign(self, method: str, host: str, path: str, query: dict, headers: dict,
+             payload_hash: str, now: datetime.datetime) -> str:
+        """Подпись запроса по AWS Signature V4. headers - подписываемые заголовки (с host)."""
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+        canonical_query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+            for name, value in sorted(query.items())
+        )
+        names = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+        canonical_headers = "".join(f"{name}:{lowered[name]}\n" for name in names)
+        canonical_request = "\n".join([
+            method, quote(path, safe="/-_.~"), canonical_query, canonical_headers,
+            ";".join(names), payload_hash
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+        ])
+        return hmac.new(self._signing_key(now.strftime("%Y%m%d")), string_to_sign.encode("utf-8"),
+                        hashlib.sha256).hexdigest()
+
+    def presign(self, method: str, path: str, expires: int, endpoint: str = None,
+                now: datetime.datetime = None) -> str:
+        """Подписанный URL (подпись в query string), по которому объект доступен без ключей."""
+        url = urlparse(endpoint) if endpoint else None
+        host = url.netloc if url else self.host
+        scheme = url.scheme if url else ("https" if self.secure else "http")
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+        signature = self.sign(method, host, path, query, {"host": host}, UNSIGNED_PAYLOAD, now)
+        query_string = "&".join(f"{name}={quote(value, safe='-_.~')}"
+                                for name, value in sorted(query.items()))
+        return f"{scheme}://{host}{quote(path, safe='/-_.~')}?{query_string}&X-Amz-Signature={signature}"
+
+    # --- Запросы ---
+
+    def _connection(self, fresh: bool = False) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and (fresh or self._local.pid != os.getpid()):
+            if self._local.pid == os.getpid():
+                conn.close()
+            conn = None
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            conn = cls(self.host, timeout=self.timeout)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def request(self, method: str, path: str, query: dict = None, body=None,
+                payload_hash: str = EMPTY_PAYLOAD_HASH, headers: dict = None,
+                stream_to=None) -> tuple:
+        """
+        Выполняет подписанный запрос. Возвращает (статус, заголовки, тело);
+        если задан stream_to, тело ответа 2xx пишется в этот файл.
+        """
+        query = query or {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        signed = {"host": self.host, "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+                  "x-amz-content-sha256": payload_hash}
+        signature = self.sign(method, self.host, path, query, signed, payload_hash, now)
+        all_headers = dict(headers or {})
+        all_headers.update(signed)
+        all_headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{now.strftime('%Y%m%d')}/"
+            f"{self.region}/s3/aws4_request, SignedHeaders=host;x-amz-content-sha256;x-amz-date, "
+            f"Signature={signature}"
+        )
+        url = quote(path, safe="/-_.~")
+        if query:
+            url += "?" + "&".join(f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+                                  if value != "" else quote(name, safe='-_.~')
+                                  for name, value in sorted(query.items()))
+
+        for attempt in (1, 2):
+            conn = self._connection(fresh=attempt == 2)
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                conn.request(method, url, body=body, headers=all_headers)
+                response = conn.getresponse()
+                if stream_to is not None and 200 <= response.status < 300:
+                    shutil.copyfileobj(response, stream_to, HASH_CHUNK_SIZE)
+                    data = b""
+                else:
+                    data = response.read()
+                return response.status, dict(response.getheaders()), data
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Сервер закрыл простаивавшее keep-alive соединение - повторяем по новому
+                conn.close()
+                if attempt == 2 or (body is not None and not hasattr(body, "seek")):
+                    raise StorageError(f"S3 {method} {path}: connection lost")
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._local.conn = None
+                raise StorageError(f"S3 {method} {path}: {e}")
+
+    @staticmethod
+    def check(status: int, data: bytes, method: str, path: str) -> None:
+        if status == 404:
+            raise ObjectNotFoundError(f"S3 object not found: {path}")
+        if not 200 <= status < 300:
+            raise StorageError(f"S3 {method} {path} failed with {status}: {data[:300]!r}")
+
+    @staticmethod
+    def xml_text(data: bytes, tag: str) -> str:
+        for element in ET.fromstring(data).iter():
+            if element.tag.rsplit("}", 1)[-1] == tag:
+                return element.text
+        raise StorageError(f"S3 response has no <{tag}>")
+
+
+class LocalStorage:
+    """Файлы в каталоге на локальном диске (или общем томе)."""
+
+    name = "local"
+
+    def __init__(self, root: str, serve: str = STORAGE_SERVE, accel_prefix: str = STORAGE_ACCEL_PREFIX):
+        self.root = root
+        self.serve = serve
+        self.accel_prefix = accel_prefix
+        # Временные файлы на том же разделе - на место они переносятся через rename
+        self.spool_dir = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put(self, temp_path: str, key: str, content_type: str = None, sha256: str = None) -> bool:
+        """Переносит временный файл в хранилище. Возвращает True, если объект был создан."""
+        return place_blob(temp_path, self._path(key))
+
+    def delete(self, key: str) -> bool:
+        """Удаляет объект. Возвращает True, если он был."""
+        return remove_blob(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def local_path(self, key: str) -> str:
+        """Путь к файлу объекта на локальном диске или None, если объекта нет."""
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def cache_path(self, key: str) -> str:
+        """Путь, под которым local_path отдает объект (без проверки наличия) - ключ кешей файлов."""
+        return self._path(key)
+
+    def iter_objects(self):
+        """Все объекты (ключ, размер, mtime) в порядке байтов ключа, включая скрытые."""
+        return _scan_sorted(self.root)
+
+    def fetch(self, key: str, dest_path: str) -> None:
+        """Копирует объект в файл dest_path."""
+        try:
+            shutil.copyfile(self._path(key), dest_path)
+        except FileNotFoundError:
+            raise ObjectNotFoundError(f"Object not found: {key}")
+
+    def read_into(self, key: str, f) -> None:
+        """Пишет содержимое объекта в открытый файл f (потоково)."""
+        try:
+            with open(self._path(key), "rb") as src:
+                shutil.copyfileobj(src, f, HASH_CHUNK_SIZE)
+        except FileNotFoundError:
+            raise ObjectNotFoundError(f"Object not found: {key}")
+
+    def serve_location(self, key: str):
+        """Куда перенаправить отдачу оригинала: ("accel", uri) или None - отдать самому."""
+        if self.serve == "accel" and self.exists(key):
+            return "accel", self.accel_prefix + quote(key)
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "serve": self.serve}
+
+
+class S3Storage:
+    """
+    Объекты в бакете S3-совместимого хранилища. Чтение идет через локальный
+    кеш LRU, загрузка крупных файлов - через multipart upload.
+    """
+
+    name = "s3"
+
+    def __init__(self, client: S3Client, bucket: str = S3_BUCKET, cache: ReadThroughCache = None,
+                 spool_dir: str = STORAGE_SPOOL_DIR, serve: str = STORAGE_SERVE,
+                 public_endpoint: str = S3_PUBLIC_ENDPOINT, presign_expires: int = S3_PRESIGN_EXPIRES,
+                 multipart_threshold: int = S3_MULTIPART_THRESHOLD, part_size: int = S3_PART_SIZE,
+                 accel_prefix: str = S3_ACCEL_PREFIX):
+        self.client = client
+        self.bucket = bucket
+        self.cache = cache or ReadThroughCache()
+        self.spool_dir = spool_dir
+        self.serve = serve
+        self.public_endpoint = public_endpoint
+        self.presign_expires = presign_expires
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.accel_prefix = accel_prefix
+        self._lock = threading.Lock()
+        self._stats = {"uploads": 0, "multipart_uploads": 0, "uploaded_bytes": 0, "deletes": 0,
+                       "redirects": 0}
+        os.makedirs(spool_dir, exist_ok=True)
+        self._bucket_checked = False
+
+    def _object_path(self, key: str) -> str:
+        return f"/{self.bucket}/{key}"
+
+    def _ensure_bucket(self) -> None:
+        """Создает бакет при первой записи, если его нет (удобно для локального MinIO)."""
+        if self._bucket_checked:
+            return
+        status, _headers, _data = self.client.request("HEAD", f"/{self.bucket}")
+        if status == 404:
+            status, _headers, data = self.client.request("PUT", f"/{self.bucket}")
+            if status not in (200, 409):
+                raise StorageError(f"Could not create bucket {self.bucket}: {status} {data[:300]!r}")
+            logger.info(f"Created storage bucket {self.bucket}")
+        self._bucket_checked = True
+
+    def exists(self, key: str) -> bool:
+        status, _headers, data = self.client.request("HEAD", self._object_path(key))
+        if status == 404:
+            return False
+        self.client.check(status, data, "HEAD", key)
+        return True
+
+    def _upload_single(self, path: str, key: str, headers: dict, sha256: str) -> None:
+        with open(path, "rb") as f:
+            status, _headers, data = self.client.request(
+                "PUT", self._object_path(key), body=f, payload_hash=sha256 or hash_file(path),
+                headers=dict(headers, **{"Content-Length": str(os.fstat(f.fileno()).st_size)})
+            )
+        self.client.check(status, data, "PUT", key)
+
+    def _upload_multipart(self, path: str, key: str, headers: dict) -> None:
+        """Загрузка частями по part_size: в памяти одновременно не больше одной части."""
+        object_path = self._object_path(key)
+        status, _headers, data = self.client.request("POST", object_path, query={"uploads": ""},
+                                                     headers=headers)
+        self.client.check(status, data, "POST", key)
+        upload_id = self.client.xml_text(data, "UploadId")
+        try:
+            parts = []
+            with open(path, "rb") as f:
+                for number in range(1, 10001):
+                    chunk = f.read(self.part_size)
+                    if not chunk:
+                        break
+                    status, response_headers, data = self.client.request(
+                        "PUT", object_path, query={"partNumber": number, "uploadId": upload_id},
+                        body=chunk, payload_hash=hashlib.sha256(chunk).hexdigest(),
+                        headers={"Content-Length": str(len(chunk))}
+                    )
+                    self.client.check(status, data, "PUT part", key)
+                    etag = {name.lower(): value for name, value in response_headers.items()}["etag"]
+                    parts.append(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>")
+            body = f"<CompleteMultipartUpload>{''.join(parts)}</CompleteMultipartUpload>".encode()
+            status, _headers, data = self.client.request(
+                "POST", object_path, query={"uploadId": upload_id}, body=body,
+                payload_hash=hashlib.sha256(body).hexdigest(),
+                headers={"Content-Length": str(len(body)), "Content-Type": "application/xml"}
+            )
+            self.client.check(status, data, "POST complete", key)
+            # Ошибка завершения может прийти с кодом 200 в теле ответа
+            if b"<Error>" in data:
+                raise StorageError(f"S3 multipart upload of {key} failed: {data[:300]!r}")
+        except BaseException:
+            self.client.request("DELETE", object_path, query={"uploadId": upload_id})
+            raise
+
+    def put(self, temp_path: str, key: str, content_type: str = None, sha256: str = None) -> bool:
+        """
+        Загружает временный файл в бакет (если объекта еще нет) и переносит его в локальный кеш.
+        Возвращает True, если объект был создан.
+        """
+        self._ensure_bucket()
+        if self.exists(key):
+            os.remove(temp_path)
+            return False
+        size = os.path.getsize(temp_path)
+        headers = {"Content-Type": content_type} if content_type else {}
+        if size > self.multipart_threshold:
+            self._upload_multipart(temp_path, key, headers)
+        else:
+            self._upload_single(temp_path, key, headers, sha256)
+        with self._lock:
+            self._stats["uploads"] += 1
+            self._stats["multipart_uploads"] += int(size > self.multipart_threshold)
+            self._stats["uploaded_bytes"] += size
+        self.cache.adopt(key, temp_path)
+        return True
+
+    def delete(self, key: str) -> bool:
+        """Удаляет объект из бакета и кеша. Возвращает True, если он был."""
+        existed = self.exists(key)
+        if existed:
+            status, _headers, data = self.client.request("DELETE", self._object_path(key))
+            self.client.check(status, data, "DELETE", key)
+            with self._lock:
+                self._stats["deletes"] += 1
+        self.cache.discard(key)
+        return existed
+
+    def iter_objects(self):
+        """Все объекты бакета (ключ, размер, mtime) страницами ListObjectsV2 - в порядке байтов ключа."""
+        query = {"list-type": "2", "max-keys": "1000"}
+        while True:
+            status, _headers, data = self.client.request("GET", f"/{self.bucket}", query=query)
+            if status == 404:
+                return
+            self.client.check(status, data, "GET list", self.bucket)
+            token = None
+            for element in ET.fromstring(data):
+                tag = element.tag.rsplit("}", 1)[-1]
+                if tag == "Contents":
+                    fields = {child.tag.rsplit("}", 1)[-1]: child.text for child in element}
+                    modified = datetime.datetime.fromisoformat(
+                        fields["LastModified"].replace("Z", "+00:00"))
+                    yield fields["Key"], int(fields["Size"]), modified.timestamp()
+                elif tag == "NextContinuationToken":
+                    token = element.text
+            if not token:
+                return
+            query = dict(query, **{"continuation-token": token})
+
+    def fetch(self, key: str, dest_path: str) -> None:
+        """Скачивает объект в файл dest_path."""
+        with open(dest_path, "wb") as f:
+            self.read_into(key, f)
+
+    def read_into(self, key: str, f) -> None:
+        """Пишет содержимое объекта в открытый файл f (потоково)."""
+        status, _headers, data = self.client.request("GET", self._object_path(key), stream_to=f)
+        self.client.check(status, data, "GET", key)
+
+    def local_path(self, key: str) -> str:
+        """Путь к локальной копии объекта (через кеш) или None, если объекта нет."""
+        try:
+            return self.cache.get(key, lambda temp_path: self.fetch(key, temp_path))
+        except ObjectNotFoundError:
+            return None
+
+    def cache_path(self, key: str) -> str:
+        """Путь, под которым local_path отдает объект (без скачивания) - ключ кешей файлов."""
+        return self.cache.path(key)
+
+    def serve_location(self, key: str):
+        """
+        Куда перенаправить отдачу оригинала: ("redirect", подписанный URL),
+        ("accel", внутренний URI nginx, проксирующий подписанный запрос к S3) или None.
+        Для отсутствующего объекта - None: ответ 404 дает сам сервер, а не подписанный URL.
+        """
+        if self.serve not in ("redirect", "accel"):
+            return None
+        # Локальная копия в кеше подтверждает наличие без запроса; иначе - HEAD
+        if not os.path.exists(self.cache.path(key)) and not self.exists(key):
+            return None
+        if self.serve == "redirect":
+            with self._lock:
+                self._stats["redirects"] += 1
+            return "redirect", self.client.presign("GET", self._object_path(key),
+                                                   self.presign_expires, self.public_endpoint)
+        url = urlparse(self.client.presign("GET", self._object_path(key), self.presign_expires))
+        return "accel", f"{self.accel_prefix}{url.path}?{url.query}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data.update({"backend": self.name, "serve": self.serve, "bucket": self.bucket,
+                     "cache": self.cache.stats()})
+        return data
+
+
+def create_storage(local_root: str):
+    """Создает хранилище по STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(local_root)
+    if STORAGE_BACKEND == "s3":
+        client = S3Client(S3_ENDPOINT, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION)
+        return S3Storage(client)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
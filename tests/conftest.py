@@ -0,0 +1,13 @@
+"""
+Модули проекта лежат в корне репозитория без пакета - добавляем корень в sys.path.
+Тесты проверяют чистую логику и не требуют PostgreSQL.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Лог модулей, вызывающих get_logger() при импорте, - во временный каталог, а не в рабочий
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(prefix="image-hosting-tests-"), "server.log"))
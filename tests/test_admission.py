@@ -0,0 +1,80 @@
+import pytest
+
+import admission
+from admission import RateLimiter, UploadSlots, _parse_networks, client_ip, retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_parse_networks():
+    networks = _parse_networks(" 10.0.0.1/8, ,::1/128")
+    assert [str(network) for network in networks] == ["10.0.0.0/8", "::1/128"]
+
+
+def test_client_ip_trusts_only_proxies():
+    assert client_ip("127.0.0.1", "203.0.113.5") == "203.0.113.5"
+    assert client_ip("172.20.0.3", " 2001:db8::1 ") == "2001:db8::1"
+    # Заголовок от непроверенного адреса игнорируется
+    assert client_ip("198.51.100.7", "203.0.113.5") == "198.51.100.7"
+    assert client_ip("127.0.0.1", "not-an-ip") == "127.0.0.1"
+    assert client_ip("127.0.0.1") == "127.0.0.1"
+    assert client_ip("unix-socket", "203.0.113.5") == "unix-socket"
+
+
+def test_rate_limiter_burst_and_refill(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    assert limiter.acquire("b") == 0.0  # у другого клиента свой запас
+    clock.now += 0.5
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("a") > 0
+    # Запас не копится сверх burst
+    clock.now += 100
+    assert [limiter.acquire("a") for _ in range(4)].count(0.0) == 3
+    assert limiter.stats()["limited"] == 3
+
+
+def test_rate_limiter_forgets_old_clients(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        limiter.acquire(client)
+    assert limiter.stats()["clients"] == 2
+    assert limiter.acquire("a") == 0.0  # вытесненный клиент снова с полным запасом
+    assert limiter.acquire("c") > 0
+
+
+def test_disabled_rate_limiter():
+    limiter = RateLimiter(rate=0)
+    assert not limiter.enabled
+    assert all(limiter.acquire("a") == 0.0 for _ in range(100))
+
+
+def test_upload_slots():
+    slots = UploadSlots(limit=2)
+    assert slots.try_acquire() and slots.try_acquire()
+    assert not slots.try_acquire()
+    assert slots.stats() == {"limit": 2, "active": 2, "rejected": 1}
+    slots.release()
+    assert slots.try_acquire()
+    unlimited = UploadSlots(limit=0)
+    assert all(unlimited.try_acquire() for _ in range(100))
+
+
+def test_retry_after():
+    assert retry_after(0) == "1"
+    assert retry_after(0.2) == "1"
+    assert retry_after(2.01) == "3"
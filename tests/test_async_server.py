@@ -0,0 +1,92 @@
+import asyncio
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from async_server import MAX_REQUEST_HEAD_SIZE, AsyncHTTPServer
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._reply(self.path.encode())
+
+    def do_POST(self):
+        self._reply(self.rfile.read(int(self.headers["Content-Length"])))
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """Сервер в цикле событий отдельного потока (serve() ставит обработчики сигналов - только в главном)."""
+    loop = asyncio.new_event_loop()
+    server = AsyncHTTPServer(("127.0.0.1", 0), EchoHandler, threads=2, keepalive_timeout=5)
+
+    async def start():
+        server._slots = asyncio.Semaphore(server.max_in_flight)
+        return await asyncio.start_server(server._handle_connection, "127.0.0.1", 0,
+                                          limit=MAX_REQUEST_HEAD_SIZE)
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    listener = asyncio.run_coroutine_threadsafe(start(), loop).result(5)
+    server.port = listener.sockets[0].getsockname()[1]
+    yield server
+    loop.call_soon_threadsafe(listener.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    server._executor.shutdown(wait=False)
+
+
+def read_response(sock_file):
+    status = sock_file.readline()
+    length = 0
+    while True:
+        line = sock_file.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, sock_file.read(length)
+
+
+def test_keep_alive_requests_on_one_connection(server):
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+        # Два запроса одним пакетом: второй должен остаться в буфере для следующей итерации
+        sock.sendall(b"GET /first HTTP/1.1\r\nHost: x\r\n\r\n"
+                     b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello")
+        sock_file = sock.makefile("rb")
+        assert read_response(sock_file) == (b"HTTP/1.1 200 OK\r\n", b"/first")
+        assert read_response(sock_file) == (b"HTTP/1.1 200 OK\r\n", b"hello")
+        sock.sendall(b"GET /third HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        assert read_response(sock_file)[1] == b"/third"
+        assert sock_file.read() == b""
+
+
+def test_oversized_request_head_is_rejected(server):
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+        sock.sendall(b"GET / HTTP/1.1\r\nX-Big: " + b"a" * (MAX_REQUEST_HEAD_SIZE + 1024))
+        status, _body = read_response(sock.makefile("rb"))
+        assert status.startswith(b"HTTP/1.1 431")
+
+
+def test_idle_connection_does_not_hold_a_thread(server):
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+        sock.sendall(b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n")
+        read_response(sock.makefile("rb"))
+        while not server._idle:
+            time.sleep(0.005)
+        assert server._in_flight == 0 and len(server._connections) == 1
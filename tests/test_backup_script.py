@@ -0,0 +1,128 @@
+import datetime
+import hashlib
+import json
+import os
+
+import pytest
+
+import backup_script
+from backup_script import (
+    MANIFEST_NAME, SNAPSHOT_ID_FORMAT, BackupError, list_snapshots, load_manifest, select_kept,
+    verify_snapshot
+)
+from content_store import blob_relpath
+from storage import LocalStorage
+
+
+def snapshot_id(*args) -> str:
+    return datetime.datetime(*args).strftime(SNAPSHOT_ID_FORMAT)
+
+
+def test_select_kept_last():
+    ids = [snapshot_id(2024, 1, 1, hour) for hour in range(10)]
+    assert select_kept(ids, keep_last=3, keep_daily=0, keep_weekly=0) == set(ids[-3:])
+
+
+def test_select_kept_newest_per_day_and_week():
+    # 2024-01-01 - понедельник; по два снимка в день в течение трех недель
+    ids = [snapshot_id(2024, 1, day, hour) for day in range(1, 22) for hour in (1, 23)]
+    kept = select_kept(ids, keep_last=1, keep_daily=3, keep_weekly=3)
+    assert kept == {
+        snapshot_id(2024, 1, 21, 23),  # последний, он же новейший за день и неделю
+        snapshot_id(2024, 1, 20, 23), snapshot_id(2024, 1, 19, 23),  # дни
+        snapshot_id(2024, 1, 14, 23), snapshot_id(2024, 1, 7, 23),  # воскресенья прошлых недель
+    }
+
+
+def test_select_kept_handles_small_and_unsorted_input():
+    ids = [snapshot_id(2024, 3, 2), snapshot_id(2024, 3, 1)]
+    assert select_kept(ids, keep_last=7, keep_daily=7, keep_weekly=4) == set(ids)
+    assert select_kept([], keep_last=7) == set()
+    assert select_kept(ids, keep_last=0, keep_daily=0, keep_weekly=0) == set()
+
+
+@pytest.fixture
+def backup_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_script, "BACKUP_DIR", str(tmp_path))
+    return tmp_path
+
+
+def add_object(backup_dir, data: bytes, ext=".png") -> str:
+    relpath = blob_relpath(hashlib.sha256(data).hexdigest(), ext)
+    path = backup_dir / "objects" / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return relpath
+
+
+def add_snapshot(backup_dir, name: str, objects: list, complete=True) -> None:
+    directory = backup_dir / "snapshots" / name
+    (directory / "db").mkdir(parents=True)
+    if complete:
+        manifest = {"db": {"dump": "db"}, "images": [
+            {"filename": f"{i}.png", "object": relpath, "size": size}
+            for i, (relpath, size) in enumerate(objects)
+        ]}
+        (directory / MANIFEST_NAME).write_text(json.dumps(manifest))
+
+
+def test_incomplete_snapshots_are_not_listed(backup_dir):
+    add_snapshot(backup_dir, snapshot_id(2024, 1, 1), [])
+    add_snapshot(backup_dir, snapshot_id(2024, 1, 2), [], complete=False)
+    assert list_snapshots() == [snapshot_id(2024, 1, 1)]
+    with pytest.raises(BackupError):
+        load_manifest(snapshot_id(2024, 1, 2))
+
+
+def test_prune_removes_snapshots_and_unreferenced_objects(backup_dir, monkeypatch):
+    shared = add_object(backup_dir, b"shared")
+    old_only = add_object(backup_dir, b"old")
+    old, new = snapshot_id(2024, 1, 1), snapshot_id(2024, 1, 2)
+    add_snapshot(backup_dir, old, [(shared, 6), (old_only, 3)])
+    add_snapshot(backup_dir, new, [(shared, 6)])
+    add_snapshot(backup_dir, snapshot_id(2024, 1, 3), [], complete=False)
+
+    # Политика по умолчанию оставила бы оба снимка (разные дни) - ограничиваем явно
+    monkeypatch.setattr(backup_script, "select_kept", lambda ids: {max(ids)})
+    result = backup_script._prune()
+    assert result["removed_snapshots"] == [old]
+    assert result["removed_incomplete"] == [snapshot_id(2024, 1, 3)]
+    assert (result["removed_objects"], result["freed_object_bytes"]) == (1, 3)
+    assert list_snapshots() == [new]
+    assert (backup_dir / "objects" / shared).exists()
+    assert not (backup_dir / "objects" / old_only).exists()
+
+
+def test_verify_snapshot_reports_damaged_objects(backup_dir, monkeypatch):
+    monkeypatch.setattr(backup_script, "PG_RESTORE", "true")  # оглавление дампа "читается"
+    good = add_object(backup_dir, b"good")
+    corrupt = add_object(backup_dir, b"corrupt")
+    (backup_dir / "objects" / corrupt).write_bytes(b"CORRUPT")
+    missing = blob_relpath(hashlib.sha256(b"missing").hexdigest(), ".png")
+    name = snapshot_id(2024, 1, 1)
+    add_snapshot(backup_dir, name, [(good, 4), (corrupt, 7), (missing, 7)])
+
+    problems = verify_snapshot(name)
+    assert sorted(problems) == sorted([f"checksum mismatch: {corrupt}", f"missing object: {missing}"])
+    # Быстрая проверка сравнивает только размеры
+    assert verify_snapshot(name, full=False) == [f"missing object: {missing}"]
+
+
+def test_verify_snapshot_reports_unreadable_dump(backup_dir, monkeypatch):
+    monkeypatch.setattr(backup_script, "PG_RESTORE", "false")
+    name = snapshot_id(2024, 1, 1)
+    add_snapshot(backup_dir, name, [])
+    assert verify_snapshot(name)[0].startswith("database dump is unreadable")
+
+
+def test_copy_object_hashes_while_copying(backup_dir, monkeypatch, tmp_path):
+    source = LocalStorage(str(tmp_path / "storage"))
+    upload = tmp_path / "upload"
+    upload.write_bytes(b"image data")
+    source.put(str(upload), "a.png")
+    monkeypatch.setattr(backup_script, "storage", source)
+
+    object_path = str(backup_dir / "objects" / "ab" / "a.png")
+    assert backup_script._copy_object("a.png", object_path) == hashlib.sha256(b"image data").hexdigest()
+    assert open(object_path, "rb").read() == b"image data"
+    assert os.listdir(os.path.dirname(object_path)) == ["a.png"]
@@ -0,0 +1,97 @@
+import http.client
+import io
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+import app
+from server_runner import BoundedThreadPoolServer
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def multipart(files: list, boundary: str = "batch-boundary") -> bytes:
+    body = b""
+    for field, name, data in files:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+                 f"filename=\"{name}\"\r\nContent-Type: application/octet-stream\r\n\r\n").encode()
+        body += data + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Сервер приложения; сохранение в хранилище и базу заменено записью имен."""
+    saved = []
+
+    def save_uploaded_files(handler, uploads):
+        saved.extend(upload.filename for upload in uploads)
+        return [(f"ab/cd/{upload.sha256}.png", False) for upload in uploads]
+
+    # Процессы пула проверки запускаются заранее: созданные во время запроса унаследовали бы
+    # сокет клиента теста, и сервер не увидел бы закрытия соединения
+    warm_up = tmp_path.parent / "warm-up.png"
+    warm_up.write_bytes(png_bytes())
+    app.image_processor.validate(str(warm_up))
+    monkeypatch.setattr(app.storage, "spool_dir", str(tmp_path))
+    monkeypatch.setattr(app.ImageServer, "_save_uploaded_files", save_uploaded_files)
+    monkeypatch.setattr(app, "MAX_BATCH_FILES", 2)
+    monkeypatch.setattr(app.upload_rate_limiter, "rate", 0)
+    httpd = BoundedThreadPoolServer(("127.0.0.1", 0), app.ImageServer, threads=2)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.saved = saved
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(server, body: bytes, boundary: str = "batch-boundary"):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        conn.request("POST", "/upload-batch", body,
+                     {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_batch_reports_result_per_file(server, tmp_path):
+    image = png_bytes()
+    status, body = post(server, multipart([
+        ("files", "a.png", image),
+        ("files", "notes.txt", b"text"),
+        ("file", "b.png", b"not an image"),
+        ("files", "c.png", image),
+    ]))
+    data = json.loads(body)
+    assert status == 200
+    assert (data["status"], data["uploaded"], data["failed"]) == ("partial", 1, 3)
+    results = data["results"]
+    assert [result["original_name"] for result in results] == ["a.png", "notes.txt", "b.png", "c.png"]
+    assert results[0]["status"] == "success" and results[0]["url"].startswith("/images/ab/cd/")
+    assert results[1]["message"].startswith("Unsupported file format")
+    assert results[2]["status"] == "error"
+    # Сверх MAX_BATCH_FILES файлы не сохраняются
+    assert results[3]["message"] == "Too many files. Maximum is 2 per batch"
+    assert server.saved == ["a.png"]
+    # Временные файлы удалены
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batch_without_valid_files_is_an_error(server):
+    status, body = post(server, multipart([("files", "notes.txt", b"text")]))
+    data = json.loads(body)
+    assert status == 400 and data["status"] == "error" and data["uploaded"] == 0
+
+
+def test_batch_without_file_fields(server):
+    status, _body = post(server, multipart([("other", "a.png", png_bytes())]))
+    assert status == 400
+    assert server.saved == []
@@ -0,0 +1,68 @@
+import argparse
+import io
+
+import pytest
+from PIL import Image
+
+from benchmarks.suite import (
+    _plan_summary, compare, make_png, multipart_body, parse_mix, percentile, unique_png
+)
+from multipart_parser import MultipartReader
+
+
+def test_percentile_interpolates():
+    values = [4, 1, 3, 2]
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4
+    assert percentile([7], 99) == 7
+    assert percentile([], 99) == 0.0
+
+
+def test_parse_mix():
+    assert parse_mix("upload=10, list=20,get") == {"upload": 10.0, "list": 20.0, "get": 1.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix("upload=1,bogus=2")
+
+
+def test_unique_png_is_a_valid_distinct_image():
+    png = make_png(8)
+    first, second = unique_png(png), unique_png(png)
+    assert first != second
+    for data in (first, second):
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            assert img.format == "PNG"
+
+
+def test_multipart_body_is_parsed_by_the_server_parser():
+    png = make_png(4)
+    body, content_type = multipart_body(png)
+    boundary = content_type.split("boundary=")[1]
+    parts = list(MultipartReader(io.BytesIO(body), boundary, len(body)))
+    assert len(parts) == 1
+
+
+def test_plan_summary_finds_indexes_and_seq_scans():
+    plan = {"Execution Time": 1.23456, "Plan": {
+        "Node Type": "Limit", "Plans": [
+            {"Node Type": "Index Scan", "Index Name": "idx_upload_time_id", "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "images"},
+            ]},
+            {"Node Type": "Bitmap Index Scan", "Index Name": "idx_original_name_trgm"},
+        ]}}
+    assert _plan_summary(plan) == {
+        "ms": 1.235, "indexes": ["idx_original_name_trgm", "idx_upload_time_id"], "seq_scan": True,
+    }
+
+
+def result(rps, p99, **extra):
+    return {"meta": {"commit": "abc"}, "operations": {
+        "list": {"throughput_rps": rps, "latency_ms": {"p50": 1.0, "p99": p99}}}, **extra}
+
+
+def test_compare_flags_regressions(capsys):
+    assert not compare(result(100, 10), result(98, 10.5), threshold=10)
+    assert compare(result(100, 10), result(80, 10), threshold=10)
+    assert compare(result(100, 10), result(100, 12), threshold=10)
+    assert "REGRESSION" in capsys.readouterr().out
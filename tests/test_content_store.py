@@ -0,0 +1,110 @@
+import hashlib
+import os
+
+from content_store import (
+    blob_relpath, count_references, delete_unreferenced, hash_file, place_blob, remove_blob
+)
+
+HASH = hashlib.sha256(b"data").hexdigest()
+
+
+def test_blob_relpath_is_sharded():
+    assert blob_relpath(HASH, ".png") == f"{HASH[:2]}/{HASH[2:4]}/{HASH}.png"
+
+
+def test_hash_file(tmp_path, monkeypatch):
+    monkeypatch.setattr("content_store.HASH_CHUNK_SIZE", 3)
+    path = tmp_path / "f"
+    path.write_bytes(b"0123456789")
+    assert hash_file(str(path)) == hashlib.sha256(b"0123456789").hexdigest()
+
+
+def test_place_blob_creates_and_deduplicates(tmp_path):
+    blob = str(tmp_path / blob_relpath(HASH, ".png"))
+    first = tmp_path / "upload-1"
+    first.write_bytes(b"data")
+    assert place_blob(str(first), blob)
+    assert not first.exists()
+    assert os.stat(blob).st_mode & 0o777 == 0o644
+
+    second = tmp_path / "upload-2"
+    second.write_bytes(b"data")
+    assert not place_blob(str(second), blob)
+    assert not second.exists()
+    assert open(blob, "rb").read() == b"data"
+
+
+def test_remove_blob(tmp_path):
+    relpath = blob_relpath(HASH, ".png")
+    os.makedirs(tmp_path / os.path.dirname(relpath))
+    (tmp_path / relpath).write_bytes(b"data")
+    assert remove_blob(str(tmp_path), relpath)
+    assert not remove_blob(str(tmp_path), relpath)
+    # Каталоги шардов остаются
+    assert (tmp_path / os.path.dirname(relpath)).is_dir()
+
+
+class FakeCursor:
+    def __init__(self, references: int):
+        self.references = references
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append(sql)
+
+    def fetchone(self):
+        return (self.references,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rolled_back = False
+
+    def cursor(self):
+        return self._cursor
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeStorage:
+    def __init__(self, existing):
+        self.existing = set(existing)
+
+    def delete(self, key):
+        if key in self.existing:
+            self.existing.remove(key)
+            return True
+        return False
+
+
+def test_count_references():
+    assert count_references(FakeCursor(3), "ab/cd/x.png") == 3
+
+
+def test_delete_unreferenced_removes_objects_under_lock():
+    cursor = FakeCursor(0)
+    conn = FakeConnection(cursor)
+    storage = FakeStorage({"a.png", "a.webp"})
+    deleted = delete_unreferenced(lambda: conn, storage, "a.png", ["a.png", "a.webp", "a.avif"])
+    assert deleted == ["a.png", "a.webp"]
+    assert "pg_advisory_xact_lock" in cursor.queries[0]
+    assert conn.rolled_back
+
+
+def test_delete_unreferenced_keeps_blob_with_new_reference():
+    conn = FakeConnection(FakeCursor(1))
+    storage = FakeStorage({"a.png"})
+    assert delete_unreferenced(lambda: conn, storage, "a.png", ["a.png"]) == []
+    assert storage.existing == {"a.png"}
+    assert conn.rolled_back
@@ -0,0 +1,142 @@
+import threading
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeoutError, _statement_type
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.pings += 1
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.pings = 0
+        self.rollbacks = 0
+        self.info = FakeInfo()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def connect(**config):
+        assert config["cursor_factory"] is db_pool.TimedCursor
+        created.append(FakeConnection())
+        return created[-1]
+
+    monkeypatch.setattr(db_pool.psycopg2, "connect", connect)
+    return created
+
+
+def test_statement_type():
+    assert _statement_type("  select 1") == "SELECT"
+    assert _statement_type(b"INSERT INTO images") == "INSERT"
+    assert _statement_type("WITH x AS (SELECT 1) SELECT 1") == "other"
+    assert _statement_type("") == "other"
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        ConnectionPool({}, min_size=3, max_size=2)
+
+
+def test_connections_are_reused(connections):
+    pool = ConnectionPool({}, min_size=1, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert len(connections) == 1
+    assert pool.stats()["idle"] == 1 and pool.stats()["in_use"] == 0
+
+
+def test_open_transaction_is_rolled_back(connections):
+    pool = ConnectionPool({}, max_size=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+
+
+def test_checkout_times_out_when_pool_is_exhausted(connections):
+    pool = ConnectionPool({}, max_size=1, checkout_timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+    # Ожидающий получает подключение, как только его вернут
+    threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+    pool.checkout_timeout = 5
+    assert pool.getconn() is conn
+
+
+def test_broken_connection_is_replaced(connections):
+    pool = ConnectionPool({}, max_size=2, validate_idle_after=60)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection():
+            raise psycopg2.OperationalError("connection lost")
+    assert connections[0].closed
+    with pool.connection() as conn:
+        assert conn is connections[1]
+    assert pool.stats()["discarded"] == 1
+
+
+def test_idle_connections_are_validated(connections):
+    pool = ConnectionPool({}, max_size=2, validate_idle_after=0)
+    with pool.connection() as conn:
+        pass
+    conn.dead = True
+    with pool.connection() as replacement:
+        assert replacement is not conn
+    assert conn.closed and pool.stats()["validation_failures"] == 1
+
+
+def test_old_connections_are_retired(connections):
+    pool = ConnectionPool({}, max_size=1, max_lifetime=10, validate_idle_after=60)
+    with pool.connection() as conn:
+        pass
+    pooled = pool._idle[0]
+    pooled.created_at -= 11
+    with pool.connection() as replacement:
+        assert replacement is not conn
+
+
+def test_fill_opens_min_size(connections):
+    pool = ConnectionPool({}, min_size=3, max_size=5)
+    pool.fill()
+    assert len(connections) == 3 and pool.stats()["idle"] == 3
+    pool.close_all()
+    assert all(conn.closed for conn in connections) and pool.size == 0
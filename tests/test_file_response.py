@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from file_response import (
+    MAX_RANGES, RangeNotSatisfiable, _coalesce, etag_matches, http_date,
+    is_not_modified, make_etag, multipart_byteranges, parse_range, range_applies
+)
+
+ETAG = '"1-2-3"'
+MTIME = 1700000000.5
+
+
+def test_single_ranges():
+    assert parse_range("bytes=0-99", 1000) == [(0, 99)]
+    assert parse_range("bytes=500-", 1000) == [(500, 999)]
+    # Конец за пределами файла обрезается
+    assert parse_range("bytes=900-5000", 1000) == [(900, 999)]
+
+
+def test_suffix_ranges():
+    assert parse_range("bytes=-100", 1000) == [(900, 999)]
+    # Суффикс длиннее файла - весь файл
+    assert parse_range("bytes=-5000", 1000) == [(0, 999)]
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=-0", 1000)
+
+
+def test_overlapping_and_adjacent_ranges_are_coalesced():
+    assert parse_range("bytes=0-5,3-10", 100) == [(0, 10)]
+    assert parse_range("bytes=0-4,5-9", 100) == [(0, 9)]
+    assert parse_range("bytes=50-60,0-1,-10", 100) == [(0, 1), (50, 60), (90, 99)]
+    assert parse_range("bytes=-10,95-", 100) == [(90, 99)]
+
+
+def test_unsatisfiable_ranges():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-", 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-2000,5000-", 1000)
+    # Недостижимые диапазоны отбрасываются, если есть хотя бы один выполнимый
+    assert parse_range("bytes=1000-2000,0-0", 1000) == [(0, 0)]
+
+
+def test_zero_size_file_has_no_satisfiable_range():
+    for header in ("bytes=0-", "bytes=0-0", "bytes=-1"):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range(header, 0)
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-1", "bytes=", "bytes=5-3", "bytes=abc", "bytes=0-1,,2-3", "bytes=1",
+    "bytes=-x",
+])
+def test_invalid_headers_are_ignored(header):
+    assert parse_range(header, 1000) is None
+
+
+def test_too_many_ranges_are_ignored():
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES + 1))
+    assert parse_range(header, 10000) is None
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES))
+    assert len(parse_range(header, 10000)) == MAX_RANGES
+
+
+def test_coalesce():
+    assert _coalesce([(5, 9), (0, 2)]) == [(0, 2), (5, 9)]
+    assert _coalesce([(0, 10), (2, 3)]) == [(0, 10)]
+    assert _coalesce([(0, 2), (3, 4), (6, 7)]) == [(0, 4), (6, 7)]
+
+
+def test_range_applies():
+    assert range_applies({}, ETAG, MTIME)
+    assert range_applies({"If-Range": ETAG}, ETAG, MTIME)
+    assert not range_applies({"If-Range": '"other"'}, ETAG, MTIME)
+    # Слабый ETag в If-Range не подходит
+    assert not range_applies({"If-Range": "W/" + ETAG}, ETAG, MTIME)
+    assert range_applies({"If-Range": http_date(MTIME)}, ETAG, MTIME)
+    assert not range_applies({"If-Range": http_date(MTIME - 60)}, ETAG, MTIME)
+    assert not range_applies({"If-Range": "not a date"}, ETAG, MTIME)
+
+
+def test_etag_matches():
+    assert etag_matches("*", ETAG)
+    assert etag_matches(f'"a", {ETAG}', ETAG)
+    assert etag_matches("W/" + ETAG, ETAG)
+    assert not etag_matches('"a", "b"', ETAG)
+
+
+def test_is_not_modified():
+    assert not is_not_modified({}, ETAG, MTIME)
+    assert is_not_modified({"If-None-Match": ETAG}, ETAG, MTIME)
+    assert is_not_modified({"If-Modified-Since": http_date(MTIME)}, ETAG, MTIME)
+    assert not is_not_modified({"If-Modified-Since": http_date(MTIME - 60)}, ETAG, MTIME)
+    assert not is_not_modified({"If-Modified-Since": "garbage"}, ETAG, MTIME)
+    # If-None-Match важнее If-Modified-Since
+    headers = {"If-None-Match": '"other"', "If-Modified-Since": http_date(MTIME)}
+    assert not is_not_modified(headers, ETAG, MTIME)
+
+
+def test_make_etag_changes_with_file(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"abc")
+    first = make_etag(os.stat(path))
+    path.write_bytes(b"abcd")
+    assert make_etag(os.stat(path)) != first
+    assert first.startswith('"') and first.endswith('"')
+
+
+def test_multipart_byteranges_length_matches_body():
+    data = bytes(range(100))
+    parts, tail, total = multipart_byteranges([(0, 9), (50, 59)], len(data), "image/png", "xyz")
+    body = b"".join(head + data[start:end + 1] for head, start, end in parts) + tail
+    assert len(body) == total
+    assert b"Content-Range: bytes 50-59/100" in body
+    assert body.endswith(b"\r\n--xyz--\r\n")
+
@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from file_response import encode_headers
+from hot_cache import CachedFile, HotFileCache
+
+
+def write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def request(cache: HotFileCache, path: str, content_type=None, headers=None):
+    """Как ImageServer._send_file: попадание или попытка допуска после промаха."""
+    entry = cache.get(path)
+    if entry is not None:
+        return entry
+    with open(path, "rb") as f:
+        return cache.admit(path, f, os.fstat(f.fileno()), content_type, headers)
+
+
+def test_file_is_admitted_after_enough_requests(tmp_path):
+    path = write(tmp_path / "a.png", b"a" * 100)
+    cache = HotFileCache(max_bytes=1000, admit_hits=2)
+    assert request(cache, path) is None
+    entry = request(cache, path)
+    assert entry is not None and entry.body == b"a" * 100
+    assert cache.get(path) is entry
+    stats = cache.stats()
+    assert (stats["admissions"], stats["rejections"], stats["hits"]) == (1, 1, 1)
+
+
+def test_changed_file_is_not_served_from_cache(tmp_path):
+    path = write(tmp_path / "a.png", b"a" * 100)
+    cache = HotFileCache(max_bytes=1000, admit_hits=1)
+    assert request(cache, path) is not None
+    write(tmp_path / "a.png", b"b" * 50)
+    assert cache.get(path) is None
+    assert cache.stats()["invalidations"] == 1
+    os.remove(path)
+    assert cache.get(path) is None
+
+
+def test_new_file_does_not_evict_more_frequent_ones(tmp_path):
+    hot = write(tmp_path / "hot.png", b"h" * 600)
+    cold = write(tmp_path / "cold.png", b"c" * 600)
+    cache = HotFileCache(max_bytes=1000, admit_hits=2)
+    for _ in range(5):
+        request(cache, hot)
+    for _ in range(3):
+        assert request(cache, cold) is None
+    assert cache.get(hot) is not None
+    assert cache.stats()["evictions"] == 0
+
+    # Став популярнее, файл вытесняет прежний
+    for _ in range(5):
+        entry = request(cache, cold)
+    assert entry is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 600
+
+
+def test_large_files_and_disabled_cache(tmp_path):
+    path = write(tmp_path / "big.png", b"x" * 500)
+    cache = HotFileCache(max_bytes=1000, max_file_size=100, admit_hits=1)
+    for _ in range(3):
+        assert request(cache, path) is None
+    disabled = HotFileCache(max_bytes=0, admit_hits=1)
+    for _ in range(3):
+        assert request(disabled, path) is None
+    assert disabled.preload(str(tmp_path)) == 0
+
+
+def test_frequencies_age(tmp_path):
+    cache = HotFileCache(max_bytes=1000, sketch_entries=2)
+    for _ in range(4):
+        cache._record_access("a")
+    cache._record_access("b")
+    cache._record_access("c")  # третий путь - счетчики делятся пополам, единичные забываются
+    assert cache._frequency == {"a": 2}
+
+
+def test_invalidate_removes_variants(tmp_path):
+    cache = HotFileCache(max_bytes=10000, admit_hits=1)
+    paths = [write(tmp_path / name, b"x" * 10) for name in ("a.png", "a.png.webp", "a.png2")]
+    for path in paths:
+        request(cache, path)
+    cache.invalidate(paths[0])
+    assert cache.stats()["entries"] == 1
+    assert cache.get(paths[2]) is not None
+
+
+def test_preload_with_headers(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    write(static / "index.html", b"<html></html>")
+    write(static / "style.css", b"body{}")
+    write(static / "big.js", b"x" * 5000)
+    cache = HotFileCache(max_bytes=10000, max_file_size=1000, admit_hits=2)
+    describe = lambda path: ("text/css" if path.endswith(".css") else "text/html",
+                             {"Cache-Control": "public"})
+    assert cache.preload(str(static), describe) == 2
+    entry = cache.get(str(static / "style.css"))
+    assert entry.content_type == "text/css"
+    assert b"Content-Type: text/css\r\n" in entry.header_block("text/css")
+    # Предзагруженную статику не вытесняет файл, запрошенный минимально допустимое число раз
+    assert cache._frequency[str(static / "style.css")] >= cache.admit_hits
+
+
+def test_cached_file_header_blocks(tmp_path):
+    path = write(tmp_path / "a.png", b"x" * 42)
+    stat = os.stat(path)
+    entry = CachedFile(stat, b"x" * 42, "image/png", {"Cache-Control": "immutable", "Vary": "Accept"})
+    block = entry.header_block("image/png")
+    assert block == encode_headers({
+        "Content-Type": "image/png", "Content-Length": "42", "ETag": entry.etag,
+        "Last-Modified": entry.last_modified, "Cache-Control": "immutable", "Vary": "Accept",
+    })
+    # Для другого типа блок строится по запросу и запоминается
+    assert entry.header_block("application/octet-stream") is None
+    other = entry.build_header_block("application/octet-stream", {})
+    assert entry.header_block("application/octet-stream") is other
+    assert CachedFile(stat).header_block("image/png") is None
+
+
+def test_admitted_entry_carries_header_block(tmp_path):
+    path = write(tmp_path / "a.png", b"x" * 10)
+    cache = HotFileCache(max_bytes=1000, admit_hits=1)
+    entry = request(cache, path, "image/png", {"Accept-Ranges": "bytes"})
+    assert entry.content_type == "image/png"
+    assert entry.header_block("image/png").endswith(b"Accept-Ranges: bytes\r\n")
+
+
+def test_encode_headers():
+    assert encode_headers({"A": "1", "B": "x y"}) == b"A: 1\r\nB: x y\r\n"
+    with pytest.raises(UnicodeEncodeError):
+        encode_headers({"A": "Ж"})
@@ -0,0 +1,111 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from image_processing import (
+    ImageJobTimeoutError, ImageProcessingError, ImageProcessor, ImageQueueFullError,
+    ImageRejectedError, validate_image
+)
+
+
+def add(a, b):
+    return a + b
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def processor():
+    created = []
+
+    def factory(**kwargs):
+        kwargs.setdefault("workers", 1)
+        proc = ImageProcessor(**kwargs)
+        created.append(proc)
+        return proc
+
+    yield factory
+    for proc in created:
+        proc.shutdown()
+
+
+def make_png(path, size=(40, 20)):
+    Image.new("RGB", size, color=(10, 20, 30)).save(path, format="PNG")
+    return str(path)
+
+
+def test_validate_image(tmp_path):
+    info = validate_image(make_png(tmp_path / "a.png"))
+    assert (info["width"], info["height"], info["format"]) == (40, 20, "PNG")
+
+
+def test_validate_image_rejects_garbage_and_truncated_files(tmp_path):
+    garbage = tmp_path / "garbage.png"
+    garbage.write_bytes(b"not an image at all")
+    with pytest.raises(ImageRejectedError, match="Invalid image file"):
+        validate_image(str(garbage))
+
+    data = open(make_png(tmp_path / "full.png", size=(200, 200)), "rb").read()
+    truncated = tmp_path / "truncated.png"
+    truncated.write_bytes(data[:len(data) // 2])
+    with pytest.raises(ImageRejectedError):
+        validate_image(str(truncated))
+
+
+# Как в процессах пула (_init_worker): предупреждение о "бомбе" - ошибка
+@pytest.mark.filterwarnings("error::PIL.Image.DecompressionBombWarning")
+def test_validate_image_rejects_too_many_pixels(tmp_path, monkeypatch):
+    path = make_png(tmp_path / "big.png", size=(100, 100))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 5000)
+    with pytest.raises(ImageRejectedError, match="too large"):
+        validate_image(path)
+
+
+def test_run_returns_result(processor):
+    proc = processor()
+    assert proc.run(add, 2, 3) == 5
+    stats = proc.stats()
+    assert (stats["submitted"], stats["completed"], stats["queue_depth"]) == (1, 1, 0)
+
+
+def test_rejected_image_is_counted_as_invalid(processor, tmp_path):
+    garbage = tmp_path / "garbage.png"
+    garbage.write_bytes(b"garbage")
+    proc = processor()
+    with pytest.raises(ImageRejectedError):
+        proc.validate(str(garbage))
+    assert proc.stats()["invalid"] == 1
+
+
+def test_job_timeout(processor):
+    proc = processor(job_timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(ImageJobTimeoutError):
+        proc.run(time.sleep, 5)
+    assert time.monotonic() - started < 3
+    assert proc.stats()["timeouts"] == 1
+    # Процесс пула после таймаута продолжает работать
+    assert proc.run(add, 1, 1) == 2
+
+
+def test_full_queue_is_rejected(processor):
+    proc = processor(queue_size=1, queue_wait=0.05)
+    proc._slots.acquire()
+    try:
+        with pytest.raises(ImageQueueFullError):
+            proc.run(add, 1, 1)
+    finally:
+        proc._slots.release()
+    assert proc.stats()["rejected"] == 1
+
+
+def test_crashed_worker_restarts_pool(processor):
+    proc = processor()
+    with pytest.raises(ImageProcessingError, match="crashed"):
+        proc.run(crash)
+    assert proc.stats()["pool_restarts"] == 1
+    assert proc.run(add, 2, 2) == 4
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+from image_search import (
+    ImageFilter, SearchParamsError, count_query, escape_like, list_query, parse_filters,
+)
+
+
+def test_empty_params_give_inactive_filter():
+    filters = parse_filters({})
+    assert not filters.active
+    assert filters.conditions() == ([], [])
+
+
+def test_file_types_are_normalized():
+    filters = parse_filters({"file_type": ["PNG, .jpg", "gif,,png"]})
+    assert filters.file_types == (".gif", ".jpeg", ".jpg", ".png")
+    assert filters.cache_key() == parse_filters({"file_type": ["gif,jpeg,png"]}).cache_key()
+
+
+@pytest.mark.parametrize("params", [
+    {"file_type": ["p?ng"]},
+    {"file_type": [",".join(f"t{i}" for i in range(11))]},
+    {"min_size": ["ten"]},
+    {"max_size": ["-1"]},
+    {"min_size": ["10"], "max_size": ["5"]},
+    {"date_from": ["yesterday"]},
+    {"date_from": ["2024-05-02"], "date_to": ["2024-05-01"]},
+    {"q": ["x" * 101]},
+])
+def test_invalid_params(params):
+    with pytest.raises(SearchParamsError):
+        parse_filters(params)
+
+
+def test_dates():
+    filters = parse_filters({"date_from": ["2024-05-01"], "date_to": ["2024-05-01"],
+                             "min_size": [" "]})
+    # Дата без времени в конце диапазона включает весь день
+    assert filters.date_from == datetime.datetime(2024, 5, 1)
+    assert filters.date_to == datetime.datetime(2024, 5, 2)
+    assert filters.min_size is None
+    # Время с часовым поясом приводится к UTC без пояса
+    filters = parse_filters({"date_from": ["2024-05-01T12:00:00+03:00"]})
+    assert filters.date_from == datetime.datetime(2024, 5, 1, 9, 0)
+
+
+def test_escape_like():
+    assert escape_like("50%_a\\b") == "50\\%\\_a\\\\b"
+
+
+def test_conditions_for_text_search():
+    filters = parse_filters({"prefix": ["Cat_"], "q": ["100%"]})
+    clauses, params = filters.conditions()
+    assert clauses == ["lower(original_name) LIKE %s", "original_name ILIKE %s"]
+    assert params == ["cat\\_%", "%100\\%%"]
+
+
+def test_list_query_keyset_and_offset():
+    filters = ImageFilter(min_size=10)
+    sql, params = list_query(filters, 20, offset=40)
+    assert "WHERE size >= %s" in sql and sql.endswith("LIMIT %s OFFSET %s")
+    assert params == [10, 20, 40]
+
+    after = (datetime.datetime(2024, 5, 1), 7)
+    sql, params = list_query(filters, 20, after=after)
+    assert "(upload_time, id) < (%s, %s)" in sql and "OFFSET" not in sql
+    assert params == [10, after[0], 7, 20]
+
+
+def test_selective_query_is_materialized_only_with_filters():
+    sql, _params = list_query(ImageFilter(file_types=(".png",)), 20, selective=True)
+    assert sql.startswith("WITH matched AS MATERIALIZED")
+    sql, _params = list_query(ImageFilter(), 20, selective=True)
+    assert "MATERIALIZED" not in sql and "WHERE" not in sql
+
+
+def test_count_query_is_capped():
+    sql, params = count_query(ImageFilter(max_size=100), cap=500)
+    assert "LIMIT %s" in sql
+    assert params == [100, 501]
@@ -0,0 +1,147 @@
+import pytest
+
+from job_queue import Job, JobQueue, JobWorker, PermanentJobError, backoff_delay, job_statuses
+
+
+class FakeCursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_backoff_delay_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr("job_queue.random.uniform", lambda low, high: high)
+    assert [backoff_delay(n, base=5, maximum=600) for n in (0, 1, 2, 3)] == [5, 5, 10, 20]
+    assert backoff_delay(20, base=5, maximum=600) == 600
+    monkeypatch.setattr("job_queue.random.uniform", lambda low, high: low)
+    assert backoff_delay(3, base=5, maximum=600) == 10
+
+
+def test_job_statuses():
+    cursor = FakeCursor([
+        ("a.png", "transcode", "done", 1, None),
+        ("a.png", "thumbnail", "failed", 5, "OSError: disk full"),
+        ("b.png", "transcode", "queued", 0, "stale error"),
+    ])
+    assert job_statuses(cursor, ["a.png", "b.png", "a.png"]) == {
+        "a.png": {"transcode": {"status": "done", "attempts": 1},
+                  "thumbnail": {"status": "failed", "attempts": 5, "error": "OSError: disk full"}},
+        "b.png": {"transcode": {"status": "queued", "attempts": 0}},
+    }
+    assert sorted(cursor.executed[0][1][0]) == ["a.png", "b.png"]
+    assert job_statuses(FakeCursor(), []) == {}
+
+
+def test_fail_retries_until_attempts_are_exhausted():
+    cursor = FakeCursor()
+    queue = JobQueue(lambda: FakeConnection(cursor), concurrency={"transcode": 2})
+    assert queue.limit("transcode") == 2 and queue.limit("other") == 1
+
+    assert queue.fail(Job(1, "transcode", "a.png", 1, 3), OSError("busy"))
+    sql, params = cursor.executed[-1]
+    assert "status = 'queued'" in sql and params[0] == "OSError: busy"
+
+    assert not queue.fail(Job(1, "transcode", "a.png", 3, 3), OSError("busy"))
+    assert "status = 'failed'" in cursor.executed[-1][0]
+    assert not queue.fail(Job(1, "transcode", "a.png", 1, 3), ValueError("bad"), permanent=True)
+    assert "status = 'failed'" in cursor.executed[-1][0]
+
+
+def test_counts_are_cached():
+    cursor = FakeCursor([("queued", 3), ("failed", 1)])
+    queue = JobQueue(lambda: FakeConnection(cursor))
+    assert queue.counts() == {"queued": 3, "running": 0, "failed": 1}
+    queue.counts()
+    assert len(cursor.executed) == 1
+    queue.counts(max_age=0)
+    assert len(cursor.executed) == 2
+
+
+class FakeQueue:
+    def __init__(self, db_error=None):
+        self.completed = []
+        self.failed = []
+        self.db_error = db_error
+
+    def complete(self, job):
+        if self.db_error is not None:
+            raise self.db_error
+        self.completed.append(job.id)
+
+    def fail(self, job, error, permanent=False):
+        if self.db_error is not None:
+            raise self.db_error
+        self.failed.append((job.id, type(error).__name__, permanent))
+        return not permanent and job.attempts < job.max_attempts
+
+
+def run_job(handler, queue=None, attempts=1):
+    queue = queue or FakeQueue()
+    worker = JobWorker(queue, {"transcode": handler}, {})
+    worker._execute(Job(7, "transcode", "a.png", attempts, 3))
+    return queue, worker.stats()
+
+
+def test_worker_completes_job():
+    done = []
+    queue, stats = run_job(done.append)
+    assert done == ["a.png"]
+    assert queue.completed == [7]
+    assert stats == {"completed": 1, "retried": 0, "failed": 0}
+
+
+def test_worker_retries_transient_errors():
+    def handler(filename):
+        raise OSError("busy")
+
+    queue, stats = run_job(handler)
+    assert queue.failed == [(7, "OSError", False)]
+    assert stats["retried"] == 1
+    _queue, stats = run_job(handler, attempts=3)
+    assert stats["failed"] == 1
+
+
+def test_worker_does_not_retry_permanent_errors():
+    def handler(filename):
+        raise PermanentJobError("not an image")
+
+    queue, stats = run_job(handler)
+    assert queue.failed == [(7, "PermanentJobError", True)]
+    assert stats["failed"] == 1
+
+
+@pytest.mark.parametrize("handler", [lambda filename: None, lambda filename: 1 / 0])
+def test_worker_survives_database_errors(handler):
+    # Результат не записан - задачу после окончания аренды заберет другой исполнитель
+    _queue, stats = run_job(handler, FakeQueue(db_error=RuntimeError("db down")))
+    assert stats == {"completed": 0, "retried": 0, "failed": 0}
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from list_cache import ListResponseCache, make_etag
+
+
+@pytest.fixture
+def make_cache():
+    def factory(**kwargs):
+        cache = ListResponseCache({}, **kwargs)
+        # Подписка "уже активна" в этом процессе: поток LISTEN не запускается
+        cache._listener_pid = os.getpid()
+        cache._listening = True
+        return cache
+    return factory
+
+
+def test_put_and_get(make_cache):
+    cache = make_cache()
+    etag = cache.put("k", cache.version, b"body")
+    assert etag == make_etag(b"body")
+    assert cache.get("k") == (b"body", etag)
+    assert cache.get("other") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_nothing_is_cached_without_listener(make_cache):
+    cache = make_cache()
+    cache._listening = False
+    cache.put("k", cache.version, b"body")
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_response_built_from_stale_version_is_not_cached(make_cache):
+    cache = make_cache()
+    version = cache.version
+    cache.invalidate()
+    cache.put("k", version, b"body")
+    assert cache.get("k") is None
+
+
+def test_invalidate_drops_entries(make_cache):
+    cache = make_cache()
+    cache.put("k", cache.version, b"body")
+    cache.invalidate()
+    assert cache.get("k") is None
+    assert cache.stats()["version"] == 1
+
+
+def test_entries_expire(make_cache):
+    cache = make_cache(ttl=0)
+    cache.put("k", cache.version, b"body")
+    assert cache.get("k") is None
+
+
+def test_eviction_by_count_and_size(make_cache):
+    cache = make_cache(max_entries=2, max_bytes=10)
+    for key in ("a", "b", "c"):
+        cache.put(key, cache.version, b"1")
+    assert cache.get("a") is None and cache.get("c") is not None
+
+    cache.put("big", cache.version, b"x" * 9)
+    assert cache.stats()["bytes"] <= 10
+    # Ответ больше лимита не кешируется вовсе
+    cache.put("huge", cache.version, b"x" * 11)
+    assert cache.get("huge") is None
+
+
+def test_etag_depends_only_on_body():
+    assert make_etag(b"a") == make_etag(b"a") != make_etag(b"b")
+
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import queue
+import sys
+
+from logger_config import (
+    DroppingQueueHandler, JsonFormatter, ProcessSafeRotatingFileHandler, RequestContextFilter,
+    TextFormatter, end_request, record_stage, request_stages, start_request
+)
+
+
+def make_record(message="hello", **extra):
+    record = logging.LogRecord("ImageServer", logging.INFO, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_request_context_and_stages():
+    start_request("rid-1")
+    try:
+        record_stage("db", 0.001)
+        record_stage("db", 0.002)
+        record_stage("save", 0.5)
+        assert request_stages() == {"db": 3.0, "save": 500.0}
+        record = make_record()
+        assert RequestContextFilter(sample_rate=1.0).filter(record)
+        assert record.request_id == "rid-1"
+    finally:
+        end_request()
+    # Вне запроса этапы не копятся
+    record_stage("db", 1.0)
+    assert request_stages() == {}
+
+
+def test_sampling_applies_only_to_marked_records():
+    drop_all = RequestContextFilter(sample_rate=0.0)
+    assert not drop_all.filter(make_record(sample=True))
+    assert drop_all.filter(make_record(sample=False))
+    assert drop_all.filter(make_record())
+    assert RequestContextFilter(sample_rate=1.0).filter(make_record(sample=True))
+
+
+def test_json_formatter():
+    record = make_record("GET / 200", request_id="rid", status=200, route="static", stages=None)
+    data = json.loads(JsonFormatter().format(record))
+    assert data["message"] == "GET / 200"
+    assert data["request_id"] == "rid"
+    assert data["status"] == 200 and data["route"] == "static"
+    assert "stages" not in data
+    assert data["level"] == "INFO"
+
+
+def test_json_formatter_includes_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("ImageServer", logging.ERROR, __file__, 1, "failed", None,
+                                   sys.exc_info())
+    assert "ValueError: boom" in json.loads(JsonFormatter().format(record))["exc"]
+
+
+def test_text_formatter_appends_request_id():
+    assert TextFormatter().format(make_record("x", request_id="rid")).endswith("x [rid=rid]")
+    assert TextFormatter().format(make_record("x")).endswith("x")
+
+
+def test_dropping_queue_handler_does_not_block():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    before = DroppingQueueHandler.dropped
+    handler.emit(make_record("first"))
+    handler.emit(make_record("second"))
+    assert handler.queue.qsize() == 1
+    assert DroppingQueueHandler.dropped == before + 1
+
+
+def test_rotation_shared_between_handlers(tmp_path):
+    path = str(tmp_path / "server.log")
+    # Два обработчика одного файла - как в двух процессах
+    first = ProcessSafeRotatingFileHandler(path, maxBytes=200, backupCount=2, encoding="utf-8")
+    second = ProcessSafeRotatingFileHandler(path, maxBytes=200, backupCount=2, encoding="utf-8")
+    try:
+        for i in range(20):
+            (first if i % 2 else second).emit(make_record("x" * 30 + str(i)))
+    finally:
+        first.close()
+        second.close()
+
+    assert os.path.exists(path + ".1")
+    assert os.path.getsize(path) <= 200
+    lines = []
+    for name in (path + ".2", path + ".1", path):
+        if os.path.exists(name):
+            with open(name, encoding="utf-8") as f:
+                lines += f.read().splitlines()
+    # Последние записи не потеряны и не продублированы после чужой ротации
+    assert lines[-1].endswith("19")
+    assert len(lines) == len(set(lines))
@@ -0,0 +1,145 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry, timed
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return Registry(str(tmp_path / "metrics"), flush_interval=60)
+
+
+def add(registry, metric):
+    registry.register(metric)
+    return metric
+
+
+def write_process_file(registry, pid, metrics):
+    os.makedirs(registry.directory, exist_ok=True)
+    with open(os.path.join(registry.directory, f"{pid}.json"), "w") as f:
+        json.dump({"pid": pid, "metrics": metrics}, f)
+
+
+def dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def lines(registry) -> list:
+    return registry.render().decode().splitlines()
+
+
+def test_counter_with_labels(registry):
+    counter = add(registry, Counter("t_requests_total", "Requests", ("route", "status")))
+    counter.inc(route="image", status=200)
+    counter.inc(2, route="image", status=200)
+    counter.inc(route='a"b\\c\nd', status=500)
+    output = lines(registry)
+    assert "# TYPE t_requests_total counter" in output
+    assert 't_requests_total{route="image",status="200"} 3' in output
+    assert 't_requests_total{route="a\\"b\\\\c\\nd",status="500"} 1' in output
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = add(registry, Histogram("t_latency_seconds", "Latency", buckets=(0.1, 1.0)))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    output = lines(registry)
+    assert 't_latency_seconds_bucket{le="0.1"} 2' in output
+    assert 't_latency_seconds_bucket{le="1"} 3' in output
+    assert 't_latency_seconds_bucket{le="+Inf"} 4' in output
+    assert "t_latency_seconds_count 4" in output
+    assert "t_latency_seconds_sum 5.65" in output
+
+
+def test_values_of_other_processes_are_summed(registry):
+    counter = add(registry, Counter("t_total", "Total"))
+    gauge = add(registry, Gauge("t_in_flight", "In flight"))
+    counter.inc(2)
+    gauge.set(1)
+    write_process_file(registry, os.getppid(), {
+        "t_total": {"type": "counter", "help": "Total", "labelnames": [], "samples": [[[], 5]]},
+        "t_in_flight": {"type": "gauge", "help": "In flight", "labelnames": [],
+                        "samples": [[[], 3]], "aggregate": "sum"},
+    })
+    output = lines(registry)
+    assert "t_total 7" in output
+    assert "t_in_flight 4" in output
+
+
+def test_gauges_of_dead_processes_are_dropped(registry):
+    add(registry, Counter("t_total", "Total"))
+    add(registry, Gauge("t_in_flight", "In flight"))
+    write_process_file(registry, dead_pid(), {
+        "t_total": {"type": "counter", "help": "Total", "labelnames": [], "samples": [[[], 5]]},
+        "t_in_flight": {"type": "gauge", "help": "In flight", "labelnames": [],
+                        "samples": [[[], 3]], "aggregate": "sum"},
+    })
+    output = lines(registry)
+    assert "t_total 5" in output
+    assert "t_in_flight 3" not in output
+
+
+def test_flush_and_clear(registry):
+    add(registry, Counter("t_total", "Total")).inc(4)
+    os.makedirs(registry.directory)
+    registry.flush()
+    with open(os.path.join(registry.directory, f"{os.getpid()}.json")) as f:
+        data = json.load(f)
+    assert data["metrics"]["t_total"]["samples"] == [[[], 4]]
+    assert [name for name in os.listdir(registry.directory) if name.startswith(".")] == []
+
+    registry.clear()
+    assert os.listdir(registry.directory) == []
+
+
+def test_unreadable_process_files_are_skipped(registry):
+    add(registry, Counter("t_total", "Total")).inc()
+    os.makedirs(registry.directory)
+    with open(os.path.join(registry.directory, "123.json"), "w") as f:
+        f.write("{broken")
+    assert "t_total 1" in lines(registry)
+
+
+def test_collectors(registry):
+    registry.register_collector(lambda: {"t_cache_hits_total": ("counter", "Hits", 10)})
+    registry.register_collector(lambda: 1 / 0)  # сбой сборщика не ломает /metrics
+    output = lines(registry)
+    assert "# TYPE t_cache_hits_total counter" in output
+    assert "t_cache_hits_total 10" in output
+
+
+def test_timed_records_duration(registry):
+    histogram = add(registry, Histogram("t_stage_seconds", "Stage", ("stage",)))
+
+    @timed(histogram, stage="save")
+    def work():
+        return "done"
+
+    assert work() == "done"
+    assert 't_stage_seconds_count{stage="save"} 1' in lines(registry)
+
+
+def test_shared_gauges_are_not_summed(registry):
+    depth = add(registry, Gauge("t_queue_depth", "Queue depth", aggregate="max"))
+    depth.set(5)
+    registry.register_collector(lambda: {"t_jobs_failed": ("gauge", "Failed jobs", 2, "max")})
+    write_process_file(registry, os.getppid(), {
+        "t_queue_depth": {"type": "gauge", "help": "Queue depth", "labelnames": [],
+                          "samples": [[[], 4]], "aggregate": "max"},
+        "t_jobs_failed": {"type": "gauge", "help": "Failed jobs", "labelnames": [],
+                          "samples": [[[], 2]], "aggregate": "max"},
+    })
+    output = lines(registry)
+    assert "t_queue_depth 5" in output
+    assert "t_jobs_failed 2" in output
+
+
+def test_unknown_gauge_aggregation_is_rejected():
+    with pytest.raises(ValueError):
+        Gauge("t_bad", "Bad", aggregate="avg")
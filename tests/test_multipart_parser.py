@@ -0,0 +1,130 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from multipart_parser import (
+    MAX_PART_HEADERS_SIZE, FileTooLargeError, MultipartError, MultipartReader, save_part_to_temp
+)
+
+BOUNDARY = "----boundary42"
+
+
+def build_body(parts, boundary=BOUNDARY, preamble=b"", epilogue=b"") -> bytes:
+    """Собирает multipart тело из списка (name, filename, data)."""
+    body = bytearray(preamble)
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if filename is not None:
+            body += b"Content-Type: image/png\r\n"
+        body += b"\r\n" + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode() + epilogue
+    return bytes(body)
+
+
+def parse(body: bytes, chunk_size: int, boundary=BOUNDARY) -> list:
+    reader = MultipartReader(io.BytesIO(body), boundary, len(body), chunk_size=chunk_size)
+    return [(part.name, part.filename, b"".join(part.iter_chunks())) for part in reader]
+
+
+# Данные содержат почти-boundary: CRLF, "--" и префиксы разделителя
+TRICKY = b"\r\n--" + BOUNDARY[:-1].encode() + b"x\r\n-\r\n--\r" + bytes(range(256))
+PARTS = [
+    ("title", None, b"hello"),
+    ("file", "a.png", TRICKY),
+    ("empty", "b.png", b""),
+    ("file", "c.png", b"-" * 300),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, len(BOUNDARY) - 1, len(BOUNDARY) + 3, 64, 65536])
+def test_parts_survive_any_chunk_boundary(chunk_size):
+    body = build_body(PARTS)
+    assert parse(body, chunk_size) == PARTS
+
+
+def test_delimiter_split_at_every_offset():
+    # Каждый возможный разрез тела на два чтения, в том числе посреди "\r\n--boundary"
+    body = build_body([("file", "a.png", b"abc" * 10)])
+    for chunk_size in range(1, len(body) + 1):
+        assert parse(body, chunk_size) == [("file", "a.png", b"abc" * 10)], chunk_size
+
+
+def test_preamble_and_epilogue_are_ignored():
+    body = build_body([("a", None, b"1")], preamble=b"ignored preamble\r\n", epilogue=b"trailer")
+    assert parse(body, 5) == [("a", None, b"1")]
+
+
+def test_unread_part_is_skipped():
+    body = build_body([("a", None, b"x" * 1000), ("b", None, b"y")])
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, len(body), chunk_size=16)
+    names = [part.name for part in reader]
+    assert names == ["a", "b"]
+
+
+def test_part_headers_are_parsed():
+    body = build_body([("file", "photo.png", b"data")])
+    part = next(iter(MultipartReader(io.BytesIO(body), BOUNDARY, len(body))))
+    assert part.content_type == "image/png"
+    assert part.headers["content-disposition"].startswith("form-data")
+
+
+def test_truncated_body_is_an_error():
+    body = build_body([("a", None, b"data")])
+    reader = MultipartReader(io.BytesIO(body[:20]), BOUNDARY, len(body), chunk_size=8)
+    with pytest.raises(MultipartError):
+        list(reader)
+
+
+def test_missing_closing_boundary_is_an_error():
+    body = f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\ndata".encode()
+    with pytest.raises(MultipartError):
+        parse(body, 4)
+
+
+def test_oversized_part_headers_are_rejected():
+    body = f"--{BOUNDARY}\r\nX-Big: ".encode() + b"a" * (MAX_PART_HEADERS_SIZE + 10)
+    with pytest.raises(MultipartError, match="too large"):
+        parse(body, 1024)
+
+
+def test_read_limits_form_field_size():
+    body = build_body([("title", None, b"x" * 100)])
+    part = next(iter(MultipartReader(io.BytesIO(body), BOUNDARY, len(body), chunk_size=10)))
+    with pytest.raises(MultipartError):
+        part.read(50)
+
+
+def test_discard_remaining_respects_limit():
+    body = build_body([("a", None, b"1")], epilogue=b"z" * 100)
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, len(body), chunk_size=8)
+    list(reader)
+    assert reader.bytes_remaining > 0
+    assert not reader.discard_remaining(limit=10)
+    assert reader.discard_remaining()
+    assert reader.bytes_remaining == 0
+
+
+def test_save_part_to_temp_hashes_content(tmp_path):
+    data = os.urandom(5000)
+    body = build_body([("file", "a.png", data)])
+    part = next(iter(MultipartReader(io.BytesIO(body), BOUNDARY, len(body), chunk_size=100)))
+    uploaded = save_part_to_temp(part, str(tmp_path), max_size=10000)
+    assert uploaded.size == len(data)
+    assert uploaded.sha256 == hashlib.sha256(data).hexdigest()
+    with open(uploaded.path, "rb") as f:
+        assert f.read() == data
+    uploaded.discard()
+    assert not os.path.exists(uploaded.path)
+
+
+def test_save_part_to_temp_removes_file_over_limit(tmp_path):
+    body = build_body([("file", "a.png", b"x" * 5000)])
+    part = next(iter(MultipartReader(io.BytesIO(body), BOUNDARY, len(body), chunk_size=100)))
+    with pytest.raises(FileTooLargeError):
+        save_part_to_temp(part, str(tmp_path), max_size=1000)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from image_processing import dhash
+from near_duplicates import (
+    CHUNKS, MAX_SIMILAR_DISTANCE, SimilarParamsError, _chunk, _neighbours, image_phash,
+    parse_distance, similar_query, to_db,
+)
+
+
+def test_chunks_split_hash_from_high_bits():
+    phash = 0x0123_4567_89AB_CDEF
+    assert [_chunk(phash, index) for index in range(CHUNKS)] == [0x0123, 0x4567, 0x89AB, 0xCDEF]
+
+
+def test_neighbours():
+    assert _neighbours(0b101, 0) == [0b101]
+    values = _neighbours(0, 1)
+    assert len(values) == 17 and len(set(values)) == 17
+    assert sorted(values[1:]) == [1 << bit for bit in range(16)]
+    # 1 + C(16, 1) + C(16, 2)
+    assert len(set(_neighbours(0xFFFF, 2))) == 1 + 16 + 120
+
+
+def test_candidates_cover_every_hash_within_distance():
+    rng = random.Random(0)
+    for distance in range(0, 8):
+        radius = distance // CHUNKS
+        for _ in range(200):
+            phash = rng.getrandbits(64)
+            other = phash
+            for bit in rng.sample(range(64), distance):
+                other ^= 1 << bit
+            # Хотя бы одна часть другого хеша попадает в значения, перебираемые по индексу
+            assert any(_chunk(other, index) in _neighbours(_chunk(phash, index), radius)
+                       for index in range(CHUNKS))
+
+
+def test_to_db_round_trip():
+    assert to_db(5) == 5
+    assert to_db((1 << 64) - 1) == -1
+    assert to_db(1 << 63) == -(1 << 63)
+    assert to_db(0xF000_0000_0000_0001) & ((1 << 64) - 1) == 0xF000_0000_0000_0001
+
+
+def test_similar_query_uses_chunk_indexes_for_small_radius():
+    phash = 0xFFFF_0000_1234_8000
+    sql, params = similar_query(phash, 4, 10, exclude_id=3)
+    assert sql.count("= ANY(%s::bigint[])") == CHUNKS
+    assert params[:3] == [to_db(phash), to_db(phash), 4]
+    assert params[3] == _neighbours(0xFFFF, 1)
+    assert params[-2:] == [3, 10]
+
+    # При большом радиусе - только точное расстояние
+    sql, params = similar_query(phash, 12, 10)
+    assert "ANY" not in sql and "id <>" not in sql
+    assert params == [to_db(phash), to_db(phash), 12, 10]
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, sql, params):
+        self.params = params
+
+    def fetchone(self):
+        return self.row
+
+
+def test_image_phash_converts_to_unsigned():
+    assert image_phash(FakeCursor(None), 1) == (False, None)
+    assert image_phash(FakeCursor((None,)), 1) == (True, None)
+    assert image_phash(FakeCursor((-1,)), 1) == (True, (1 << 64) - 1)
+
+
+def test_parse_distance():
+    assert parse_distance({}) == 4
+    assert parse_distance({"distance": ["0"]}) == 0
+    assert parse_distance({"distance": [str(MAX_SIMILAR_DISTANCE)]}) == MAX_SIMILAR_DISTANCE
+    for value in ("x", "-1", str(MAX_SIMILAR_DISTANCE + 1)):
+        with pytest.raises(SimilarParamsError):
+            parse_distance({"distance": [value]})
+
+
+def sample_image() -> Image.Image:
+    img = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((40, 30, 220, 210), fill="red")
+    draw.rectangle((250, 120, 380, 280), fill="navy")
+    draw.line((0, 300, 400, 0), fill="green", width=12)
+    return img
+
+
+def test_dhash_is_stable_for_resized_copy():
+    img = sample_image()
+    phash = dhash(img)
+    resized = img.resize((133, 100))
+    assert bin(phash ^ dhash(resized)).count("1") <= 4
+    flipped = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    assert bin(phash ^ dhash(flipped)).count("1") > 16
+    assert 0 <= phash < 1 << 64
@@ -0,0 +1,55 @@
+import base64
+import datetime
+
+import pytest
+
+from pagination import PaginationParamsError, decode_cursor, encode_cursor, parse_limit, parse_page
+
+
+@pytest.mark.parametrize("upload_time", [
+    datetime.datetime(2024, 1, 2, 3, 4, 5),
+    datetime.datetime(2024, 1, 2, 3, 4, 5, 123456),
+    datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+    datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+])
+def test_cursor_round_trip(upload_time):
+    cursor = encode_cursor(upload_time, 42)
+    assert decode_cursor(cursor) == (upload_time, 42)
+
+
+def test_cursor_is_url_safe_without_padding():
+    for image_id in range(1, 50):
+        cursor = encode_cursor(datetime.datetime(2024, 5, 6, 7, 8, 9, image_id), image_id)
+        assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+        assert decode_cursor(cursor)[1] == image_id
+
+
+@pytest.mark.parametrize("cursor", [
+    "", "!!!", "not-base64@",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"2024-01-01T00:00:00|abc").decode(),
+    base64.urlsafe_b64encode(b"yesterday|1").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+    "é",
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(PaginationParamsError):
+        decode_cursor(cursor)
+
+
+def test_parse_limit():
+    assert parse_limit({}, 10, 100) == 10
+    assert parse_limit({"limit": ["25"]}, 10, 100) == 25
+    assert parse_limit({"limit": ["1000"]}, 10, 100) == 100
+    assert parse_limit({"limit": ["0"]}, 10, 100) == 1
+    assert parse_limit({"limit": ["-5"]}, 10, 100) == 1
+    with pytest.raises(PaginationParamsError):
+        parse_limit({"limit": ["ten"]}, 10, 100)
+
+
+def test_parse_page():
+    assert parse_page({}) == 1
+    assert parse_page({"page": ["3"]}) == 3
+    assert parse_page({"page": ["-2"]}) == 1
+    with pytest.raises(PaginationParamsError):
+        parse_page({"page": ["x"]})
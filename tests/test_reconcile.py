@@ -0,0 +1,90 @@
+import pytest
+
+from reconcile import (
+    RECONCILE_SAMPLE_SIZE, ReconcileReport, _check_orphan, _original_of, merge_sorted
+)
+from storage import LocalStorage
+
+
+def merge(stored, expected):
+    return [(obj and obj[0], exp and exp[0])
+            for obj, exp in merge_sorted(iter(stored), iter(expected))]
+
+
+def test_merge_sorted_pairs_equal_keys():
+    stored = [("a",), ("c",), ("d",), ("f",)]
+    expected = [("b",), ("c",), ("f",), ("g",)]
+    assert merge(stored, expected) == [
+        ("a", None), (None, "b"), ("c", "c"), ("d", None), ("f", "f"), (None, "g"),
+    ]
+
+
+@pytest.mark.parametrize("stored, expected, result", [
+    ([], [], []),
+    ([("a",)], [], [("a", None)]),
+    ([], [("a",)], [(None, "a")]),
+    ([("a",), ("b",)], [("a",), ("b",)], [("a", "a"), ("b", "b")]),
+])
+def test_merge_sorted_edge_cases(stored, expected, result):
+    assert merge(stored, expected) == result
+
+
+def test_merge_sorted_is_lazy():
+    consumed = []
+
+    def stored():
+        for key in ("a", "b", "c"):
+            consumed.append(key)
+            yield (key,)
+
+    merged = merge_sorted(stored(), iter([("a",)]))
+    assert next(merged) == (("a",), ("a",))
+    assert consumed == ["a"]
+
+
+def test_storage_scan_matches_byte_order_of_expected_keys(tmp_path):
+    # Порядок обхода хранилища совпадает с ORDER BY key COLLATE "C" (порядком байтов)
+    keys = ["ab/cd/x.png", "ab/cd/x.png.webp", "ab/cd-x.png", "ab/c.png", "Ab/z.png", "ab0.png"]
+    storage = LocalStorage(str(tmp_path))
+    for key in keys:
+        path = tmp_path / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    expected = [(key,) for key in sorted(keys, key=str.encode)]
+    pairs = list(merge_sorted(storage.iter_objects(), iter(expected)))
+    assert all(obj is not None and exp is not None for obj, exp in pairs)
+    assert len(pairs) == len(keys)
+
+
+@pytest.mark.parametrize("key, original", [
+    ("ab/cd/x.png.webp", "ab/cd/x.png"),
+    ("ab/cd/x.jpg.avif", "ab/cd/x.jpg"),
+    ("ab/cd/x.png", None),
+    ("ab/cd/x.webp", None),  # загруженный WebP - оригинал, а не вариант
+])
+def test_original_of(key, original):
+    assert _original_of(key) == original
+
+
+def test_report_keeps_limited_samples():
+    report = ReconcileReport()
+    for i in range(RECONCILE_SAMPLE_SIZE + 5):
+        report.add("orphan_files", f"{i}.png", 10)
+    data = report.as_dict()
+    assert data["counts"]["orphan_files"] == RECONCILE_SAMPLE_SIZE + 5
+    assert data["bytes"]["orphan_files"] == 10 * (RECONCILE_SAMPLE_SIZE + 5)
+    assert len(data["samples"]["orphan_files"]) == RECONCILE_SAMPLE_SIZE
+    assert "missing_files" not in data["samples"]
+
+
+@pytest.mark.parametrize("key, age, kind", [
+    ("ab/.upload-1.part", 7200, "stale_temp_files"),
+    ("ab/.upload-1.part", 10, None),
+    ("ab/cd/x.png", 10, "recent_files"),
+    ("ab/cd/x.png", 7200, "orphan_files"),
+])
+def test_check_orphan_classification(key, age, kind):
+    report = ReconcileReport()
+    _check_orphan(report, (key, 5, 10000 - age), now=10000, grace=3600, repair=False)
+    assert {name for name, count in report.counts.items() if count} == ({kind} if kind else set())
+    assert not any(report.repaired.values())
@@ -0,0 +1,164 @@
+import psycopg2
+import pytest
+from psycopg2 import errors
+
+import readiness
+import schema
+from readiness import ReadinessMonitor
+from schema import Migration, migrate
+
+
+class FakeCursor:
+    """Курсор с таблицей schema_migrations в памяти."""
+
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.db.statements.append(" ".join(sql.split()))
+        if "MAX(version)" in sql:
+            if self.db.versions is None:
+                raise errors.UndefinedTable("relation \"schema_migrations\" does not exist")
+            self.result = (max(self.db.versions, default=0),)
+        elif "CREATE TABLE IF NOT EXISTS schema_migrations" in sql:
+            if self.db.versions is None:
+                self.db.versions = []
+        elif "INSERT INTO schema_migrations" in sql:
+            self.db.versions.append(params[0])
+        elif sql == "SELECT 1":
+            if self.db.fail_select:
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            self.result = (1,)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    def __init__(self, versions=None):
+        self.versions = versions
+        self.statements = []
+        self.connections = []
+        self.fail_select = False
+        self.fail_connect = False
+
+    def connect(self, **config):
+        if self.fail_connect:
+            raise psycopg2.OperationalError("could not connect to server")
+        self.config = config
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(schema.psycopg2, "connect", db.connect)
+    return db
+
+
+def migrations(applied):
+    return [Migration(version, f"step {version}", lambda version=version: applied.append(version))
+            for version in (2, 1, 3)]
+
+
+def test_fresh_database_applies_all_migrations_in_order(db):
+    applied = []
+    assert migrate({}, migrations(applied)) == {"version": 3, "applied": [1, 2, 3]}
+    assert applied == [1, 2, 3] and db.versions == [1, 2, 3]
+    assert "SELECT pg_advisory_lock(%s)" in db.statements
+    assert db.statements[-1] == "SELECT pg_advisory_unlock(%s)"
+    assert all(conn.closed for conn in db.connections)
+
+
+def test_up_to_date_schema_takes_one_query(db):
+    db.versions = [1, 2, 3]
+    applied = []
+    assert migrate({}, migrations(applied)) == {"version": 3, "applied": []}
+    assert applied == [] and len(db.statements) == 1
+
+
+def test_only_newer_migrations_are_applied(db):
+    db.versions = [1]
+    applied = []
+    assert migrate({}, migrations(applied)) == {"version": 3, "applied": [2, 3]}
+    assert applied == [2, 3]
+
+
+def test_failed_migration_is_not_recorded(db):
+    db.versions = []
+
+    def broken():
+        raise RuntimeError("DDL failed")
+
+    with pytest.raises(RuntimeError):
+        migrate({}, [Migration(1, "ok", lambda: None), Migration(2, "broken", broken)])
+    assert db.versions == [1]
+    assert db.statements[-1] == "SELECT pg_advisory_unlock(%s)"
+
+
+@pytest.fixture
+def readiness_db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(readiness.psycopg2, "connect", db.connect)
+    return db
+
+
+def test_readiness_reuses_connection_and_reconnects(readiness_db):
+    monitor = ReadinessMonitor({"host": "db"}, timeout=2)
+    assert monitor.check()
+    assert monitor.check()
+    assert len(readiness_db.connections) == 1
+    assert readiness_db.config["connect_timeout"] == 2
+    assert readiness_db.config["options"] == "-c statement_timeout=2000"
+
+    # Разорванное подключение открывается заново в той же проверке
+    readiness_db.connections[0].closed = True
+    assert monitor.check()
+    assert len(readiness_db.connections) == 2
+
+
+def test_readiness_reports_failures(readiness_db):
+    prepared = [False, True]
+    monitor = ReadinessMonitor({}, prepare=lambda: prepared.pop(0))
+    assert not monitor.check()
+    assert monitor._state["error"] == "Database schema is not up to date"
+    assert monitor.check()
+    readiness_db.fail_connect = True
+    monitor._conn.closed = True
+    assert not monitor.check()
+    assert monitor._state["database"] == "disconnected"
+    assert monitor._state["failures"] == 2 and monitor._state["checks"] == 3
+
+
+def test_readiness_status(readiness_db, monkeypatch):
+    monitor = ReadinessMonitor({}, interval=1, timeout=1)
+    monkeypatch.setattr(monitor, "ensure_started", lambda: None)
+    monitor.check()
+    ready, state = monitor.status()
+    assert ready and state["database"] == "connected" and "checked_ago" in state
+
+    monitor._state["checked_at"] -= 10
+    ready, state = monitor.status()
+    assert not ready and state["error"] == "Readiness check result is stale"
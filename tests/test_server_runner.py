@@ -0,0 +1,104 @@
+import http.client
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import server_runner
+from server_runner import OVERLOADED_RESPONSE, BoundedThreadPoolServer
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    release = threading.Event()
+
+    def do_GET(self):
+        if self.path == "/slow":
+            self.release.wait(5)
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_in_flight(server):
+    while server.in_flight == 0:
+        time.sleep(0.005)
+
+
+def get(server, path, timeout=5):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_overloaded_response_is_valid_http():
+    head, _, body = OVERLOADED_RESPONSE.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 503")
+    assert f"Content-Length: {len(body)}".encode() in head
+
+
+def test_requests_are_served_concurrently():
+    SlowHandler.release.clear()
+    server = BoundedThreadPoolServer(("127.0.0.1", 0), SlowHandler, threads=4, max_in_flight=4)
+    start(server)
+    try:
+        slow = threading.Thread(target=get, args=(server, "/slow"))
+        slow.start()
+        # Медленный запрос не блокирует остальные
+        assert get(server, "/fast") == (200, b"/fast")
+        SlowHandler.release.set()
+        slow.join(5)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert server.in_flight == 0
+
+
+def test_requests_over_limit_get_503(monkeypatch):
+    monkeypatch.setattr(server_runner, "IN_FLIGHT_WAIT", 0.05)
+    SlowHandler.release.clear()
+    server = BoundedThreadPoolServer(("127.0.0.1", 0), SlowHandler, threads=2, max_in_flight=1)
+    start(server)
+    try:
+        slow = threading.Thread(target=get, args=(server, "/slow"))
+        slow.start()
+        wait_in_flight(server)
+        status, _body = get(server, "/fast")
+        assert status == 503
+        SlowHandler.release.set()
+        slow.join(5)
+        assert get(server, "/fast") == (200, b"/fast")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_drain_waits_for_in_flight_requests():
+    SlowHandler.release.clear()
+    server = BoundedThreadPoolServer(("127.0.0.1", 0), SlowHandler, threads=2, max_in_flight=2)
+    start(server)
+    results = []
+    slow = threading.Thread(target=lambda: results.append(get(server, "/slow")))
+    slow.start()
+    wait_in_flight(server)
+    server.shutdown()
+    assert not server.drain(timeout=0.05)
+    SlowHandler.release.set()
+    assert server.drain(timeout=5)
+    slow.join(5)
+    assert results == [(200, b"/slow")]
+    server.socket.close()
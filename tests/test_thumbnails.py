@@ -0,0 +1,106 @@
+import os
+
+import pytest
+from PIL import Image
+
+from thumbnails import (
+    THUMBNAIL_DEFAULT_WIDTH, ThumbnailCache, ThumbnailParamsError, derivatives_dir,
+    parse_thumbnail_params, remove_derivatives, render_thumbnail, thumbnail_url
+)
+
+
+def make_image(path, size=(800, 400), mode="RGB", fmt="PNG"):
+    Image.new(mode, size, color=0).save(path, format=fmt)
+    return str(path)
+
+
+def test_parse_thumbnail_params_defaults():
+    assert parse_thumbnail_params({}, ".png") == (THUMBNAIL_DEFAULT_WIDTH, "png")
+    assert parse_thumbnail_params({}, ".gif") == (THUMBNAIL_DEFAULT_WIDTH, "png")
+    assert parse_thumbnail_params({}, ".jpg") == (THUMBNAIL_DEFAULT_WIDTH, "jpeg")
+    assert parse_thumbnail_params({"w": ["640"], "fmt": ["WEBP"]}, ".jpg") == (640, "webp")
+
+
+@pytest.mark.parametrize("query", [{"w": ["abc"]}, {"w": ["161"]}, {"w": ["0"]}, {"fmt": ["bmp"]}])
+def test_parse_thumbnail_params_rejects(query):
+    with pytest.raises(ThumbnailParamsError):
+        parse_thumbnail_params(query, ".jpg")
+
+
+def test_thumbnail_url():
+    assert thumbnail_url("ab/cd/x.png") == f"/images/ab/cd/x.png?w={THUMBNAIL_DEFAULT_WIDTH}&fmt=webp"
+
+
+def test_render_thumbnail_keeps_aspect_ratio(tmp_path):
+    source = make_image(tmp_path / "src.png", mode="P")
+    target = str(tmp_path / "out" / "w160.jpg")
+    size = render_thumbnail(source, target, 160, "jpeg")
+    assert size == os.path.getsize(target)
+    with Image.open(target) as img:
+        assert img.size == (160, 80)
+        assert img.format == "JPEG"
+    # Временных файлов не остается
+    assert os.listdir(tmp_path / "out") == ["w160.jpg"]
+
+
+def test_render_thumbnail_does_not_upscale(tmp_path):
+    source = make_image(tmp_path / "src.png", size=(100, 50))
+    target = str(tmp_path / "w320.png")
+    render_thumbnail(source, target, 320, "png")
+    with Image.open(target) as img:
+        assert img.size == (100, 50)
+
+
+def test_render_thumbnail_fails_on_corrupt_source(tmp_path):
+    source = tmp_path / "bad.png"
+    source.write_bytes(b"not an image")
+    with pytest.raises(Exception):
+        render_thumbnail(str(source), str(tmp_path / "out" / "w160.png"), 160, "png")
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_cache_hits_and_invalidation(tmp_path):
+    source = make_image(tmp_path / "src.png")
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    path = cache.get_or_create(source, "ab/cd/src.png", 160, "png")
+    assert os.path.exists(path)
+    assert cache.get_or_create(source, "ab/cd/src.png", 160, "png") == path
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["entries"]) == (1, 1, 1)
+
+    cache.invalidate("ab/cd/src.png")
+    assert not os.path.exists(path)
+    assert cache.stats()["bytes"] == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    source = make_image(tmp_path / "src.png")
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    first = cache.get_or_create(source, "a.png", 160, "png")
+    second = cache.get_or_create(source, "b.png", 160, "png")
+    cache.get_or_create(source, "a.png", 160, "png")  # a становится самым свежим
+
+    cache.max_bytes = os.path.getsize(first)
+    with cache._lock:
+        cache._evict()
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_index_is_restored_from_disk(tmp_path):
+    source = make_image(tmp_path / "src.png")
+    cache_dir = str(tmp_path / "cache")
+    path = ThumbnailCache(cache_dir).get_or_create(source, "a.png", 320, "webp")
+    restored = ThumbnailCache(cache_dir)
+    assert restored.stats()["entries"] == 1
+    assert restored.get_or_create(source, "a.png", 320, "webp") == path
+    assert restored.stats()["hits"] == 1
+
+
+def test_remove_derivatives_without_index(tmp_path):
+    source = make_image(tmp_path / "src.png")
+    cache_dir = str(tmp_path / "cache")
+    ThumbnailCache(cache_dir).get_or_create(source, "a.png", 160, "png")
+    remove_derivatives("a.png", cache_dir)
+    assert not os.path.exists(derivatives_dir("a.png", cache_dir))
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from PIL import Image
+
+from transcoding import Transcoder, negotiate, parse_accept, transcode_image, variant_key
+
+VARIANTS = {
+    "webp": ("a.png.webp", 700, 1000),
+    "avif": ("a.png.avif", 500, 1000),
+}
+
+
+def test_parse_accept():
+    header = "image/avif;q=0.9, IMAGE/WEBP , image/apng;q=0, image/*;q=0.8, */*;q=0.5"
+    assert parse_accept(header) == {"image/avif", "image/webp", "image/*", "*/*"}
+    assert parse_accept("image/webp;q=abc") == set()
+    assert parse_accept("image/webp; charset=x; q=1") == {"image/webp"}
+    assert parse_accept("image/webp,,") == {"image/webp"}
+    assert parse_accept("") == set()
+    assert parse_accept(None) == set()
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("image/avif,image/webp,*/*", "avif"),
+    ("image/webp,*/*", "webp"),
+    ("image/avif;q=0,image/webp", "webp"),
+    # Маски не означают поддержку конкретного формата
+    ("image/*,*/*;q=0.8", None),
+    ("", None),
+])
+def test_negotiate_picks_smallest_accepted_variant(accept, expected):
+    assert negotiate(accept, VARIANTS) == expected
+
+
+def test_negotiate_without_variants():
+    assert negotiate("image/avif,image/webp", {}) is None
+
+
+def test_variant_key():
+    assert variant_key("ab/cd/x.png", "webp") == "ab/cd/x.png.webp"
+    assert variant_key("ab/cd/x.png", "avif") == "ab/cd/x.png.avif"
+
+
+def test_accepted_formats():
+    transcoder = Transcoder(None, None, None, formats=["webp", "avif", "bogus"])
+    assert transcoder.configured_formats == ["webp", "avif"]
+    assert transcoder.accepted_formats("image/avif,image/webp") == ["webp", "avif"]
+    assert transcoder.accepted_formats("image/*") == []
+    assert Transcoder(None, None, None, formats=[]).accepted_formats("image/webp") == []
+
+
+@pytest.mark.parametrize("fmt, pil_format", [("webp", "WEBP"), ("avif", "AVIF")])
+def test_transcode_image(tmp_path, fmt, pil_format):
+    source = tmp_path / "src.png"
+    Image.new("P", (64, 32)).save(source)
+    dest = tmp_path / f"out.{fmt}"
+    size = transcode_image(str(source), str(dest), fmt, 60)
+    assert size == os.path.getsize(dest)
+    with Image.open(dest) as img:
+        assert img.format == pil_format
+        assert img.size == (64, 32)
+
+
+def test_animated_images_are_not_transcoded(tmp_path):
+    source = tmp_path / "anim.gif"
+    frames = [Image.new("RGB", (16, 16), color) for color in ("red", "blue")]
+    frames[0].save(source, save_all=True, append_images=frames[1:])
+    assert transcode_image(str(source), str(tmp_path / "out.webp"), "webp", 80) is None
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = 0
+
+    def execute(self, sql, params=None):
+        self.executed += 1
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_variants_lookup_is_cached():
+    cursor = FakeCursor([("webp", "a.png.webp", 700, 1000), ("jxl", "a.png.jxl", 1, 1000)])
+    transcoder = Transcoder(None, None, lambda: FakeConnection(cursor), formats=["webp"])
+    assert transcoder.variants("a.png") == {"webp": ("a.png.webp", 700, 1000)}
+    assert transcoder.variants("a.png") == {"webp": ("a.png.webp", 700, 1000)}
+    assert cursor.executed == 1
+    assert Transcoder(None, None, None, formats=[]).variants("a.png") == {}
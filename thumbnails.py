@@ -0,0 +1,223 @@
+"""
+Генерация уменьшенных копий изображений с дисковым кешем производных файлов.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки кеша производных (переопределяются переменными окружения)
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", "/app/cache/thumbnails")
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get("THUMBNAIL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+THUMBNAIL_WIDTHS = (160, 320, 640, 1280)  # фиксированный набор - кеш нельзя "взорвать" перебором w
+THUMBNAIL_DEFAULT_WIDTH = 160  # превью 64px в таблице с запасом для HiDPI
+THUMBNAIL_QUALITY = 80
+
+# Формат производного файла -> (формат Pillow, расширение, MIME-тип)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "jpg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+
+class ThumbnailParamsError(ValueError):
+    """Некорректные параметры запроса уменьшенной копии."""
+
+
+def parse_thumbnail_params(query: dict, source_ext: str) -> tuple:
+    """Проверяет параметры w и fmt из query string. Возвращает (ширина, формат)."""
+    try:
+        width = int(query.get("w", [THUMBNAIL_DEFAULT_WIDTH])[0])
+    except ValueError:
+        raise ThumbnailParamsError("Parameter 'w' must be an integer")
+    if width not in THUMBNAIL_WIDTHS:
+        raise ThumbnailParamsError(
+            f"Unsupported width. Allowed: {', '.join(str(w) for w in THUMBNAIL_WIDTHS)}"
+        )
+
+    default_fmt = "png" if source_ext in (".png", ".gif") else "jpeg"
+    fmt = query.get("fmt", [default_fmt])[0].lower()
+    if fmt not in THUMBNAIL_FORMATS:
+        raise ThumbnailParamsError(f"Unsupported format. Allowed: {', '.join(THUMBNAIL_FORMATS)}")
+    return width, fmt
+
+
+def thumbnail_url(filename: str, width: int = THUMBNAIL_DEFAULT_WIDTH, fmt: str = "webp") -> str:
+    """URL уменьшенной копии для ответа /images-list."""
+    return f"/images/{filename}?w={width}&fmt={fmt}"
+
+
+def render_thumbnail(source_path: str, path: str, width: int, fmt: str) -> int:
+    """Уменьшает изображение и атомарно записывает результат. Возвращает размер файла."""
+    from PIL import Image  # выполняется в процессе пула; сервер Pillow не импортирует
+
+    pil_format = THUMBNAIL_FORMATS[fmt][0]
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    with Image.open(source_path) as img:
+        img.draft("RGB", (width, width * 4))  # JPEG декодируется сразу в уменьшенном масштабе
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode == "P":
+            img = img.convert("RGBA")
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".thumb-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format=pil_format, quality=THUMBNAIL_QUALITY, optimize=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+    return os.path.getsize(path)
+
+
+def derivatives_dir(filename: str, cache_dir: str = THUMBNAIL_DIR) -> str:
+    """Каталог производных одного исходного файла (шардирован по хешу имени)."""
+    shard = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:2]
+    return os.path.join(cache_dir, shard, filename)
+
+
+def remove_derivatives(filename: str, cache_dir: str = THUMBNAIL_DIR) -> None:
+    """
+    Удаляет производные файла с диска без индекса ThumbnailCache - для скриптов,
+    которые меняют файлы, но не создают уменьшенные копии (reconcile, миграция).
+    """
+    shutil.rmtree(derivatives_dir(filename, cache_dir), ignore_errors=True)
+
+
+class ThumbnailCache:
+    """Дисковый кеш производных с вытеснением LRU по суммарному размеру."""
+
+    def __init__(self, cache_dir: str = THUMBNAIL_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 processor=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.processor = processor  # ImageProcessor; без него уменьшение идет в текущем потоке
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # путь -> размер, от самых старых к самым свежим
+        self._total_bytes = 0
+        self._pending = {}  # путь -> Event для объединения одинаковых запросов
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """Восстанавливает индекс кеша с диска, упорядочивая файлы по времени доступа."""
+        found = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_atime, path, stat.st_size))
+        for _atime, path, size in sorted(found):
+            self._entries[path] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _source_dir(self, filename: str) -> str:
+        return derivatives_dir(filename, self.cache_dir)
+
+    def variant_path(self, filename: str, width: int, fmt: str) -> str:
+        """Путь производного файла: ключ - исходное имя и параметры."""
+        ext = THUMBNAIL_FORMATS[fmt][1]
+        return os.path.join(self._source_dir(filename), f"w{width}{ext}")
+
+    def get_or_create(self, source_path: str, filename: str, width: int, fmt: str) -> str:
+        """Возвращает путь к производному файлу, создавая его при необходимости."""
+        path = self.variant_path(filename, width, fmt)
+
+        while True:
+            with self._lock:
+                if path in self._entries and os.path.exists(path):
+                    self._entries.move_to_end(path)
+                    self._stats["hits"] += 1
+                    return path
+                if path not in self._entries and os.path.exists(path):
+                    # Вариант создан другим процессом - учитываем его в своем индексе
+                    size = os.path.getsize(path)
+                    self._entries[path] = size
+                    self._total_bytes += size
+                    self._stats["hits"] += 1
+                    self._evict()
+                    return path
+                event = self._pending.get(path)
+                if event is None:
+                    # Этот поток будет генерировать вариант; остальные подождут его
+                    event = threading.Event()
+                    self._pending[path] = event
+                    self._stats["misses"] += 1
+                    break
+                self._stats["coalesced"] += 1
+            event.wait()
+            # Генерация могла завершиться ошибкой - тогда повторяем попытку сами
+
+        try:
+            if self.processor is not None:
+                size = self.processor.run(render_thumbnail, source_path, path, width, fmt)
+            else:
+                size = render_thumbnail(source_path, path, width, fmt)
+            with self._lock:
+                if path in self._entries:
+                    self._total_bytes -= self._entries.pop(path)
+                self._entries[path] = size
+                self._total_bytes += size
+                self._evict()
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+            event.set()
+
+    def _evict(self) -> None:
+        """Удаляет самые давно использованные варианты, пока кеш больше лимита. Вызывать под блокировкой."""
+        while self._total_bytes > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, filename: str) -> None:
+        """Удаляет все производные исходного файла (после его удаления)."""
+        directory = self._source_dir(filename)
+        with self._lock:
+            prefix = directory + os.sep
+            for path in [p for p in self._entries if p.startswith(prefix)]:
+                self._total_bytes -= self._entries.pop(path)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self) -> dict:
+        """Статистика кеша для мониторинга."""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            })
+        return data
@@ -0,0 +1,280 @@
+"""
+Перекодирование загруженных изображений в WebP/AVIF (задача "transcode" очереди
+job_queue) и выбор варианта по заголовку Accept. Вариант хранится рядом с оригиналом (<ключ оригинала>.webp)
+и сохраняется, только если он заметно меньше оригинала.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from content_store import count_references, lock_blob
+from logger_config import get_logger
+
+logger = get_logger()
+
+# Настройки (переопределяются переменными окружения)
+# Форматы вариантов через запятую; пустая строка отключает перекодирование
+TRANSCODE_FORMATS = [fmt for fmt in os.environ.get("TRANSCODE_FORMATS", "webp,avif").split(",")
+                     if fmt.strip()]
+TRANSCODE_WEBP_QUALITY = int(os.environ.get("TRANSCODE_WEBP_QUALITY", "80"))
+TRANSCODE_AVIF_QUALITY = int(os.environ.get("TRANSCODE_AVIF_QUALITY", "60"))
+TRANSCODE_MIN_SAVING = float(os.environ.get("TRANSCODE_MIN_SAVING", "0.1"))  # доля от оригинала
+VARIANT_LOOKUP_TTL = float(os.environ.get("VARIANT_LOOKUP_TTL", "30"))  # секунды
+VARIANT_LOOKUP_MAX_ENTRIES = 10000
+
+# Формат варианта -> (формат Pillow, расширение, MIME-тип)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "avif": ("AVIF", ".avif", "image/avif"),
+}
+
+VARIANTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS image_variants (
+        filename TEXT NOT NULL,
+        format TEXT NOT NULL,
+        key TEXT,
+        size INTEGER NOT NULL,
+        original_size INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (filename, format)
+    );
+
+    CREATE OR REPLACE TRIGGER trg_image_variants_notify_change
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON image_variants
+        FOR EACH STATEMENT EXECUTE FUNCTION images_notify_change();
+"""
+
+
+def variant_key(filename: str, fmt: str) -> str:
+    """Ключ варианта в хранилище: ab/cd/<sha256>.png -> ab/cd/<sha256>.png.webp."""
+    return filename + VARIANT_FORMATS[fmt][1]
+
+
+def transcode_image(source_path: str, dest_path: str, fmt: str, quality: int):
+    """
+    Перекодирует изображение в формат варианта. Возвращает размер результата
+    или None, если изображение анимированное (такие не перекодируются).
+    """
+    from PIL import Image  # выполняется в процессе пула
+    with Image.open(source_path) as img:
+        if getattr(img, "n_frames", 1) > 1:
+            return None
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGB")
+        with open(dest_path, "wb") as f:
+            img.save(f, format=VARIANT_FORMATS[fmt][0], quality=quality)
+    return os.path.getsize(dest_path)
+
+
+def parse_accept(header: str) -> set:
+    """Явно перечисленные в Accept типы с ненулевым q (image/* и */* не считаются)."""
+    accepted = set()
+    for item in (header or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and media_type:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def negotiate(accept_header: str, variants: dict):
+    """
+    Выбирает самый маленький вариант из поддерживаемых клиентом.
+    variants: формат -> (ключ, размер, размер оригинала).
+    """
+    accepted = parse_accept(accept_header)
+    candidates = [(size, fmt) for fmt, (_key, size, _original_size) in variants.items()
+                  if VARIANT_FORMATS[fmt][2] in accepted]
+    return min(candidates)[1] if candidates else None
+
+
+class Transcoder:
+    """
+    Создает варианты оригиналов (в пуле процессов ImageProcessor) и отвечает
+    на вопрос, какие варианты есть у файла (с коротким кешем в памяти).
+    """
+
+    def __init__(self, processor, storage, connection_factory, formats: list = TRANSCODE_FORMATS,
+                 on_change=None):
+        self.processor = processor
+        self.storage = storage
+        self.connection_factory = connection_factory
+        self.configured_formats = [fmt for fmt in formats if fmt in VARIANT_FORMATS]
+        self._formats = None
+        self.on_change = on_change  # вызывается после записи вариантов (сброс кеша списка)
+        self.quality = {"webp": TRANSCODE_WEBP_QUALITY, "avif": TRANSCODE_AVIF_QUALITY}
+        self._lock = threading.Lock()
+        self._lookup = OrderedDict()  # имя файла -> (время, варианты из variants())
+        self._stats = {"completed": 0, "skipped": 0,
+                       "variants_stored": 0, "variants_not_smaller": 0, "bytes_saved_stored": 0}
+
+    @property
+    def formats(self) -> list:
+        """
+        Форматы, для которых в сборке Pillow есть кодировщик. Определяются при первом
+        обращении: Image.init() загружает все модули форматов Pillow (~0.1 с), а сервер
+        без перекодирования в TRANSCODE_FORMATS Pillow не импортирует вовсе.
+        """
+        if self._formats is None:
+            formats = []
+            if self.configured_formats:
+                from PIL import Image
+                Image.init()
+                formats = [fmt for fmt in self.configured_formats
+                           if VARIANT_FORMATS[fmt][0] in Image.SAVE]
+            self._formats = formats
+        return self._formats
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.formats)
+
+    @property
+    def serves_variants(self) -> bool:
+        """Могут ли у файлов быть варианты для выдачи (без проверки кодировщиков Pillow)."""
+        return bool(self.configured_formats)
+
+    def accepted_formats(self, accept_header: str) -> list:
+        """Настроенные форматы, которые клиент явно принимает; пустой список - варианты не нужны."""
+        if not self.configured_formats:
+            return []
+        accepted = parse_accept(accept_header)
+        return [fmt for fmt in self.configured_formats if VARIANT_FORMATS[fmt][2] in accepted]
+
+    def transcode(self, filename: str) -> dict:
+        """
+        Создает варианты файла во всех форматах. Возвращает {формат: размер результата}.
+        Ошибки пробрасываются: задачу повторит очередь, готовые варианты просто перезапишутся.
+        """
+        source_path = self.storage.local_path(filename)
+        if source_path is None:
+            with self._lock:
+                self._stats["skipped"] += 1
+            return {}
+        original_size = os.path.getsize(source_path)
+
+        results = {}
+        for fmt in self.formats:
+            fd, temp_path = tempfile.mkstemp(dir=self.storage.spool_dir, prefix=".variant-")
+            os.close(fd)
+            try:
+                size = self.processor.run(transcode_image, source_path, temp_path, fmt,
+                                          self.quality[fmt])
+                if size is None:
+                    continue
+                results[fmt] = size
+                self._store_variant(filename, fmt, temp_path, size, original_size)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        with self._lock:
+            self._stats["completed"] += 1
+            self._lookup.pop(filename, None)
+        if self.on_change is not None:
+            self.on_change()
+        return results
+
+    def _store_variant(self, filename: str, fmt: str, temp_path: str, size: int,
+                       original_size: int) -> None:
+        """
+        Сохраняет вариант, если он меньше оригинала хотя бы на TRANSCODE_MIN_SAVING,
+        и записывает его размер в image_variants (в том числе неудачный - чтобы не повторять).
+        """
+        worthwhile = size <= original_size * (1 - TRANSCODE_MIN_SAVING)
+        key = variant_key(filename, fmt) if worthwhile else None
+
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            try:
+                # Под блокировкой блоба: параллельное удаление оригинала не оставит "сирот"
+                lock_blob(cursor, filename)
+                if count_references(cursor, filename) == 0:
+                    conn.rollback()
+                    return
+                if key is not None:
+                    self.storage.put(temp_path, key, content_type=VARIANT_FORMATS[fmt][2])
+                cursor.execute("""
+                    INSERT INTO image_variants (filename, format, key, size, original_size)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (filename, format) DO UPDATE
+                    SET key = EXCLUDED.key, size = EXCLUDED.size,
+                        original_size = EXCLUDED.original_size, created_at = CURRENT_TIMESTAMP
+                """, (filename, fmt, key, size, original_size))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                if key is not None:
+                    self.storage.delete(key)
+                raise
+            finally:
+                cursor.close()
+
+        with self._lock:
+            if key is not None:
+                self._stats["variants_stored"] += 1
+                self._stats["bytes_saved_stored"] += original_size - size
+            else:
+                self._stats["variants_not_smaller"] += 1
+
+    def delete_variants(self, cursor, filename: str) -> list:
+        """
+        Удаляет записи о вариантах оригинала (в транзакции и под блокировкой блоба вызывающего).
+        Возвращает ключи их файлов: они удаляются из хранилища после commit.
+        """
+        cursor.execute("DELETE FROM image_variants WHERE filename = %s RETURNING key", (filename,))
+        keys = [key for (key,) in cursor.fetchall() if key is not None]
+        with self._lock:
+            self._lookup.pop(filename, None)
+        return keys
+
+    def variants(self, filename: str) -> dict:
+        """
+        Сохраненные варианты файла: {формат: (ключ, размер, размер оригинала)}.
+        Кешируется на VARIANT_LOOKUP_TTL.
+        """
+        if not self.serves_variants:
+            return {}
+        now = time.monotonic()
+        with self._lock:
+            cached = self._lookup.get(filename)
+            if cached is not None and now - cached[0] < VARIANT_LOOKUP_TTL:
+                self._lookup.move_to_end(filename)
+                return cached[1]
+
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT format, key, size, original_size FROM image_variants
+                WHERE filename = %s AND key IS NOT NULL
+            """, (filename,))
+            found = {fmt: (key, size, original_size)
+                     for fmt, key, size, original_size in cursor.fetchall()
+                     if fmt in VARIANT_FORMATS}
+            cursor.close()
+
+        with self._lock:
+            self._lookup[filename] = (now, found)
+            self._lookup.move_to_end(filename)
+            while len(self._lookup) > VARIANT_LOOKUP_MAX_ENTRIES:
+                self._lookup.popitem(last=False)
+        return found
+
+    def stats(self) -> dict:
+        """Статистика перекодирования для мониторинга."""
+        with self._lock:
+            data = dict(self._stats)
+        data["formats"] = list(self.formats)
+        return data
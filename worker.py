@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Исполнитель фоновых задач после загрузки (очередь job_queue в PostgreSQL).
+
+Задачи:
+    transcode  - варианты оригинала в WebP/AVIF (transcoding.py)
+    thumbnail  - уменьшенная копия для списка изображений в дисковом кеше
+
+Запуск: python worker.py (рядом с app.py, с тем же хранилищем и кешем уменьшенных копий).
+Можно запускать несколько исполнителей - лимиты JOB_CONCURRENCY общие для всех.
+"""
+
+import signal
+from functools import wraps
+
+from PIL import UnidentifiedImageError
+
+from image_processing import ImageProcessor
+from job_queue import JobQueue, JobWorker, PermanentJobError
+from logger_config import get_logger
+from services import DB_CONFIG, db_pool, get_db_connection, storage
+from thumbnails import THUMBNAIL_DEFAULT_WIDTH, ThumbnailCache
+from transcoding import Transcoder
+
+logger = get_logger()
+
+# Обработка изображений - в пуле процессов, как у сервера; кеш уменьшенных копий общий с ним
+image_processor = ImageProcessor()
+thumbnail_cache = ThumbnailCache(processor=image_processor)
+transcoder = Transcoder(image_processor, storage, get_db_connection)
+
+
+def image_job(func):
+    """Файл, который Pillow не может прочитать, не прочитается и при повторе."""
+    @wraps(func)
+    def wrapper(filename: str):
+        try:
+            return func(filename)
+        except UnidentifiedImageError as e:
+            raise PermanentJobError(str(e))
+    return wrapper
+
+
+@image_job
+def render_list_thumbnail(filename: str) -> None:
+    """Создает уменьшенную копию, на которую ссылается thumbnail_url в /images-list."""
+    source_path = storage.local_path(filename)
+    if source_path is None:
+        # Файл удален раньше, чем дошла очередь
+        return
+    thumbnail_cache.get_or_create(source_path, filename, THUMBNAIL_DEFAULT_WIDTH, "webp")
+
+
+@image_job
+def transcode(filename: str) -> None:
+    transcoder.transcode(filename)
+
+
+JOB_HANDLERS = {
+    "transcode": transcode,
+    "thumbnail": render_list_thumbnail,
+}
+
+
+def main() -> None:
+    handlers = dict(JOB_HANDLERS)
+    if not transcoder.enabled:
+        handlers.pop("transcode")
+
+    worker = JobWorker(JobQueue(db_pool.connection), handlers, DB_CONFIG)
+
+    def handle_signal(signum, frame):
+        logger.info("Stopping job worker after running jobs...")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    worker.start()
+    worker.join()
+    image_processor.shutdown()
+    logger.info(f"Job worker stopped: {worker.stats()}")
+
+
+if __name__ == "__main__":
+    main()